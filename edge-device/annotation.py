@@ -1,36 +1,234 @@
 import json
-from typing import Union, Tuple, List
+import os
+import shutil
+import tempfile
+import threading
+from typing import Union, Tuple, List, Dict, Any
+
+import numpy as np
+from pycocotools.coco import COCO
 
 from model import AnnotationView, Image, AnnotationsByImage
 
+CACHE_VERSION = 1
+CACHE_ARRAYS = [
+    'image_ids', 'image_file_names', 'image_ann_starts', 'image_ann_ends',
+    'ann_ids', 'ann_image_ids', 'ann_bboxes', 'ann_categories', 'ann_areas', 'ann_iscrowd',
+]
+
+
+class AnnotationStore:
+    annotations_path: str
+    source_key: Dict[str, int]
+    categories: List[Dict[str, Any]]
+    videos: Dict[str, Tuple[int, int]]
+
+    image_ids: Any
+    image_file_names: Any
+    image_ann_starts: Any
+    image_ann_ends: Any
+    ann_ids: Any
+    ann_image_ids: Any
+    ann_bboxes: Any
+    ann_categories: Any
+    ann_areas: Any
+    ann_iscrowd: Any
+
+    image_index: Dict[int, int]
+    coco_gt: Union[COCO, None]
+
+    def __init__(self, annotations_path: str, source_key: Dict[str, int], categories: List[Dict[str, Any]],
+                 videos: Dict[str, Tuple[int, int]], arrays: Dict[str, Any]):
+        self.annotations_path = annotations_path
+        self.source_key = source_key
+        self.categories = categories
+        self.videos = videos
+        for name in CACHE_ARRAYS:
+            setattr(self, name, arrays[name])
+
+        self.image_index = {image_id: idx for idx, image_id in enumerate(self.image_ids.tolist())}
+        self.coco_gt = None
+
+    @classmethod
+    def open(cls, annotations_path: str) -> "AnnotationStore":
+        source_key = _source_key(annotations_path)
+        cache_dir = _cache_dir(annotations_path)
+
+        store = _read_cache(annotations_path, cache_dir, source_key)
+        if store is None:
+            store = _build(annotations_path, source_key)
+            _write_cache(store, cache_dir)
+        return store
+
+    def load_video(self, video: str) -> Tuple[List[Image], AnnotationsByImage]:
+        images = self.images_of_video(video)
+
+        annotations = dict()
+        for image in images:
+            annotations[image.id] = self.annotations_of_image(image.id)
+
+        return images, annotations
+
+    def images_of_video(self, video: str) -> List[Image]:
+        video_name = video.split("/")[-2]
+        if video_name in self.videos:
+            start, end = self.videos[video_name]
+            indices = range(start, end)
+        else:
+            indices = [idx for idx, file_name in enumerate(self.image_file_names) if video_name in file_name]
+
+        return [Image(id=int(self.image_ids[idx]), file_name=str(self.image_file_names[idx])) for idx in indices]
+
+    def annotations_of_image(self, image_id: int) -> List[AnnotationView]:
+        idx = self.image_index.get(image_id)
+        if idx is None:
+            return []
+
+        start, end = int(self.image_ann_starts[idx]), int(self.image_ann_ends[idx])
+        bboxes = self.ann_bboxes[start:end].tolist()
+        categories = self.ann_categories[start:end].tolist()
+        return [AnnotationView(_to_number(x), _to_number(y), _to_number(w), _to_number(h), category)
+                for (x, y, w, h), category in zip(bboxes, categories)]
+
+    def coco(self) -> COCO:
+        if self.coco_gt is None:
+            coco_gt = COCO()
+            coco_gt.dataset = self._to_coco_dataset()
+            coco_gt.createIndex()
+            self.coco_gt = coco_gt
+        return self.coco_gt
+
+    def _to_coco_dataset(self) -> Dict[str, Any]:
+        images = [dict(id=image_id, file_name=file_name)
+                  for image_id, file_name in zip(self.image_ids.tolist(), self.image_file_names.tolist())]
+        annotations = [
+            dict(id=ann_id, image_id=image_id, bbox=[_to_number(value) for value in bbox], category_id=category,
+                 area=_to_number(area), iscrowd=iscrowd)
+            for ann_id, image_id, bbox, category, area, iscrowd in zip(
+                self.ann_ids.tolist(), self.ann_image_ids.tolist(), self.ann_bboxes.tolist(),
+                self.ann_categories.tolist(), self.ann_areas.tolist(), self.ann_iscrowd.tolist()
+            )
+        ]
+        return dict(images=images, annotations=annotations, categories=self.categories)
+
+
+_stores: Dict[str, AnnotationStore] = dict()
+_stores_lock = threading.Lock()
+
+
+def get_annotation_store(annotations_path: str) -> AnnotationStore:
+    with _stores_lock:
+        store = _stores.get(annotations_path)
+        if store is None or store.source_key != _source_key(annotations_path):
+            store = AnnotationStore.open(annotations_path)
+            _stores[annotations_path] = store
+        return store
+
 
 def annotations_available(video: Union[str, None], annotations_path: Union[str, None]) -> bool:
     return video is not None and annotations_path is not None
 
 
 def load_annotations(video, annotations_path) -> Tuple[List[Image], AnnotationsByImage]:
+    return get_annotation_store(annotations_path).load_video(video)
+
+
+def _build(annotations_path: str, source_key: Dict[str, int]) -> AnnotationStore:
+    print(f"Indexing annotations: {annotations_path}")
+
     with open(annotations_path) as annotations_file:
         annotations_json = json.load(annotations_file)
-        images = _to_images_of_video(annotations_json['images'], video)
-        images_sorted = sorted(images, key=lambda i: i.file_name)
-        image_ids = [image.id for image in images_sorted]
 
-        annotations = dict()
-        for image_id in image_ids:
-            image_annotations = [annotation for annotation in annotations_json['annotations']
-                                 if annotation['image_id'] == image_id]
+    images = sorted(annotations_json['images'], key=lambda i: i['file_name'])
+    image_ids = np.array([int(image['id']) for image in images], dtype=np.int64)
+    image_file_names = np.array([image['file_name'] for image in images], dtype=np.str_)
+
+    raw_annotations = annotations_json['annotations']
+    ann_image_ids = np.array([int(annotation['image_id']) for annotation in raw_annotations], dtype=np.int64)
+    order = np.argsort(ann_image_ids, kind='stable')
+    raw_annotations = [raw_annotations[idx] for idx in order]
+    ann_image_ids = ann_image_ids[order]
+
+    bboxes = np.array([annotation['bbox'] for annotation in raw_annotations], dtype=np.float64).reshape(-1, 4)
+    areas = [annotation['area'] if 'area' in annotation else w * h
+             for annotation, (_, _, w, h) in zip(raw_annotations, bboxes.tolist())]
+
+    arrays = dict(
+        image_ids=image_ids,
+        image_file_names=image_file_names,
+        image_ann_starts=np.searchsorted(ann_image_ids, image_ids, side='left').astype(np.int64),
+        image_ann_ends=np.searchsorted(ann_image_ids, image_ids, side='right').astype(np.int64),
+        ann_ids=np.array([int(annotation['id']) for annotation in raw_annotations], dtype=np.int64),
+        ann_image_ids=ann_image_ids,
+        ann_bboxes=bboxes,
+        ann_categories=np.array([int(annotation['category_id']) for annotation in raw_annotations], dtype=np.int32),
+        ann_areas=np.array(areas, dtype=np.float64),
+        ann_iscrowd=np.array([int(annotation.get('iscrowd', 0)) for annotation in raw_annotations], dtype=np.uint8),
+    )
+
+    videos = dict()
+    ambiguous = set()
+    for idx, file_name in enumerate(image_file_names.tolist()):
+        parts = file_name.replace("\\", "/").split("/")
+        video_name = parts[-2] if len(parts) > 1 else ""
+        start, end = videos.get(video_name, (idx, idx))
+        if end != idx:
+            ambiguous.add(video_name)
+        videos[video_name] = (start, idx + 1)
+    for video_name in ambiguous:
+        del videos[video_name]
+
+    categories = annotations_json.get('categories', [])
+    return AnnotationStore(annotations_path, source_key, categories, videos, arrays)
+
+
+def _read_cache(annotations_path: str, cache_dir: str, source_key: Dict[str, int]) -> Union[AnnotationStore, None]:
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        if meta['version'] != CACHE_VERSION or meta['source'] != source_key:
+            return None
+
+        arrays = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r') for name in CACHE_ARRAYS}
+    except (OSError, ValueError, KeyError):
+        return None
+
+    videos = {video: (start, end) for video, (start, end) in meta['videos'].items()}
+    return AnnotationStore(annotations_path, source_key, meta['categories'], videos, arrays)
+
+
+def _write_cache(store: AnnotationStore, cache_dir: str):
+    parent_dir = os.path.dirname(os.path.abspath(cache_dir))
+    try:
+        tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=".annotations-cache-")
+    except OSError as e:
+        print(f"Cannot cache annotations: {e}")
+        return
+
+    try:
+        for name in CACHE_ARRAYS:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(store, name))
+
+        meta = dict(version=CACHE_VERSION, source=store.source_key, categories=store.categories,
+                    videos=store.videos)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, cache_dir)
+    except OSError as e:
+        print(f"Cannot cache annotations: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _cache_dir(annotations_path: str) -> str:
+    return f"{annotations_path}.cache"
 
-            annotations[image_id] = []
-            for image_annotation in image_annotations:
-                (x, y, w, h) = image_annotation['bbox']
-                category = int(image_annotation['category_id'])
-                annotations[image_id].append(AnnotationView(x, y, w, h, category))
 
-        return images_sorted, annotations
+def _source_key(annotations_path: str) -> Dict[str, int]:
+    stat = os.stat(annotations_path)
+    return dict(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
 
 
-def _to_images_of_video(images, video) -> List[Image]:
-    video_name = video.split("/")[-2]
-    images = [image for image in images
-              if video_name in image['file_name']]
-    return [Image(id=int(image['id']), file_name=image['file_name']) for image in images]
+def _to_number(value: float) -> Union[int, float]:
+    return int(value) if value.is_integer() else value
@@ -1,15 +1,12 @@
-from typing import List
+import numpy as np
 
 
-def xyxy2xywh(xyxy_bbox: List[float]) -> List[float]:
-    bbox = xyxy_bbox
-    return [bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]]
+def xyxy2xywh(xyxy_bboxes):
+    bboxes = np.array(xyxy_bboxes, dtype=np.float64).reshape(-1, 4)
+    bboxes[:, 2:4] -= bboxes[:, 0:2]
+    return bboxes
 
 
-def scale(bbox: List[float], scale_width: float, scale_height: float) -> List[int]:
-    return [
-        int(bbox[0] * scale_width),
-        int(bbox[1] * scale_height),
-        int(bbox[2] * scale_width),
-        int(bbox[3] * scale_height),
-    ]
+def scale(bboxes, scale_width: float, scale_height: float):
+    factors = np.array([scale_width, scale_height, scale_width, scale_height])
+    return (np.asarray(bboxes, dtype=np.float64) * factors).astype(np.int64)
@@ -1,3 +1,6 @@
+import numpy as np
+from typing import List
+
 CATEGORIES = [
     {"id": 0, "name": "pedestrian"},
     {"id": 1, "name": "people"},
@@ -11,12 +14,18 @@ CATEGORIES = [
     {"id": 9, "name": "motor"}
 ]
 
+CATEGORY_IDS = {category["name"]: category["id"] for category in CATEGORIES}
+CATEGORY_NAMES = {category["id"]: category["name"] for category in CATEGORIES}
+
 
 def to_category_id(category_name: str) -> int:
-    category = next(filter(lambda cat: cat["name"] == category_name, CATEGORIES))
-    return category["id"]
+    return CATEGORY_IDS[category_name]
+
+
+def to_category_ids(category_names: List[str]):
+    return np.fromiter((CATEGORY_IDS[category_name] for category_name in category_names), dtype=np.int16,
+                       count=len(category_names))
 
 
 def to_category_name(category_id: int) -> str:
-    category = next(filter(lambda cat: cat["id"] == category_id, CATEGORIES))
-    return category["name"]
+    return CATEGORY_NAMES[category_id]
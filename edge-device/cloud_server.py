@@ -1,35 +1,75 @@
-import cv2 as cv
+import numpy as np
 import requests
-import time
-from typing import List
+from typing import Union
 
 from bbox import xyxy2xywh
-from model import Detection, Frame
+from category import to_category_ids
+from frame_encoding import FrameEncoder
+from http_client import HttpClient
+from metrics import Metrics
+from model import DetectionBatch, DetectionType, Frame
+from response_trace import TraceRecorder
+from simulation import Clock, Latency
 
 
 class CloudServer:
     detection_model_url: str
-    detection_timeout: int
+    http_client: HttpClient
+    encoder: FrameEncoder
+    clock: Clock
+    metrics: Metrics
+    latency: Union[Latency, None]
+    trace: Union[TraceRecorder, None]
+    verbose: bool
 
-    def __init__(self, detection_model_url: str, detection_timeout: int):
-        self.detection_model_url = detection_model_url
-        self.detection_timeout = detection_timeout
+    last_request_bytes: int
 
-    def detect_objects(self, frame: Frame) -> List[Detection]:
-        encode_param = [int(cv.IMWRITE_JPEG_QUALITY), 90]
-        encoded = cv.imencode(".jpg", frame.cloud_data, encode_param)[1]
+    def __init__(self, detection_model_url: str, http_client: HttpClient, encoder: FrameEncoder, clock: Clock,
+                 metrics: Metrics, latency: Union[Latency, None] = None, trace: Union[TraceRecorder, None] = None,
+                 verbose: bool = True):
+        self.detection_model_url = detection_model_url
+        self.http_client = http_client
+        self.encoder = encoder
+        self.clock = clock
+        self.metrics = metrics
+        self.latency = latency
+        self.trace = trace
+        self.verbose = verbose
+        self.last_request_bytes = 0
 
-        start = time.time()
+    def detect_objects(self, frame: Frame, deadline: float) -> DetectionBatch:
+        with self.clock.computing('cloud_resize_seconds'), self.metrics.timer('cloud_resize_seconds'):
+            cloud_data = frame.cloud_data
+        encoded = self.encoder.encode(cloud_data)
+        self.last_request_bytes = encoded.num_bytes
 
-        response = requests.get(self.detection_model_url, data=encoded.tobytes(), timeout=self.detection_timeout)
+        start = self.clock.time()
+        try:
+            response = self.http_client.get(self.detection_model_url, data=encoded.data.tobytes(), deadline=deadline)
+        except requests.exceptions.RequestException:
+            # Failed requests are recorded as well, a replay fails them the same way.
+            if self.trace is not None:
+                self.trace.record(DetectionType.CLOUD, frame.video, frame.id, start, self.clock.time(),
+                                  encoded.num_bytes, DetectionBatch.empty(), failed=True)
+            raise
         body = response.json()
-        print(f"Cloud num detections: {len(body)}")
-
-        end = time.time()
-        print(f"Cloud detection request took: {end - start}s")
+        if self.latency is not None:
+            # The result can't arrive before the cloud server has actually answered, even if that took longer.
+            self.clock.wait_until(start + self.latency.sample(encoded.num_bytes))
+        arrived_at = self.clock.time()
+        round_trip_time = arrived_at - start
+        self.metrics.observe('cloud_rtt_seconds', round_trip_time)
+        self.encoder.observe_transfer(encoded.num_bytes, round_trip_time)
+        if self.verbose:
+            print(f"Cloud num detections: {len(body)} ({encoded.encoding}, {encoded.num_bytes} bytes)")
 
-        return [Detection(
-            category=detection['class_name'],
-            score=int(detection['score'] * 100),
-            bbox=xyxy2xywh(detection['bbox'])
-        ) for detection in body]
+        detections = DetectionBatch.create(
+            bboxes=xyxy2xywh([detection['bbox'] for detection in body]) / encoded.encoding.scale,
+            scores=(np.array([detection['score'] for detection in body], dtype=np.float64) * 100).astype(np.int32),
+            categories=to_category_ids([detection['class_name'] for detection in body]),
+            det_type=DetectionType.CLOUD
+        )
+        if self.trace is not None:
+            self.trace.record(DetectionType.CLOUD, frame.video, frame.id, start, arrived_at, encoded.num_bytes,
+                              detections)
+        return detections
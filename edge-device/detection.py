@@ -1,69 +1,95 @@
+import numpy as np
 import requests
+import time
 import zmq
 
-from concurrent.futures import Executor, Future, ThreadPoolExecutor
-from multiprocessing import Process, Event
-from queue import Full
-from typing import List, Union, Any
+from collections import deque
+from concurrent.futures import Executor, Future
+from dataclasses import replace
+from typing import List, Dict, Tuple, Union, Any
 
 from bbox import scale
 from cloud_server import CloudServer
 from edge_server import EdgeServer
+from frame_ring import SharedFrameRing, FrameBacklog
 from fusion import fuse_edge_cloud_detections
-from model import Detection, DetectionType, Frame, Dimensions, DetectionsWithTypes
-from process import track_objects_until_current_worker
+from metrics import Metrics
+from model import DetectionBatch, DetectionType, Frame, Dimensions, FrameSlot, TrackerHealth
+from offload import OffloadScheduler
+from process import CloudTrackingWorker, CLOUD_TRACKING_ENDPOINT
+from response_trace import ReplayEdgeServer, ReplayCloudServer
+from simulation import Clock
+
+FRAME_RING_CAPACITY_FACTOR = 3
 
 
 class EdgeCloudObjectDetector:
-    edge_server: EdgeServer
-    cloud_server: CloudServer
+    edge_server: Union[EdgeServer, ReplayEdgeServer]
+    cloud_server: Union[CloudServer, ReplayCloudServer]
+    cloud_detection_deadline: float
     executor: Executor
     dimensions: Dimensions
-    cloud_tracking_process: Union[Process, None]
+    cloud_tracking: CloudTrackingWorker
+    cloud_tracking_identity: str
     cloud_tracking_context: Any
     cloud_tracking_socket: Any
-    cloud_tracking_stop_event: Event
     cloud_tracking_min_score: int
     cloud_tracking_stride: int
     max_fps: int
+    offload_scheduler: OffloadScheduler
+    clock: Clock
+    metrics: Metrics
+    verbose: bool
 
-    frames_until_current: List[Frame]
-    cloud_detection: "Future[List[Detection]]"
+    cloud_tracking_sent_at: "deque[float]"
+    cloud_tracking_result: Union[Dict[str, Any], None]
+    frame_ring: SharedFrameRing
+    frames_until_current: FrameBacklog
+    current_frame_slot: Union[FrameSlot, None]
+    cloud_detection: "Future[Tuple[DetectionBatch, float]]"
+    cloud_detection_pending: bool
 
-    def __init__(self, edge_server: EdgeServer, cloud_server: CloudServer, dimensions: Dimensions,
-                 cloud_tracking_min_score: int, cloud_tracking_stride: int, max_fps: int):
+    def __init__(self, edge_server: Union[EdgeServer, ReplayEdgeServer],
+                 cloud_server: Union[CloudServer, ReplayCloudServer], executor: Executor,
+                 cloud_detection_deadline: float, dimensions: Dimensions, cloud_tracking: CloudTrackingWorker,
+                 cloud_tracking_identity: str, cloud_tracking_min_score: int, cloud_tracking_stride: int, max_fps: int,
+                 offload_scheduler: OffloadScheduler, clock: Clock, metrics: Metrics, verbose: bool = True):
         self.edge_server = edge_server
         self.cloud_server = cloud_server
-        self.executor = ThreadPoolExecutor()
+        self.cloud_detection_deadline = cloud_detection_deadline
+        self.executor = executor
         self.dimensions = dimensions
-        self.cloud_tracking_process = None
+        self.cloud_tracking = cloud_tracking
+        self.cloud_tracking_identity = cloud_tracking_identity
         self.cloud_tracking_context = zmq.Context()
         self.cloud_tracking_socket = self.cloud_tracking_context.socket(zmq.DEALER)
-        self.cloud_tracking_stop_event = Event()
         self.cloud_tracking_min_score = cloud_tracking_min_score
         self.cloud_tracking_stride = cloud_tracking_stride
         self.max_fps = max_fps
-        self.frames_until_current = []
+        self.offload_scheduler = offload_scheduler
+        self.clock = clock
+        self.metrics = metrics
+        self.verbose = verbose
+        self.cloud_tracking_sent_at = deque()
+        self.cloud_tracking_result = None
+        self.frame_ring = cloud_tracking.frame_ring
+        self.frames_until_current = FrameBacklog(self.frame_ring, max_frames=max_fps)
+        self.current_frame_slot = None
         self.cloud_detection = Future()
-        self.cloud_detection.set_result([])
+        self.cloud_detection.set_result((DetectionBatch.empty(), 0.0))
+        self.cloud_detection_pending = False
 
     def start_cloud_tracking(self):
-        self.cloud_tracking_process = Process(
-            target=track_objects_until_current_worker,
-            args=(self.cloud_tracking_stop_event,)
-        )
-        self.cloud_tracking_process.start()
-
-        self.cloud_tracking_socket.setsockopt_string(zmq.IDENTITY, "edge-device")
-        self.cloud_tracking_socket.connect("ipc:///tmp/edge-device/0")
+        self.cloud_tracking_socket.setsockopt_string(zmq.IDENTITY, self.cloud_tracking_identity)
+        self.cloud_tracking_socket.connect(CLOUD_TRACKING_ENDPOINT)
 
     def stop_cloud_tracking(self):
-        self.cloud_tracking_stop_event.set()
-        self.cloud_tracking_process.join()
+        self._clear_frames_until_current()
+        self.cloud_tracking_socket.close(linger=0)
 
     def request_edge_detections_sync(self,
                                      frame: Frame,
-                                     current_detections: DetectionsWithTypes) -> Union[DetectionsWithTypes, None]:
+                                     current_detections: DetectionBatch) -> Union[DetectionBatch, None]:
         self.request_edge_detections_async(frame)
         return self.get_edge_detections(current_detections, block=True)
 
@@ -71,87 +97,174 @@ class EdgeCloudObjectDetector:
         return self.edge_server.send_frame(frame)
 
     def get_edge_detections(self,
-                            current_detections: DetectionsWithTypes,
-                            block: bool) -> Union[DetectionsWithTypes, None]:
+                            current_detections: DetectionBatch,
+                            block: bool) -> Union[DetectionBatch, None]:
         timeout = 60000 if block else 1
         edge_detections = self.edge_server.receive_detections(timeout)
 
         if edge_detections is None:
             return None
 
-        current_detections = [detection for detection, det_type in current_detections
-                              if det_type == DetectionType.CLOUD]
-        return fuse_edge_cloud_detections(current_detections, edge_detections, DetectionType.EDGE)
+        current_detections = current_detections.of_type(DetectionType.CLOUD)
+        with self.clock.computing('fusion_seconds'), self.metrics.timer('fusion_seconds'):
+            return fuse_edge_cloud_detections(current_detections, edge_detections, DetectionType.EDGE)
+
+    def get_edge_round_trip_time(self) -> float:
+        return self.edge_server.round_trip_time
+
+    def process_cloud_detections(self, frame: Frame, current_detections: DetectionBatch):
+        if not self._cloud_detection_arrived():
+            return
+
+        # A finished cloud detection is handed to cloud tracking right away, even if no new request goes out.
+        if self.cloud_detection_pending:
+            self.cloud_detection_pending = False
+            self.offload_scheduler.observe_request_bytes(self.cloud_server.last_request_bytes)
+            cloud_detections, _ = self.cloud_detection.result()
+            self._add_cloud_tracking_task(self._scale_cloud_to_edge(cloud_detections), frame)
+
+        decision = self.offload_scheduler.decide(frame, current_detections)
+        if not decision.offload:
+            self.metrics.with_labels(reason=decision.reason).increment('cloud_offloads_skipped')
+            return
+
+        self.metrics.with_labels(reason=decision.reason).increment('cloud_offloads')
+        # Frames recorded while no cloud detection was running can't be used to catch up with the next one.
+        self._clear_frames_until_current()
+        deadline = time.time() + self.cloud_detection_deadline
+        self.cloud_detection = self.executor.submit(self._cloud_detect_objects, frame, deadline, self.clock.time())
+        self.cloud_detection_pending = True
 
-    def process_cloud_detections(self, frame: Frame):
-        if self.cloud_detection.done():
-            cloud_detections = self.cloud_detection.result()
-            scaled_cloud_detections = self._scale_cloud_to_edge(cloud_detections)
-            self.cloud_detection = self.executor.submit(self._cloud_detect_objects, frame)
-            self.executor.submit(self._add_cloud_tracking_task, scaled_cloud_detections, frame)
+    def observe_tracking(self, health: TrackerHealth):
+        self.offload_scheduler.observe_tracking(health)
 
-    def get_cloud_detections(self, current_detections: DetectionsWithTypes) -> Union[DetectionsWithTypes, None]:
-        tracked_cloud_detections = []
-        if self.cloud_tracking_socket.poll(1, zmq.POLLIN):
-            tracked_cloud_detections = self.cloud_tracking_socket.recv_pyobj(zmq.NOBLOCK)
+    def get_cloud_detections(self, current_detections: DetectionBatch) -> Union[DetectionBatch, None]:
+        tracked_cloud_detections = None
+        obj = self._receive_cloud_tracking()
+        if obj is not None:
+            tracked_cloud_detections = obj['detections']
+            if obj['tracking_time'] is not None:
+                self.metrics.observe('cloud_tracking_seconds', obj['tracking_time'])
 
         if not tracked_cloud_detections:
             return None
 
-        current_detections = [detection for detection, det_type in current_detections
-                              if det_type == DetectionType.EDGE]
-        return fuse_edge_cloud_detections(current_detections, tracked_cloud_detections, DetectionType.CLOUD)
+        current_detections = current_detections.of_type(DetectionType.EDGE)
+        with self.clock.computing('fusion_seconds'), self.metrics.timer('fusion_seconds'):
+            return fuse_edge_cloud_detections(current_detections, tracked_cloud_detections, DetectionType.CLOUD)
 
-    def record(self, frame: Frame):
-        self.frames_until_current.append(frame)
+    def is_recording(self) -> bool:
+        return self.cloud_detection_pending
+
+    def record(self, frame: Frame, frame_slot: Union[FrameSlot, None]):
+        # The frame slot is only valid while the caller holds it, i.e. until the frame has been processed.
+        self.current_frame_slot = frame_slot
+        if not self.cloud_detection_pending or frame_slot is None:
+            return
 
-        if len(self.frames_until_current) > self.max_fps:
-            self.frames_until_current = self.frames_until_current[-self.max_fps:]
+        self.frames_until_current.append(frame, frame_slot)
 
     def reset(self):
-        self.frames_until_current.clear()
+        self._clear_frames_until_current()
 
-    def _scale_cloud_to_edge(self, detections: List[Detection]) -> List[Detection]:
-        return [
-            Detection(
-                detection.category,
-                detection.score,
-                scale(
-                    detection.bbox,
-                    self.dimensions.edge_processing_width / self.dimensions.cloud_processing_width,
-                    self.dimensions.edge_processing_height / self.dimensions.cloud_processing_height
-                )
-            )
-            for detection in detections
-        ]
-
-    def _cloud_detect_objects(self, frame: Frame) -> List[Detection]:
-        try:
-            print("Cloud detection start")
-            cloud_detections = self.cloud_server.detect_objects(frame)
-            print(f"Cloud detection end")
-            return cloud_detections
-        except requests.exceptions.RequestException as e:
-            print("Cloud detection failure:", e)
-            return []
-
-    def _add_cloud_tracking_task(self, cloud_detections: List[Detection], frame: Frame):
+    def _scale_cloud_to_edge(self, detections: DetectionBatch) -> DetectionBatch:
+        bboxes = scale(
+            detections.bboxes,
+            self.dimensions.edge_processing_width / self.dimensions.cloud_processing_width,
+            self.dimensions.edge_processing_height / self.dimensions.cloud_processing_height
+        )
+        return replace(detections, bboxes=bboxes.astype(np.float64))
+
+    def _cloud_detection_arrived(self) -> bool:
+        if not self.clock.finished(self.cloud_detection):
+            return False
+        _, arrived_at = self.cloud_detection.result()
+        return arrived_at <= self.clock.time()
+
+    def _cloud_detect_objects(self, frame: Frame, deadline: float,
+                              sent_at: float) -> Tuple[DetectionBatch, float]:
+        # The request runs on a timeline forked from the processing loop when it was sent. Its result arrives at the
+        # time the timeline has reached once the request is done.
+        with self.clock.forked(sent_at):
+            try:
+                if self.verbose:
+                    print("Cloud detection start")
+                cloud_detections = self.cloud_server.detect_objects(frame, deadline)
+                if self.verbose:
+                    print("Cloud detection end")
+            except requests.exceptions.RequestException as e:
+                if self.verbose:
+                    print("Cloud detection failure:", e)
+                self.metrics.increment('cloud_detection_failures')
+                cloud_detections = DetectionBatch.empty()
+            return cloud_detections, self.clock.time()
+
+    def _add_cloud_tracking_task(self, cloud_detections: DetectionBatch, frame: Frame):
         if not self.frames_until_current:
             return
 
-        try:
-            obj = dict(
-                detections=cloud_detections,
-                frames_until_current=self._filter_frames_until_current(),
-                current_frame=frame,
-                min_score=self.cloud_tracking_min_score
-            )
-            self.cloud_tracking_socket.send_pyobj(obj, protocol=-1)
-        except Full as e:
-            print("Cloud tracking failure:", e)
+        frames_until_current = self._filter_frames_until_current()
+        self.frame_ring.acquire([frame_slot.slot for frame_slot in frames_until_current])
+        current_frame = self._acquire_current_frame(frame)
 
-        self.frames_until_current.clear()
+        slots = [frame_slot.slot for frame_slot in frames_until_current]
+        if current_frame is not None:
+            slots.append(current_frame.slot)
+
+            try:
+                obj = dict(
+                    detections=cloud_detections,
+                    frames_until_current=frames_until_current,
+                    current_frame=current_frame,
+                    min_score=self.cloud_tracking_min_score
+                )
+                self.cloud_tracking_socket.send_pyobj(obj, protocol=-1)
+                self.cloud_tracking_sent_at.append(self.clock.time())
+                slots = []
+            except zmq.ZMQError as e:
+                if self.verbose:
+                    print("Cloud tracking failure:", e)
+                self.metrics.increment('cloud_tracking_failures')
+
+        self.frame_ring.release(slots)
+        self._clear_frames_until_current()
+
+    def _receive_cloud_tracking(self) -> Union[Dict[str, Any], None]:
+        if self.cloud_tracking_result is None and self.cloud_tracking_sent_at:
+            if self.clock.poll(self.cloud_tracking_socket, 1):
+                self.cloud_tracking_result = self.cloud_tracking_socket.recv_pyobj(zmq.NOBLOCK)
+
+        if self.cloud_tracking_result is None:
+            return None
+
+        # Cloud tracking runs next to the processing loop. With a simulated clock, which skips waiting, its result is
+        # held back until the compute time charged for it has passed.
+        sent_at = self.cloud_tracking_sent_at[0]
+        tracking_time = self.clock.compute_time('cloud_tracking_seconds',
+                                                self.cloud_tracking_result['tracking_time'] or 0.0)
+        if self.clock.time() < sent_at + tracking_time:
+            return None
+
+        obj = self.cloud_tracking_result
+        self.cloud_tracking_result = None
+        self.metrics.observe('cloud_catch_up_seconds', self.clock.time() - self.cloud_tracking_sent_at.popleft())
+        return obj
 
-    def _filter_frames_until_current(self) -> List[Frame]:
-        return [frame for idx, frame in enumerate(self.frames_until_current)
+    def _filter_frames_until_current(self) -> List[FrameSlot]:
+        return [frame_slot for idx, frame_slot in enumerate(self.frames_until_current.recorded_slots())
                 if idx % self.cloud_tracking_stride == 0]
+
+    def _acquire_current_frame(self, frame: Frame) -> Union[FrameSlot, None]:
+        if self.current_frame_slot is not None and self.current_frame_slot.id == frame.id:
+            self.frame_ring.acquire([self.current_frame_slot.slot])
+            return self.current_frame_slot
+
+        frame_slot = self.frame_ring.write_frame(frame)
+        if frame_slot is None:
+            if self.verbose:
+                print("Cloud tracking failure: frame ring full")
+            self.metrics.increment('cloud_tracking_failures')
+        return frame_slot
+
+    def _clear_frames_until_current(self):
+        self.frames_until_current.clear()
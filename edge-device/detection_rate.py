@@ -0,0 +1,146 @@
+import math
+from typing_extensions import Protocol
+
+from metrics import Metrics, SIZE_BUCKETS
+from model import TrackerHealth
+
+SMOOTHING = 0.2
+MAX_FAILURE_RATIO = 0.2
+MIN_SCORE_RETENTION = 0.6
+EASY_FAILURE_RATIO = 0.02
+EASY_SCORE_RETENTION = 0.9
+
+
+class DetectionRateController(Protocol):
+    def get_rate(self) -> int:
+        ...
+
+    def observe_frame(self, frame_time: float, detected: bool):
+        ...
+
+    def observe_tracking(self, health: TrackerHealth):
+        ...
+
+    def observe_edge_detection(self, round_trip_time: float):
+        ...
+
+
+class FixedDetectionRate:
+    rate: int
+
+    def __init__(self, rate: int):
+        self.rate = rate
+
+    def get_rate(self) -> int:
+        return self.rate
+
+    def observe_frame(self, frame_time: float, detected: bool):
+        pass
+
+    def observe_tracking(self, health: TrackerHealth):
+        pass
+
+    def observe_edge_detection(self, round_trip_time: float):
+        pass
+
+
+class AdaptiveDetectionRate:
+    rate: int
+    min_rate: int
+    max_rate: int
+    target_fps: float
+    sync: bool
+    metrics: Metrics
+
+    detected_frame_time: float
+    tracked_frame_time: float
+    round_trip_time: float
+    updates: int
+    failures: int
+    score_retention: float
+
+    def __init__(self, rate: int, min_rate: int, max_rate: int, target_fps: float, sync: bool, metrics: Metrics):
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.target_fps = target_fps
+        self.sync = sync
+        self.metrics = metrics
+
+        self.detected_frame_time = 0.0
+        self.tracked_frame_time = 0.0
+        self.round_trip_time = 0.0
+        self._reset_health()
+
+        self.metrics.register_gauge('detection_rate', self.get_rate)
+
+    def get_rate(self) -> int:
+        return self.rate
+
+    def observe_frame(self, frame_time: float, detected: bool):
+        if detected:
+            self.detected_frame_time = _smooth(self.detected_frame_time, frame_time)
+        else:
+            self.tracked_frame_time = _smooth(self.tracked_frame_time, frame_time)
+
+    def observe_tracking(self, health: TrackerHealth):
+        self.updates += health.updates
+        self.failures += health.failures
+        self.score_retention = min(self.score_retention, health.score_retention)
+
+    def observe_edge_detection(self, round_trip_time: float):
+        self.round_trip_time = _smooth(self.round_trip_time, round_trip_time)
+
+        # The rate never drops below the lowest rate expected to hold the target FPS. Within that, tracking
+        # which struggles asks for edge detections more often, while easy scenes ask for them less often.
+        min_rate = self._min_rate_for_target_fps()
+        failure_ratio = self.failures / self.updates if self.updates else 0.0
+        if failure_ratio > MAX_FAILURE_RATIO or self.score_retention < MIN_SCORE_RETENTION:
+            rate = self.rate - 1
+        elif failure_ratio <= EASY_FAILURE_RATIO and self.score_retention >= EASY_SCORE_RETENTION:
+            rate = self.rate + 1
+        else:
+            rate = self.rate
+        rate = min(max(rate, min_rate, self.min_rate), self.max_rate)
+
+        if rate > self.rate:
+            self.metrics.increment('detection_rate_raised')
+        elif rate < self.rate:
+            self.metrics.increment('detection_rate_lowered')
+        self.metrics.observe('detection_rate_decisions', rate, SIZE_BUCKETS)
+
+        self.rate = rate
+        self._reset_health()
+
+    def _min_rate_for_target_fps(self) -> int:
+        for rate in range(self.min_rate, self.max_rate + 1):
+            if self._predict_fps(rate) >= self.target_fps:
+                return rate
+        return self.max_rate
+
+    def _predict_fps(self, rate: int) -> float:
+        if self.sync:
+            # One frame waits for the edge server, the others are tracked.
+            cycle_time = self.detected_frame_time + (rate - 1) * self.tracked_frame_time
+        else:
+            # Frames are tracked while the edge server works, the last frame of a cycle waits for its response.
+            cycle_time = max(self.round_trip_time, rate * self.tracked_frame_time)
+        return rate / cycle_time if cycle_time > 0 else math.inf
+
+    def _reset_health(self):
+        self.updates = 0
+        self.failures = 0
+        self.score_retention = 1.0
+
+
+def get_detection_rate_controller(adaptive: bool, rate: int, min_rate: int, max_rate: int, target_fps: float,
+                                  sync: bool, metrics: Metrics) -> DetectionRateController:
+    if adaptive:
+        return AdaptiveDetectionRate(rate, min_rate, max_rate, target_fps, sync, metrics)
+    return FixedDetectionRate(rate)
+
+
+def _smooth(average: float, value: float) -> float:
+    if average == 0.0:
+        return value
+    return (1 - SMOOTHING) * average + SMOOTHING * value
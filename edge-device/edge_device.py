@@ -1,73 +1,113 @@
-import cv2 as cv
-import dataclasses
 import glob
-import json
 import numpy as np
-import time
-from typing import Union, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, List, Tuple, Callable, Any
 
 from annotation import annotations_available, load_annotations
 from bbox import scale
-from category import to_category_id
 from detection import EdgeCloudObjectDetector
-from display import display_detection, display_annotation, display_fps
-from evaluation import evaluate_detections
+from detection_rate import DetectionRateController
+from evaluation import Evaluator, image_id_range
 from frame import get_frames
-from model import DetectionView, AnnotationsByImage, Frame, Detection, DetectionType, DetectionsWithTypes, Dimensions, \
-    Image
+from frame_ring import FrameBacklog
+from metrics import Metrics
+from model import DetectionView, AnnotationsByImage, Frame, DetectionBatch, DetectionType, Dimensions, Image
+from render import Renderer
+from results import ResultWriter
+from simulation import Clock
 from track import MultiObjectTracker
 
 
+class Stream:
+    id: int
+    object_tracker: MultiObjectTracker
+    object_detector: EdgeCloudObjectDetector
+    rate_controller: DetectionRateController
+    renderer: Renderer
+    clock: Clock
+    metrics: Metrics
+
+    evaluator: Union[Evaluator, None]
+    num_detections: int
+    all_fps: List[float]
+
+    def __init__(self, id: int, object_tracker: MultiObjectTracker, object_detector: EdgeCloudObjectDetector,
+                 rate_controller: DetectionRateController, renderer: Renderer, clock: Clock, metrics: Metrics):
+        self.id = id
+        self.object_tracker = object_tracker
+        self.object_detector = object_detector
+        self.rate_controller = rate_controller
+        self.renderer = renderer
+        self.clock = clock
+        self.metrics = metrics
+
+        self.evaluator = None
+        self.num_detections = 0
+        self.all_fps = []
+
+
 class EdgeDevice:
     dimensions: Dimensions
     max_fps: int
-    detection_rate: int
-    object_tracker: MultiObjectTracker
-    object_detector: EdgeCloudObjectDetector
+    streams: List[Stream]
     sync: bool
+    verbose: bool
+    result_writer: ResultWriter
 
-    all_detections: List[DetectionView]
+    num_detections: int
     all_fps: List[float]
 
-    def __init__(self, dimensions: Dimensions, max_fps: int, detection_rate: int, object_tracker: MultiObjectTracker,
-                 object_detector: EdgeCloudObjectDetector, sync: bool):
+    def __init__(self, dimensions: Dimensions, max_fps: int, streams: List[Stream], sync: bool, verbose: bool,
+                 result_writer: ResultWriter):
         self.dimensions = dimensions
         self.max_fps = max_fps
-        self.detection_rate = detection_rate
-        self.object_tracker = object_tracker
-        self.object_detector = object_detector
+        self.streams = streams
         self.sync = sync
+        self.verbose = verbose
+        self.result_writer = result_writer
 
-        self.all_detections = []
+        self.num_detections = 0
         self.all_fps = []
 
     def process(self, videos: Union[str, None], annotations_path: Union[str, None]):
         items = []
-        multiple_videos = False
 
         if videos is not None:
             items = glob.glob(videos)
         else:
-            self._process_camera()
+            self._process_streams(self._process_camera, [(stream,) for stream in self.streams])
 
         if len(items) > 0:
             if items[0].endswith(".jpg"):
                 video = videos
-                self._process_video(video, annotations_path)
+                self._process_streams(self._process_video, [(self.streams[0], video, annotations_path)])
             else:
-                multiple_videos = True
+                # Videos are spread over the streams, each stream processes its videos one after another.
+                num_streams = len(self.streams)
+                self._process_streams(self._process_multiple_videos, [
+                    (stream, items[stream.id::num_streams], annotations_path)
+                    for stream in self.streams if items[stream.id::num_streams]
+                ])
 
-        if multiple_videos:
-            self._process_multiple_videos(videos, annotations_path)
+        self.result_writer.close()
+
+        for stream in self.streams:
+            self.num_detections += stream.num_detections
+            self.all_fps.extend(stream.all_fps)
 
         if annotations_available(videos, annotations_path):
-            evaluate_detections(self.all_detections, annotations_path)
+            # Frames were matched against the annotations per video, only the totals are computed here.
+            evaluators = [stream.evaluator for stream in self.streams if stream.evaluator is not None]
+            evaluator = evaluators[0] if len(evaluators) == 1 else Evaluator.merge(evaluators)
+            evaluator.evaluate(evaluator.image_id_range())
 
-            print("Creating all_detections.json")
-            with open('all_detections.json', 'w') as f:
-                json.dump([dataclasses.asdict(detection) for detection in self.all_detections], f, default=str)
+        for stream in self.streams:
+            stream.renderer.close()
 
-        cv.destroyAllWindows()
+        if len(self.streams) > 1:
+            for stream in self.streams:
+                if stream.all_fps:
+                    print(f"Stream {stream.id} FPS average: {int(sum(stream.all_fps) / len(stream.all_fps))}")
 
         fps_avg = int(sum(self.all_fps) / len(self.all_fps))
         fps_bins = np.append(np.arange(self.max_fps + 1), np.inf)
@@ -76,42 +116,53 @@ class EdgeDevice:
         print(f"Total FPS average: {fps_avg}")
         print(f"Total FPS histogram: {fps_histogram} (includes {sum(fps_histogram[0])}/{len(self.all_fps)})")
 
-    def _process_camera(self):
-        self._process_video(None, None)
+    def _process_streams(self, process: Callable[..., Any], args: List[Tuple[Any, ...]]):
+        if len(args) == 1:
+            process(*args[0])
+            return
+
+        with ThreadPoolExecutor(max_workers=len(args)) as executor:
+            futures = [executor.submit(process, *stream_args) for stream_args in args]
+            for future in futures:
+                future.result()
 
-    def _process_multiple_videos(self, videos: str, annotations_path: Union[str, None]):
+    def _process_camera(self, stream: Stream):
+        self._process_video(stream, None, None)
+
+    def _process_multiple_videos(self, stream: Stream, videos: List[str], annotations_path: Union[str, None]):
         mAP_per_video = []
         mAP_50_per_video = []
         fps_per_video = []
 
-        for video in glob.glob(videos):
-            self.object_tracker.reset_objects()
-            self.object_detector.reset()
+        for video in videos:
+            stream.object_tracker.reset_objects()
+            stream.object_detector.reset()
 
-            result, fps_records = self._process_video(f"{video}/*", annotations_path)
+            result, fps_records = self._process_video(stream, f"{video}/*", annotations_path)
 
             if annotations_available(video, annotations_path):
-                mAP, mAP_50 = evaluate_detections(result, annotations_path)
+                mAP, mAP_50 = stream.evaluator.evaluate(image_id_range(result))
                 mAP_per_video.append(mAP)
                 mAP_50_per_video.append(mAP_50)
 
             fps = int(sum(fps_records) / len(fps_records))
-            print(f"FPS average: {fps}")
+            self._log(stream, f"FPS average: {fps}")
             fps_per_video.append(fps)
 
         print()
 
         if mAP_per_video:
-            print(f"All mAPs: {mAP_per_video}")
+            self._log(stream, f"All mAPs: {mAP_per_video}")
         if mAP_50_per_video:
-            print(f"All mAP_50s: {mAP_50_per_video}")
-        print(f"All FPS averages: {fps_per_video}")
+            self._log(stream, f"All mAP_50s: {mAP_50_per_video}")
+        self._log(stream, f"All FPS averages: {fps_per_video}")
 
         print()
 
-    def _process_video(self, video: Union[str, None],
+    def _process_video(self, stream: Stream, video: Union[str, None],
                        annotations_path: Union[str, None]) -> Tuple[List[DetectionView], List[float]]:
         frame_count = 0
+        frames_since_detection = 0
         prev_frame_at = 0.0
         first_frame = True
 
@@ -120,10 +171,13 @@ class EdgeDevice:
         edge_detection_start = 0.0
         edge_detection_times = []
 
-        frames_until_current: List[Frame] = []
+        frame_ring = stream.object_detector.frame_ring
+        frames_until_current = FrameBacklog(frame_ring)
         reset_frames_until_current = False
 
-        current_detections: DetectionsWithTypes = []
+        current_detections = DetectionBatch.empty()
+        num_detections = 0
+        # Detections are only kept for evaluating them against the annotations, camera streams never end.
         result: List[DetectionView] = []
 
         images: List[Image] = []
@@ -131,134 +185,163 @@ class EdgeDevice:
         if annotations_available(video, annotations_path):
             (images, annotations) = load_annotations(video, annotations_path)
 
-        frames = get_frames(video, images, self.dimensions, self.max_fps)
+        frames = get_frames(video, images, self.dimensions, self.max_fps, stream.clock, stream.metrics,
+                            camera=stream.id)
         while True:
-            start = time.time()
+            start = stream.clock.time()
 
             frame = next(frames)
             if frame.id == -1:
                 break
 
+            # The frame is copied into the frame ring once, the async backlog and the cloud catch-up share the copy.
+            frame_slot = None
+            if not self.sync or stream.object_detector.is_recording():
+                frame_slot = frame_ring.write_frame(frame)
+                if frame_slot is None:
+                    if self.verbose:
+                        print("Frame ring full, frame not recorded")
+                    stream.metrics.increment('frame_ring_full')
+
             tracked = False
+            detected = False
             reset_tracker = False
+            detection_rate = stream.rate_controller.get_rate()
 
             if self.sync:
-                if frame_count % self.detection_rate == 0:
-                    edge_detection_start = time.time()
-                    detections = self.object_detector.request_edge_detections_sync(frame, current_detections)
-                    edge_detection_times.append(time.time() - edge_detection_start)
+                if first_frame or frames_since_detection >= detection_rate:
+                    edge_detection_start = stream.clock.time()
+                    detections = stream.object_detector.request_edge_detections_sync(frame, current_detections)
+                    edge_detection_times.append(stream.clock.time() - edge_detection_start)
 
                     current_detections = detections
+                    detected = True
                     reset_tracker = True
                 else:
                     tracked = True
-                    current_detections = self.object_tracker.track_objects(frame)
+                    with stream.clock.computing('tracking_seconds'), stream.metrics.timer('tracking_seconds'):
+                        current_detections = stream.object_tracker.track_objects(frame)
             else:
                 if not first_frame:
-                    ok = self.object_detector.request_edge_detections_async(frame)
+                    ok = stream.object_detector.request_edge_detections_async(frame)
                     if ok:
                         reset_frames_until_current = True
 
-                        edge_detection_times.append(time.time() - edge_detection_start)
-                        edge_detection_start = time.time()
+                        edge_detection_times.append(stream.clock.time() - edge_detection_start)
+                        edge_detection_start = stream.clock.time()
 
                 if reset_frames_until_current:
                     frames_until_current.clear()
                     reset_frames_until_current = False
-                frames_until_current.append(frame)
+                frames_until_current.append(frame, frame_slot)
 
                 if first_frame:
-                    detections = self.object_detector.request_edge_detections_sync(frame, current_detections)
+                    detections = stream.object_detector.request_edge_detections_sync(frame, current_detections)
 
                     current_detections = detections
+                    detected = True
                     reset_tracker = True
                 else:
-                    block = len(frames_until_current) >= self.detection_rate
-                    detections = self.object_detector.get_edge_detections(current_detections, block)
+                    block = len(frames_until_current) >= detection_rate
+                    detections = stream.object_detector.get_edge_detections(current_detections, block)
 
                     if detections is None:
                         tracked = True
-                        current_detections = self.object_tracker.track_objects(frame)
+                        with stream.clock.computing('tracking_seconds'), stream.metrics.timer('tracking_seconds'):
+                            current_detections = stream.object_tracker.track_objects(frame)
                     else:
-                        self.object_tracker.reset_objects()
-                        for (detection, det_type) in detections:
-                            self.object_tracker.add_object(
-                                frames_until_current[0],
-                                detection,
-                                det_type
+                        detected = True
+                        stream.object_tracker.reset_objects()
+                        stream.object_tracker.add_objects(frames_until_current[0], detections)
+
+                        with stream.clock.computing('catch_up_seconds'), stream.metrics.timer('catch_up_seconds'):
+                            current_detections = stream.object_tracker.track_objects_until_current(
+                                list(frames_until_current.frames)[1:-1],
+                                frame,
+                                decay=1.0
                             )
 
-                        current_detections = self.object_tracker.track_objects_until_current(
-                            frames_until_current[1:-1],
-                            frame,
-                            decay=1.0
-                        )
+            if detected:
+                stream.rate_controller.observe_edge_detection(stream.object_detector.get_edge_round_trip_time())
+            elif tracked:
+                stream.rate_controller.observe_tracking(stream.object_tracker.health)
+                stream.object_detector.observe_tracking(stream.object_tracker.health)
 
-            self.object_detector.record(frame)
+            stream.object_detector.record(frame, frame_slot)
 
             if frame_count % 5 == 0:
-                self.object_detector.process_cloud_detections(frame)
+                stream.object_detector.process_cloud_detections(frame, current_detections)
 
-            detections = self.object_detector.get_cloud_detections(current_detections)
+            if frame_slot is not None:
+                frame_ring.release([frame_slot.slot])
+
+            detections = stream.object_detector.get_cloud_detections(current_detections)
             if detections is not None:
                 current_detections = detections
                 reset_tracker = True
 
             if reset_tracker:
-                self.object_tracker.reset_objects()
-                for (detection, det_type) in current_detections:
-                    self.object_tracker.add_object(frame, detection, det_type)
+                stream.object_tracker.reset_objects()
+                stream.object_tracker.add_objects(frame, current_detections)
 
             current_det_views = self._convert_to_views(current_detections, frame, tracked=tracked)
-            result.extend(current_det_views)
+            num_detections += len(current_det_views)
+            if annotations_available(video, annotations_path):
+                result.extend(current_det_views)
+                self.result_writer.write(current_det_views)
 
-            frame_at = time.time()
+            frame_at = stream.clock.time()
             fps = 1 / (frame_at - prev_frame_at)
             fps_records.append(fps)
             prev_frame_at = frame_at
 
             frame_count += 1
+            frames_since_detection = 1 if detected else frames_since_detection + 1
             first_frame = False
 
-            for current_detection in current_det_views:
-                display_detection(frame.data, current_detection)
-
-            if annotations_available(video, annotations_path):
-                for annotation in annotations[frame.id]:
-                    display_annotation(frame.data, annotation)
+            frame_annotations = annotations[frame.id] if annotations_available(video, annotations_path) else []
 
-            display_fps(frame.data, int(fps))
+            end = stream.clock.time()
+            stream.metrics.observe('frame_seconds', end - start)
+            stream.metrics.increment('frames')
+            stream.rate_controller.observe_frame(end - start, detected)
 
-            end = time.time()
-
-            cv.imshow('frame', frame.data)
-            if cv.waitKey(1) == ord('q'):
+            if not stream.renderer.render(frame, current_det_views, frame_annotations, int(fps)):
                 break
 
-            print(f"Frame took: {end - start}s, with wait: {time.time() - start}s")
+            if self.verbose:
+                print(f"Frame took: {end - start}s, with wait: {stream.clock.time() - start}s")
+
+        frames_until_current.clear()
 
         edge_detection_times = edge_detection_times if self.sync else edge_detection_times[1:]
         average_edge_detection_time = sum(edge_detection_times) / len(edge_detection_times)
-        print(f"Edge detections took: {edge_detection_times} (average: {average_edge_detection_time}s)")
+        self._log(stream, f"Edge detections took: {edge_detection_times} (average: {average_edge_detection_time}s)")
+
+        if annotations_available(video, annotations_path):
+            if stream.evaluator is None:
+                stream.evaluator = Evaluator(annotations_path)
+            stream.evaluator.add(result)
 
-        self.all_detections.extend(result)
-        self.all_fps.extend(fps_records)
+        stream.num_detections += num_detections
+        stream.all_fps.extend(fps_records)
 
         return result, fps_records
 
-    def _convert_to_views(self, detections: DetectionsWithTypes, frame: Frame, tracked: bool) -> List[DetectionView]:
+    def _log(self, stream: Stream, message: str):
+        if len(self.streams) > 1:
+            message = f"Stream {stream.id}: {message}"
+        print(message)
+
+    def _convert_to_views(self, detections: DetectionBatch, frame: Frame, tracked: bool) -> List[DetectionView]:
         frame_height, frame_width, _ = frame.data.shape
         frame_width_scale = frame_width / self.dimensions.edge_processing_width
         frame_height_scale = frame_height / self.dimensions.edge_processing_height
 
+        bboxes = scale(detections.bboxes, frame_width_scale, frame_height_scale)
         return [
-            _to_view(detection, det_type, frame.id, frame_width_scale, frame_height_scale, tracked=tracked)
-            for (detection, det_type) in detections
+            DetectionView(frame.id, x, y, w, h, score, category, DetectionType(det_type), tracked)
+            for (x, y, w, h), score, category, det_type in zip(bboxes.tolist(), detections.scores.tolist(),
+                                                               detections.categories.tolist(),
+                                                               detections.types.tolist())
         ]
-
-
-def _to_view(detection: Detection, det_type: DetectionType, frame_id: int, scale_width: float, scale_height: float,
-             tracked: bool) -> DetectionView:
-    (x, y, w, h) = scale(detection.bbox, scale_width, scale_height)
-    category_id = to_category_id(detection.category)
-    return DetectionView(frame_id, x, y, w, h, detection.score, category_id, det_type, tracked)
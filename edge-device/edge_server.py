@@ -1,42 +1,146 @@
-import cv2 as cv
 import json
 import numpy as np
 import random
+import threading
 import zmq
-from typing import List, Any, Union
+from typing import Any, Union
 
 from bbox import xyxy2xywh
-from model import Detection, Frame
+from category import to_category_ids
+from frame_encoding import FrameEncoder
+from metrics import Metrics
+from model import DetectionBatch, DetectionType, Frame
+from response_trace import TraceRecorder
+from simulation import Clock, Latency
+from wire import WIRE_FORMAT_JSON, is_binary, decode_detections, encode_hello, decode_hello_ack
+
+STREAMS_ENDPOINT = "inproc://edge-server-streams"
+CONTROL_ENDPOINT = "inproc://edge-server-control"
+HELLO_TIMEOUT = 2000
+
+
+class EdgeServerConnection:
+    context: Any
+    frontend: Any
+    backend: Any
+    control: Any
+    thread: threading.Thread
+    num_streams: int
+
+    def __init__(self, ipc: bool):
+        self.context = zmq.Context()
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend.bind(STREAMS_ENDPOINT)
+        self.backend = self.context.socket(zmq.DEALER)
+        self.backend.setsockopt_string(zmq.IDENTITY, str(random.randint(0, 8000)))
+        self.backend.connect(_endpoint(ipc))
+        self.control = self.context.socket(zmq.PAIR)
+        self.control.bind(CONTROL_ENDPOINT)
+        self.thread = threading.Thread(target=self._forward, daemon=True)
+        self.num_streams = 0
+
+    def start(self):
+        self.thread.start()
+
+    def connect(self, socket):
+        # The frontend prefixes requests with the identity of the stream's socket, the edge server sends it back in
+        # front of the response and the frontend routes the response to that stream.
+        socket.setsockopt_string(zmq.IDENTITY, f"stream-{self.num_streams}")
+        socket.connect(STREAMS_ENDPOINT)
+        self.num_streams += 1
+
+    def close(self):
+        control = self.context.socket(zmq.PAIR)
+        control.connect(CONTROL_ENDPOINT)
+        control.send(b"TERMINATE")
+        self.thread.join()
+        control.close()
+        for socket in [self.frontend, self.backend, self.control]:
+            socket.close(linger=0)
+
+    def _forward(self):
+        zmq.proxy_steerable(self.frontend, self.backend, None, self.control)
 
 
 class EdgeServer:
     context: Any
     socket: Any
     ipc: bool
+    wire_format: str
+    encoder: FrameEncoder
+    clock: Clock
+    metrics: Metrics
+    verbose: bool
+    connection: Union[EdgeServerConnection, None]
+    latency: Union[Latency, None]
+    trace: Union[TraceRecorder, None]
 
     in_progress: bool
+    sent_frame: Union[Frame, None]
+    sent_at: float
+    response_due_at: float
+    sent_bytes: int
+    sent_scale: float
+    round_trip_time: float
 
-    def __init__(self, ipc: bool):
-        self.context = zmq.Context()
+    def __init__(self, ipc: bool, wire_format: str, encoder: FrameEncoder, clock: Clock, metrics: Metrics,
+                 verbose: bool = True, connection: Union[EdgeServerConnection, None] = None,
+                 latency: Union[Latency, None] = None, trace: Union[TraceRecorder, None] = None):
+        self.context = connection.context if connection is not None else zmq.Context()
         self.socket = self.context.socket(zmq.DEALER)
         self.ipc = ipc
+        self.wire_format = wire_format
+        self.encoder = encoder
+        self.clock = clock
+        self.metrics = metrics
+        self.verbose = verbose
+        self.connection = connection
+        self.latency = latency
+        self.trace = trace
         self.in_progress = False
+        self.sent_frame = None
+        self.sent_at = 0.0
+        self.response_due_at = 0.0
+        self.sent_bytes = 0
+        self.sent_scale = 1.0
+        self.round_trip_time = 0.0
 
     def connect(self):
-        self.socket.setsockopt_string(zmq.IDENTITY, str(random.randint(0, 8000)))
-        if self.ipc:
-            self.socket.connect("ipc:///tmp/edge-server/0")
+        if self.connection is not None:
+            self.connection.connect(self.socket)
         else:
-            self.socket.connect("tcp://127.0.0.1:8000")
+            self.socket.setsockopt_string(zmq.IDENTITY, str(random.randint(0, 8000)))
+            self.socket.connect(_endpoint(self.ipc))
+
+        # Edge servers answer in JSON unless they acknowledge another wire format.
+        if self.wire_format != WIRE_FORMAT_JSON:
+            self.wire_format = self._negotiate_wire_format()
+
+    def _negotiate_wire_format(self) -> str:
+        self.socket.send(encode_hello([self.wire_format, WIRE_FORMAT_JSON]))
+        # Older edge servers take the hello for a frame and answer it with detections.
+        if self.socket.poll(HELLO_TIMEOUT, zmq.POLLIN):
+            wire_format = decode_hello_ack(self.socket.recv())
+            if wire_format is not None:
+                return wire_format
+        print(f"Edge server didn't acknowledge wire format {self.wire_format}, using {WIRE_FORMAT_JSON}")
+        return WIRE_FORMAT_JSON
 
     def send_frame(self, frame: Frame) -> bool:
         if not self.in_progress:
-            encode_param = [int(cv.IMWRITE_JPEG_QUALITY), 90]
-            encoded = cv.imencode(".jpg", frame.edge_data, encode_param)[1]
+            encoded_frame = self.encoder.encode(frame.edge_data)
+            encoded = encoded_frame.data
 
-            print("Sending frame")
+            if self.verbose:
+                print(f"Sending frame ({encoded_frame.encoding}, {encoded_frame.num_bytes} bytes)")
 
             self.in_progress = True
+            self.sent_frame = frame
+            self.sent_bytes = encoded_frame.num_bytes
+            self.sent_scale = encoded_frame.encoding.scale
+            self.sent_at = self.clock.time()
+            if self.latency is not None:
+                self.response_due_at = self.sent_at + self.latency.sample(encoded_frame.num_bytes)
             if encoded.flags['C_CONTIGUOUS']:
                 self.socket.send(encoded, 0, copy=False, track=False)
             else:
@@ -45,22 +149,58 @@ class EdgeServer:
             return True
         return False
 
-    def receive_detections(self, timeout: int) -> Union[List[Detection], None]:
-        if not self.socket.poll(timeout, zmq.POLLIN):
+    def receive_detections(self, timeout: int) -> Union[DetectionBatch, None]:
+        if not self._poll(timeout):
             return None
 
-        print("Receiving detections")
+        if self.verbose:
+            print("Receiving detections")
         self.in_progress = False
         response = self.socket.recv(zmq.NOBLOCK)
+        arrived_at = self.clock.time()
+        self.round_trip_time = arrived_at - self.sent_at
+        self.metrics.observe('edge_rtt_seconds', self.round_trip_time)
+        self.encoder.observe_transfer(self.sent_bytes, self.round_trip_time)
+
+        if is_binary(response):
+            detections = self._to_detections(response)
+        else:
+            detections = self._json_to_detections(response)
+
+        if self.trace is not None:
+            self.trace.record(DetectionType.EDGE, self.sent_frame.video, self.sent_frame.id, self.sent_at, arrived_at,
+                              self.sent_bytes, detections)
+        return detections
 
+    def _poll(self, timeout: int) -> bool:
+        if self.latency is None:
+            return self.socket.poll(timeout, zmq.POLLIN)
+
+        # The response is due once the simulated latency has passed, however long the edge server actually takes.
+        remaining_time = self.response_due_at - self.clock.time()
+        if not self.in_progress or remaining_time > timeout / 1000:
+            self.clock.sleep(timeout / 1000)
+            return False
+
+        self.clock.sleep(remaining_time)
+        return self.clock.poll(self.socket, timeout)
+
+    def _to_detections(self, response) -> DetectionBatch:
+        bboxes, scores, category_ids = decode_detections(response)
+        return DetectionBatch.create(xyxy2xywh(bboxes) / self.sent_scale, scores, category_ids, DetectionType.EDGE)
+
+    def _json_to_detections(self, response) -> DetectionBatch:
         body = json.loads(response)
 
         detections = body['detections']
 
-        return [self._to_detection(detection) for detection in detections]
+        return DetectionBatch.create(
+            bboxes=xyxy2xywh([detection['bbox'] for detection in detections]) / self.sent_scale,
+            scores=[detection['score'] for detection in detections],
+            categories=to_category_ids([detection['category'] for detection in detections]),
+            det_type=DetectionType.EDGE
+        )
+
 
-    def _to_detection(self, detection) -> Detection:
-        bbox = xyxy2xywh(detection['bbox'])
-        score = detection['score']
-        category = detection['category']
-        return Detection(category, score, bbox)
+def _endpoint(ipc: bool) -> str:
+    return "ipc:///tmp/edge-server/0" if ipc else "tcp://127.0.0.1:8000"
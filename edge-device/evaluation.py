@@ -1,7 +1,10 @@
+import copy
+import numpy as np
 from pycocotools.coco import COCO
 from pycocotools.cocoeval import COCOeval
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Set, Union, Any
 
+from annotation import get_annotation_store
 from model import DetectionView
 
 METRICS = ['mAP', 'mAP_50', 'mAP_75', 'mAP_s', 'mAP_m', 'mAP_l']
@@ -13,38 +16,151 @@ METRIC_TO_COCO_ID = {
     'mAP_m': 4,
     'mAP_l': 5,
 }
+CATEGORY_IDS = list(range(0, 10))
+MAX_DETS = [100, 500, 1000]
+
+
+class Evaluator:
+    annotations_path: str
+    coco_gt: COCO
+
+    detections: Dict[int, List[Dict[str, Any]]]
+    eval_imgs: Dict[int, List[Any]]
+    pending: Set[int]
+    first_image_id: Union[int, None]
+    last_image_id: Union[int, None]
+
+    def __init__(self, annotations_path: str):
+        self.annotations_path = annotations_path
+        self.coco_gt = get_annotation_store(annotations_path).coco()
+        self.detections = dict()
+        self.eval_imgs = dict()
+        self.pending = set()
+        self.first_image_id = None
+        self.last_image_id = None
+
+    def add(self, detections: List[DetectionView]):
+        for detection in detections:
+            if detection.frame_id in self.eval_imgs:
+                raise ValueError(f"Image {detection.frame_id} was already matched")
+            self.detections.setdefault(detection.frame_id, []).append(dict(
+                image_id=detection.frame_id,
+                bbox=[detection.x, detection.y, detection.w, detection.h],
+                score=detection.score,
+                category_id=detection.category,
+                area=detection.w * detection.h,
+                iscrowd=0
+            ))
+            self.pending.add(detection.frame_id)
+
+        if detections:
+            self._extend_range(min(detection.frame_id for detection in detections),
+                               max(detection.frame_id for detection in detections))
+
+    def match(self):
+        self._evaluate_images(sorted(self.pending))
+
+    def image_id_range(self) -> List[int]:
+        return list(range(self.first_image_id, self.last_image_id + 1))
+
+    def evaluate(self, image_ids: List[int]) -> Tuple[float, float]:
+        # Matches of an image don't depend on other images, each image is matched once and its matches are reused
+        # by every evaluation which covers the image.
+        self._evaluate_images([image_id for image_id in image_ids
+                               if image_id in self.pending or image_id not in self.eval_imgs])
+
+        coco_eval = _coco_eval(self.coco_gt, None, image_ids)
+        params = coco_eval.params
+        params.imgIds = list(np.unique(params.imgIds))
+        params.catIds = list(np.unique(params.catIds))
+        params.maxDets = sorted(params.maxDets)
+
+        eval_imgs = [self.eval_imgs[int(image_id)] for image_id in params.imgIds]
+        coco_eval.evalImgs = [image_eval_imgs[idx] for idx in range(len(params.catIds) * len(params.areaRng))
+                              for image_eval_imgs in eval_imgs]
+        coco_eval._paramsEval = copy.deepcopy(params)
+
+        coco_eval.accumulate()
+        coco_eval.summarize()
+
+        eval_results = dict()
+        for metric in METRICS:
+            coco_id = METRIC_TO_COCO_ID[metric]
+            stat = coco_eval.stats[coco_id]
+            eval_results[metric] = float(f'{stat:.4f}')
+        print(f'Bounding box evaluation results: {eval_results}')
+
+        return eval_results['mAP'], eval_results['mAP_50']
+
+    def _evaluate_images(self, image_ids: List[int]):
+        if not image_ids:
+            return
+
+        annotations = []
+        for image_id in image_ids:
+            annotations.extend(self.detections.get(image_id, []))
+        for idx, annotation in enumerate(annotations):
+            annotation['id'] = idx + 1
+
+        coco_dt = COCO()
+        coco_dt.dataset = dict(images=[], annotations=annotations, categories=self.coco_gt.dataset['categories'])
+        coco_dt.createIndex()
+
+        coco_eval = _coco_eval(self.coco_gt, coco_dt, image_ids)
+        coco_eval.evaluate()
+
+        # Per image matches are ordered by category, area range and image.
+        num_images = len(coco_eval.params.imgIds)
+        for idx, image_id in enumerate(coco_eval.params.imgIds):
+            self.eval_imgs[int(image_id)] = coco_eval.evalImgs[idx::num_images]
+            # Detections are only kept until they're matched.
+            self.detections.pop(int(image_id), None)
+        self.pending.difference_update(image_ids)
+
+    def _extend_range(self, first_image_id: int, last_image_id: int):
+        if self.first_image_id is None:
+            self.first_image_id, self.last_image_id = first_image_id, last_image_id
+        else:
+            self.first_image_id = min(self.first_image_id, first_image_id)
+            self.last_image_id = max(self.last_image_id, last_image_id)
+
+    @staticmethod
+    def merge(evaluators: List["Evaluator"]) -> "Evaluator":
+        merged = Evaluator(evaluators[0].annotations_path)
+
+        for evaluator in evaluators:
+            for image_id, detections in evaluator.detections.items():
+                merged.detections[image_id] = merged.detections.get(image_id, []) + detections
+            merged.pending.update(evaluator.pending)
+            if evaluator.first_image_id is not None:
+                merged._extend_range(evaluator.first_image_id, evaluator.last_image_id)
+
+        # Detections of matched images are gone, so an image matched by one evaluator can't be matched again with
+        # the detections of another. Streams process different videos, which means they never share images.
+        for evaluator in evaluators:
+            for image_id, eval_imgs in evaluator.eval_imgs.items():
+                if image_id in merged.eval_imgs or image_id in merged.pending:
+                    raise ValueError(f"Image {image_id} has detections from more than one evaluator, but was already "
+                                     f"matched by one of them")
+                merged.eval_imgs[image_id] = eval_imgs
+
+        return merged
+
+
+def image_id_range(detections: List[DetectionView]) -> List[int]:
+    img_ids = [detection.frame_id for detection in detections]
+    return list(range(min(img_ids), max(img_ids) + 1))
 
 
 def evaluate_detections(detections: List[DetectionView], annotations_path: str) -> Tuple[float, float]:
-    results = [
-        dict(
-            image_id=detection.frame_id,
-            bbox=[detection.x, detection.y, detection.w, detection.h],
-            score=detection.score,
-            category_id=detection.category
-        ) for detection in detections
-    ]
-
-    img_ids = [result['image_id'] for result in results]
-    img_ids_start = min(img_ids)
-    img_ids_end = max(img_ids)
-
-    coco_gt = COCO(annotations_path)
-    coco_dt = coco_gt.loadRes(results)
+    evaluator = Evaluator(annotations_path)
+    evaluator.add(detections)
+    return evaluator.evaluate(image_id_range(detections))
+
+
+def _coco_eval(coco_gt: COCO, coco_dt: Any, image_ids: List[int]) -> COCOeval:
     coco_eval = COCOeval(coco_gt, coco_dt, 'bbox')
-    coco_eval.params.catIds = list(range(0, 10))
-    coco_eval.params.imgIds = list(range(img_ids_start, img_ids_end + 1))
-    coco_eval.params.maxDets = [100, 500, 1000]
-
-    coco_eval.evaluate()
-    coco_eval.accumulate()
-    coco_eval.summarize()
-
-    eval_results = dict()
-    for metric in METRICS:
-        coco_id = METRIC_TO_COCO_ID[metric]
-        stat = coco_eval.stats[coco_id]
-        eval_results[metric] = float(f'{stat:.4f}')
-    print(f'Bounding box evaluation results: {eval_results}')
-
-    return eval_results['mAP'], eval_results['mAP_50']
+    coco_eval.params.catIds = CATEGORY_IDS
+    coco_eval.params.imgIds = image_ids
+    coco_eval.params.maxDets = MAX_DETS
+    return coco_eval
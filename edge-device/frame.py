@@ -1,66 +1,109 @@
-from typing import Union, Iterator, List
+from typing import Union, Iterator, List, Dict, Tuple, Any
 
 import cv2 as cv
 import glob
-import time
 import uuid
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 
-from model import Frame, Dimensions, Image
+from metrics import Metrics
+from model import Frame, Dimensions, Image, resize
+from simulation import Clock
 
+PREFETCH_SIZE = 8
+NUM_WORKERS = 4
 
-def get_frames(video: Union[str, None], images: List[Image], dimensions: Dimensions, max_fps: int) -> Iterator[Frame]:
+
+def get_frames(video: Union[str, None], images: List[Image], dimensions: Dimensions, max_fps: int, clock: Clock,
+               metrics: Metrics, camera: int = 0, prefetch_size: int = PREFETCH_SIZE,
+               num_workers: int = NUM_WORKERS) -> Iterator[Frame]:
     if video is None:
-        video = 'camera'
-        capture = cv.VideoCapture(0)
+        video = 'camera' if camera == 0 else f'camera-{camera}'
+        capture = cv.VideoCapture(camera)
         if not capture.isOpened():
             print("Cannot open capture")
             exit()
 
         while True:
             frame_id = uuid.uuid4().int
-            ret, data = capture.read()
+            with metrics.timer('frame_acquire_seconds'):
+                ret, data = capture.read()
             if not ret:
                 print("Cannot receive frame")
                 capture.release()
                 yield Frame(id=-1, video=video, data=-1, edge_data=-1, cloud_data=-1)
-            edge_data = cv.resize(data, (dimensions.edge_processing_width, dimensions.edge_processing_height),
-                                  interpolation=cv.INTER_LINEAR)
-            cloud_data = cv.resize(data, (dimensions.cloud_processing_width, dimensions.cloud_processing_height),
-                                   interpolation=cv.INTER_LINEAR)
+            edge_data = _resize(data, dimensions, metrics)
 
-            yield Frame(id=frame_id, video=video, data=data, edge_data=edge_data, cloud_data=cloud_data)
+            yield Frame(id=frame_id, video=video, data=data, edge_data=edge_data, dimensions=dimensions)
     else:
-        frame_id = 0
+        files = sorted(glob.glob(video))
+        image_ids = _index_image_ids(images)
 
-        frames = dict()
-        for file in sorted(glob.glob(video)):
-            frames[file] = cv.imread(file)
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            pending: "deque[Future[Tuple[Any, Any]]]" = deque()
+            next_file = 0
 
-        print("Loaded frames")
+            while next_file < len(files) and len(pending) < prefetch_size:
+                pending.append(_submit_load(executor, files[next_file], dimensions, metrics))
+                next_file += 1
 
-        for file in sorted(glob.glob(video)):
-            if len(images) > 0:
-                image = next(filter(lambda img: file.endswith(img.file_name), images))
-                frame_id = image.id
-            else:
-                frame_id = frame_id + 1
+            frame_id = 0
+            for file in files:
+                if image_ids:
+                    frame_id = _find_image_id(file, image_ids)
+                else:
+                    frame_id = frame_id + 1
 
-            data = frames[file]
-            edge_data = cv.resize(data, (dimensions.edge_processing_width, dimensions.edge_processing_height),
-                                  interpolation=cv.INTER_LINEAR)
-            cloud_data = cv.resize(data, (dimensions.cloud_processing_width, dimensions.cloud_processing_height),
-                                   interpolation=cv.INTER_LINEAR)
+                with clock.computing('frame_acquire_seconds'), metrics.timer('frame_acquire_seconds'):
+                    data, edge_data = pending.popleft().result()
+                if next_file < len(files):
+                    pending.append(_submit_load(executor, files[next_file], dimensions, metrics))
+                    next_file += 1
 
-            before = time.time()
-            yield Frame(id=frame_id, video=video, data=data, edge_data=edge_data, cloud_data=cloud_data)
-            after = time.time()
+                before = clock.time()
+                yield Frame(id=frame_id, video=video, data=data, edge_data=edge_data, dimensions=dimensions)
+                after = clock.time()
 
-            _wait_for_next_frame(processing_time=after - before, max_fps=max_fps)
+                _wait_for_next_frame(processing_time=after - before, max_fps=max_fps, clock=clock)
 
         yield Frame(id=-1, video=video, data=-1, edge_data=-1, cloud_data=-1)
 
 
-def _wait_for_next_frame(processing_time: float, max_fps: int):
+def _submit_load(executor: Executor, file: str, dimensions: Dimensions,
+                 metrics: Metrics) -> "Future[Tuple[Any, Any]]":
+    return executor.submit(_load, file, dimensions, metrics)
+
+
+def _load(file: str, dimensions: Dimensions, metrics: Metrics) -> Tuple[Any, Any]:
+    with metrics.timer('frame_read_seconds'):
+        data = cv.imread(file)
+    return data, _resize(data, dimensions, metrics)
+
+
+def _resize(data, dimensions: Dimensions, metrics: Metrics) -> Any:
+    # Every frame is tracked at edge resolution, so it's resized ahead of time. The cloud resolution is computed by
+    # the frame when it's first used.
+    with metrics.timer('frame_resize_seconds'):
+        return resize(data, dimensions.edge_processing_width, dimensions.edge_processing_height)
+
+
+def _index_image_ids(images: List[Image]) -> Dict[str, int]:
+    image_ids = dict()
+    for image in images:
+        image_ids.setdefault(image.file_name.replace("\\", "/"), image.id)
+    return image_ids
+
+
+def _find_image_id(file: str, image_ids: Dict[str, int]) -> int:
+    parts = file.replace("\\", "/").split("/")
+    for start in range(len(parts) - 1, -1, -1):
+        image_id = image_ids.get("/".join(parts[start:]))
+        if image_id is not None:
+            return image_id
+    raise ValueError(f"No image found for {file}")
+
+
+def _wait_for_next_frame(processing_time: float, max_fps: int, clock: Clock):
     remaining_time = (1 / max_fps) - processing_time
     if remaining_time > 0.0:
-        time.sleep(remaining_time)
+        clock.sleep(remaining_time)
@@ -0,0 +1,204 @@
+import cv2 as cv
+import math
+import numpy as np
+import time
+from collections import deque
+from typing import List, Dict, Tuple, Union, Any
+from typing_extensions import Protocol
+
+from metrics import Metrics, BYTE_BUCKETS
+from model import Encoding, EncodedFrame
+from simulation import Clock
+
+FRAME_ENCODINGS = ['fixed', 'adaptive']
+DEFAULT_ENCODING = Encoding('jpg', 90, 1.0)
+
+# Ordered from the best to the cheapest encoding.
+ENCODING_LADDER = [
+    Encoding('png', 100, 1.0),
+    Encoding('jpg', 95, 1.0),
+    Encoding('jpg', 90, 1.0),
+    Encoding('webp', 85, 1.0),
+    Encoding('jpg', 75, 1.0),
+    Encoding('jpg', 75, 0.75),
+    Encoding('webp', 70, 0.75),
+    Encoding('jpg', 60, 0.75),
+    Encoding('jpg', 60, 0.5),
+    Encoding('webp', 50, 0.5),
+    Encoding('jpg', 40, 0.5),
+]
+
+PNG_COMPRESSION = 1
+SMOOTHING = 0.2
+TRANSFER_WINDOW = 30
+MIN_SIZE_SPREAD = 0.1
+
+
+class FrameEncoder(Protocol):
+    def encode(self, image: Any) -> EncodedFrame:
+        ...
+
+    def observe_transfer(self, num_bytes: int, round_trip_time: float):
+        ...
+
+
+class FixedEncoder:
+    encoding: Encoding
+    name: str
+    metrics: Metrics
+    clock: Clock
+
+    def __init__(self, encoding: Encoding, name: str, metrics: Metrics, clock: Clock):
+        self.encoding = encoding
+        self.name = name
+        self.metrics = metrics
+        self.clock = clock
+
+    def encode(self, image: Any) -> EncodedFrame:
+        with self.clock.computing(f'{self.name}_encode_seconds'):
+            encoded = _encode(image, self.encoding)
+        _observe(self.metrics, self.name, encoded)
+        return encoded
+
+    def observe_transfer(self, num_bytes: int, round_trip_time: float):
+        pass
+
+
+class BandwidthEstimator:
+    transfers: "deque[Tuple[int, float]]"
+
+    def __init__(self, window: int = TRANSFER_WINDOW):
+        self.transfers = deque(maxlen=window)
+
+    def observe(self, num_bytes: int, round_trip_time: float):
+        self.transfers.append((num_bytes, round_trip_time))
+
+    def estimate(self) -> Union[Tuple[float, float], None]:
+        if len(self.transfers) < 2:
+            return None
+
+        sizes = np.array([num_bytes for num_bytes, _ in self.transfers], dtype=np.float64)
+        times = np.array([round_trip_time for _, round_trip_time in self.transfers], dtype=np.float64)
+
+        # A round trip is modelled as a fixed latency, e.g. inference and queueing on the server, plus sending the
+        # request at the available bandwidth. Both can only be told apart if the request sizes differ enough.
+        if np.std(sizes) > MIN_SIZE_SPREAD * np.mean(sizes):
+            slope, latency = np.polyfit(sizes, times, 1)
+            if slope > 0:
+                return min(max(latency, 0.0), times.min()), 1 / slope
+
+        return 0.0, sizes.sum() / times.sum()
+
+
+class AdaptiveEncoder:
+    latency_target: float
+    name: str
+    metrics: Metrics
+    clock: Clock
+    ladder: List[Encoding]
+    estimator: BandwidthEstimator
+
+    sizes: Dict[str, float]
+    encode_times: Dict[str, float]
+    size_ratio: float
+    latency: float
+    bandwidth: float
+
+    def __init__(self, latency_target: float, name: str, metrics: Metrics, clock: Clock,
+                 ladder: List[Encoding] = ENCODING_LADDER):
+        self.latency_target = latency_target
+        self.name = name
+        self.metrics = metrics
+        self.clock = clock
+        self.ladder = ladder
+        self.estimator = BandwidthEstimator()
+
+        self.sizes = dict()
+        self.encode_times = dict()
+        self.size_ratio = 1.0
+        self.latency = 0.0
+        self.bandwidth = 0.0
+
+        self.metrics.register_gauge(f'{name}_bandwidth_bytes_per_second', lambda: self.bandwidth)
+        self.metrics.register_gauge(f'{name}_base_latency_seconds', lambda: self.latency)
+
+    def encode(self, image: Any) -> EncodedFrame:
+        if not self.sizes:
+            self._calibrate(image)
+
+        encoding = self._choose()
+        with self.clock.computing(f'{self.name}_encode_seconds'):
+            encoded = _encode(image, encoding)
+
+        # Sizes of the other encodings are predicted from the calibration, scaled by how much larger or smaller the
+        # current content encodes compared to the calibration frame.
+        key = str(encoding)
+        self.size_ratio = encoded.num_bytes / self.sizes[key]
+        self.encode_times[key] = (1 - SMOOTHING) * self.encode_times[key] + SMOOTHING * self._encode_time(encoded)
+
+        _observe(self.metrics, self.name, encoded)
+        self.metrics.with_labels(encoding=key).increment(f'{self.name}_encodings')
+        return encoded
+
+    def observe_transfer(self, num_bytes: int, round_trip_time: float):
+        self.estimator.observe(num_bytes, round_trip_time)
+
+        estimate = self.estimator.estimate()
+        if estimate is not None:
+            self.latency, self.bandwidth = estimate
+
+    def _calibrate(self, image: Any):
+        for encoding in self.ladder:
+            encoded = _encode(image, encoding)
+            self.sizes[str(encoding)] = encoded.num_bytes
+            self.encode_times[str(encoding)] = self._encode_time(encoded)
+
+    def _encode_time(self, encoded: EncodedFrame) -> float:
+        return self.clock.compute_time(f'{self.name}_encode_seconds', encoded.encode_time)
+
+    def _choose(self) -> Encoding:
+        if self.bandwidth == 0.0:
+            return DEFAULT_ENCODING if DEFAULT_ENCODING in self.ladder else self.ladder[-1]
+
+        fastest = self.ladder[-1]
+        fastest_time = math.inf
+        for encoding in self.ladder:
+            predicted_time = self._predict_time(encoding)
+            if predicted_time <= self.latency_target:
+                return encoding
+            if predicted_time < fastest_time:
+                fastest, fastest_time = encoding, predicted_time
+        return fastest
+
+    def _predict_time(self, encoding: Encoding) -> float:
+        key = str(encoding)
+        return self.encode_times[key] + self.latency + self.sizes[key] * self.size_ratio / self.bandwidth
+
+
+def get_frame_encoder(frame_encoding: str, latency_target: float, name: str, metrics: Metrics,
+                      clock: Clock) -> FrameEncoder:
+    if frame_encoding == 'adaptive':
+        return AdaptiveEncoder(latency_target, name, metrics, clock)
+    return FixedEncoder(DEFAULT_ENCODING, name, metrics, clock)
+
+
+def _encode(image: Any, encoding: Encoding) -> EncodedFrame:
+    start = time.perf_counter()
+    if encoding.scale != 1.0:
+        image = cv.resize(image, None, fx=encoding.scale, fy=encoding.scale, interpolation=cv.INTER_AREA)
+    data = cv.imencode(f".{encoding.codec}", image, _encode_params(encoding))[1]
+    return EncodedFrame(data=data, encoding=encoding, encode_time=time.perf_counter() - start)
+
+
+def _encode_params(encoding: Encoding) -> List[int]:
+    if encoding.codec == 'jpg':
+        return [int(cv.IMWRITE_JPEG_QUALITY), encoding.quality]
+    elif encoding.codec == 'webp':
+        return [int(cv.IMWRITE_WEBP_QUALITY), encoding.quality]
+    else:
+        return [int(cv.IMWRITE_PNG_COMPRESSION), PNG_COMPRESSION]
+
+
+def _observe(metrics: Metrics, name: str, encoded: EncodedFrame):
+    metrics.observe(f'{name}_encode_seconds', encoded.encode_time)
+    metrics.observe(f'{name}_request_bytes', encoded.num_bytes, BYTE_BUCKETS)
@@ -0,0 +1,150 @@
+import numpy as np
+import os
+from collections import deque
+from multiprocessing import Lock
+from multiprocessing.shared_memory import SharedMemory
+from typing import Tuple, List, Union, Any
+
+from model import Frame, FrameSlot
+
+HEADER_ALIGNMENT = 64
+
+
+class SharedFrameRing:
+    capacity: int
+    shape: Tuple[int, int, int]
+    lock: Any
+    shared_memory: SharedMemory
+    owner_pid: Union[int, None]
+
+    ref_counts: Any
+    frames: Any
+    next_slot: int
+
+    def __init__(self, capacity: int, shape: Tuple[int, int, int]):
+        self.capacity = capacity
+        self.shape = shape
+        self.lock = Lock()
+        self.shared_memory = SharedMemory(create=True, size=_size(capacity, shape))
+        self.owner_pid = os.getpid()
+        self._map()
+
+        self.ref_counts[:] = 0
+
+    def __getstate__(self):
+        return dict(capacity=self.capacity, shape=self.shape, lock=self.lock, name=self.shared_memory.name)
+
+    def __setstate__(self, state):
+        self.capacity = state['capacity']
+        self.shape = state['shape']
+        self.lock = state['lock']
+        self.shared_memory = SharedMemory(name=state['name'])
+        self.owner_pid = None
+        self._map()
+
+    def write(self, data) -> Union[int, None]:
+        with self.lock:
+            slot = self._find_free_slot()
+            if slot is None:
+                return None
+            self.ref_counts[slot] = 1
+
+        self.frames[slot] = data
+        return slot
+
+    def write_frame(self, frame: Frame) -> Union[FrameSlot, None]:
+        slot = self.write(frame.edge_data)
+        if slot is None:
+            return None
+        return FrameSlot(frame.id, frame.video, slot)
+
+    def acquire(self, slots: List[int]):
+        with self.lock:
+            for slot in slots:
+                self.ref_counts[slot] += 1
+
+    def release(self, slots: List[int]):
+        with self.lock:
+            for slot in slots:
+                self.ref_counts[slot] -= 1
+
+    def get(self, slot: int):
+        return self.frames[slot]
+
+    def close(self):
+        self.ref_counts = None
+        self.frames = None
+        self.shared_memory.close()
+        if self.owner_pid == os.getpid():
+            self.shared_memory.unlink()
+
+    def _map(self):
+        self.ref_counts = np.ndarray((self.capacity,), dtype=np.int32, buffer=self.shared_memory.buf)
+        self.frames = np.ndarray((self.capacity, *self.shape), dtype=np.uint8, buffer=self.shared_memory.buf,
+                                 offset=_header_size(self.capacity))
+        self.next_slot = 0
+
+    def _find_free_slot(self) -> Union[int, None]:
+        for offset in range(self.capacity):
+            slot = (self.next_slot + offset) % self.capacity
+            if self.ref_counts[slot] == 0:
+                self.next_slot = (slot + 1) % self.capacity
+                return slot
+        return None
+
+
+class FrameBacklog:
+    frame_ring: SharedFrameRing
+    max_frames: Union[int, None]
+
+    frame_slots: "deque[Union[FrameSlot, None]]"
+    frames: "deque[Frame]"
+
+    def __init__(self, frame_ring: SharedFrameRing, max_frames: Union[int, None] = None):
+        self.frame_ring = frame_ring
+        self.max_frames = max_frames
+        self.frame_slots = deque()
+        self.frames = deque()
+
+    def append(self, frame: Frame, frame_slot: Union[FrameSlot, None]):
+        # Frames in the backlog are views of the frame ring, they don't keep the full frame alive. If the frame ring was
+        # full, the frame's own edge resolution is kept instead.
+        if frame_slot is not None:
+            self.frame_ring.acquire([frame_slot.slot])
+            edge_data = self.frame_ring.get(frame_slot.slot)
+        else:
+            edge_data = frame.edge_data
+
+        self.frame_slots.append(frame_slot)
+        self.frames.append(Frame(id=frame.id, video=frame.video, data=None, edge_data=edge_data))
+
+        while self.max_frames is not None and len(self.frames) > self.max_frames:
+            self._release(self.frame_slots.popleft())
+            self.frames.popleft()
+
+    def recorded_slots(self) -> List[FrameSlot]:
+        return [frame_slot for frame_slot in self.frame_slots if frame_slot is not None]
+
+    def clear(self):
+        self.frame_ring.release([frame_slot.slot for frame_slot in self.recorded_slots()])
+        self.frame_slots.clear()
+        self.frames.clear()
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __getitem__(self, idx: int) -> Frame:
+        return self.frames[idx]
+
+    def _release(self, frame_slot: Union[FrameSlot, None]):
+        if frame_slot is not None:
+            self.frame_ring.release([frame_slot.slot])
+
+
+def _header_size(capacity: int) -> int:
+    size = capacity * np.dtype(np.int32).itemsize
+    return -(-size // HEADER_ALIGNMENT) * HEADER_ALIGNMENT
+
+
+def _size(capacity: int, shape: Tuple[int, int, int]) -> int:
+    return _header_size(capacity) + capacity * int(np.prod(shape))
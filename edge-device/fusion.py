@@ -1,58 +1,189 @@
+import numpy as np
 from pycocotools.coco import maskUtils as mask
 from scipy.optimize import linear_sum_assignment
-from typing import List
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from typing import Tuple, Union, Any
 
-from model import Detection, DetectionType, DetectionsWithTypes
+from model import DetectionBatch, DetectionType
 
+IOU_THRESHOLD = 0.5
+MAX_DENSE_PAIRS = 400 * 400
+# In crowded scenes most boxes overlap, then the full IoU matrix is assigned instead once the grid finds more than
+# this share of all pairs, or one component holds more than this share of all detections.
+MAX_CANDIDATE_SHARE = 0.1
+MAX_COMPONENT_SHARE = 0.5
 
-def fuse_edge_cloud_detections(current_detections: List[Detection],
-                               new_detections: List[Detection],
-                               new_type: DetectionType) -> DetectionsWithTypes:
+
+def fuse_edge_cloud_detections(current_detections: DetectionBatch,
+                               new_detections: DetectionBatch,
+                               new_type: DetectionType) -> DetectionBatch:
     if not current_detections:
-        return [(detection, new_type) for detection in new_detections]
+        return _with_type(new_detections, new_type)
 
     if not new_detections:
-        return []
+        return DetectionBatch.empty()
+
+    current_ind, new_ind = match_detections(current_detections.bboxes, new_detections.bboxes)
+
+    if new_type == DetectionType.CLOUD:
+        fused_bboxes = current_detections.bboxes[current_ind]
+        fused_categories = new_detections.categories[new_ind]
+    else:
+        fused_bboxes = new_detections.bboxes[new_ind]
+        fused_categories = current_detections.categories[current_ind]
+
+    # The result holds the fused detections in the order of their current detections, then the unmatched new
+    # detections, then the unmatched current detections, which are only kept when fusing cloud into edge detections.
+    unmatched_new = np.setdiff1d(np.arange(len(new_detections)), new_ind)
+    unmatched_current = np.setdiff1d(np.arange(len(current_detections)), current_ind)
+    if new_type != DetectionType.CLOUD:
+        unmatched_current = unmatched_current[:0]
+
+    return DetectionBatch(
+        bboxes=np.concatenate([fused_bboxes, new_detections.bboxes[unmatched_new],
+                               current_detections.bboxes[unmatched_current]]),
+        scores=np.concatenate([new_detections.scores[new_ind], new_detections.scores[unmatched_new],
+                               current_detections.scores[unmatched_current]]),
+        categories=np.concatenate([fused_categories, new_detections.categories[unmatched_new],
+                                   current_detections.categories[unmatched_current]]),
+        types=np.concatenate([
+            np.full(len(new_ind) + len(unmatched_new), new_type.value, dtype=np.int8),
+            np.full(len(unmatched_current), DetectionType.EDGE.value, dtype=np.int8)
+        ])
+    )
+
+
+def _with_type(detections: DetectionBatch, det_type: DetectionType) -> DetectionBatch:
+    return DetectionBatch(
+        bboxes=detections.bboxes,
+        scores=detections.scores,
+        categories=detections.categories,
+        types=np.full(len(detections), det_type.value, dtype=np.int8)
+    )
+
 
-    current_detection_bboxes = [detection.bbox for detection in current_detections]
-    new_detection_bboxes = [detection.bbox for detection in new_detections]
+def match_detections(current_bboxes, new_bboxes) -> Tuple[Any, Any]:
+    # Returns the matched pairs, ordered by current detection. They maximise the summed IoU of pairs with an IoU of
+    # at least the threshold, like an assignment on the full IoU matrix. If several assignments reach the same sum,
+    # e.g. for boxes with identical IoUs, each component can pick another one of them than the full assignment.
+    num_current = len(current_bboxes)
+    if num_current * len(new_bboxes) <= MAX_DENSE_PAIRS:
+        return _match_dense(current_bboxes, new_bboxes)
 
-    diff = len(current_detection_bboxes) - len(new_detection_bboxes)
-    if diff < 0:
-        current_detection_bboxes.extend([[0, 0, 0, 0]] * (diff * (-1)))
-    elif diff > 0:
-        new_detection_bboxes.extend([[0, 0, 0, 0]] * diff)
+    candidates = _grid_candidates(current_bboxes, new_bboxes)
+    if candidates is None:
+        return _match_dense(current_bboxes, new_bboxes)
 
-    M = mask.iou(current_detection_bboxes, new_detection_bboxes, [0] * len(new_detection_bboxes))
-    M[M < 0.5] = 0
+    current_ind, new_ind = candidates
+    iou = _iou(current_bboxes[current_ind], new_bboxes[new_ind])
+    gated = iou >= IOU_THRESHOLD
+    current_ind, new_ind, iou = current_ind[gated], new_ind[gated], iou[gated]
+    if not len(iou):
+        return current_ind, new_ind
 
+    # Pairs below the threshold never match, so detections only compete for matches within a connected component
+    # of the remaining pairs, and each component is assigned on its own.
+    num_nodes = num_current + len(new_bboxes)
+    graph = coo_matrix((np.ones(len(iou)), (current_ind, num_current + new_ind)), shape=(num_nodes, num_nodes))
+    _, labels = connected_components(graph, directed=False)
+    if np.bincount(labels).max() > MAX_COMPONENT_SHARE * num_nodes:
+        return _match_dense(current_bboxes, new_bboxes)
+
+    pair_labels = labels[current_ind]
+    order = np.argsort(pair_labels, kind='stable')
+    current_ind, new_ind, iou, pair_labels = current_ind[order], new_ind[order], iou[order], pair_labels[order]
+    starts = np.flatnonzero(np.r_[True, pair_labels[1:] != pair_labels[:-1]])
+    ends = np.r_[starts[1:], len(pair_labels)]
+
+    # A component of a single pair is matched as it is.
+    single = ends - starts == 1
+    matched_current = [current_ind[starts[single]]]
+    matched_new = [new_ind[starts[single]]]
+    for start, end in zip(starts[~single].tolist(), ends[~single].tolist()):
+        rows, row_ind = np.unique(current_ind[start:end], return_inverse=True)
+        cols, col_ind = np.unique(new_ind[start:end], return_inverse=True)
+        M = np.zeros((len(rows), len(cols)))
+        M[row_ind, col_ind] = iou[start:end]
+        assigned_rows, assigned_cols = linear_sum_assignment(M, maximize=True)
+        paired = M[assigned_rows, assigned_cols] != 0
+        matched_current.append(rows[assigned_rows[paired]])
+        matched_new.append(cols[assigned_cols[paired]])
+
+    current_ind = np.concatenate(matched_current)
+    new_ind = np.concatenate(matched_new)
+    order = np.argsort(current_ind)
+    return current_ind[order], new_ind[order]
+
+
+def _match_dense(current_bboxes, new_bboxes) -> Tuple[Any, Any]:
+    M = mask.iou(np.asarray(current_bboxes, dtype=np.float64), np.asarray(new_bboxes, dtype=np.float64),
+                 [0] * len(new_bboxes))
+    M[M < IOU_THRESHOLD] = 0
     current_ind, new_ind = linear_sum_assignment(M, maximize=True)
-    result = []
-
-    for i, j in zip(current_ind, new_ind):
-        if M[i, j] != 0:
-            category = ""
-            bbox = []
-            if new_type == DetectionType.CLOUD:
-                category = new_detections[j].category
-                bbox = current_detections[i].bbox
-            if new_type == DetectionType.EDGE:
-                category = current_detections[i].category
-                bbox = new_detections[j].bbox
-            score = new_detections[j].score
-            result.append((Detection(category=category, score=score, bbox=bbox), new_type))
-        else:
-            if j < len(new_detections):
-                detection = new_detections[j]
-                result.append(
-                    (Detection(category=detection.category, score=detection.score, bbox=detection.bbox), new_type)
-                )
-
-            if i < len(current_detections) and new_type == DetectionType.CLOUD:
-                detection = current_detections[i]
-                result.append((
-                    Detection(category=detection.category, score=detection.score, bbox=detection.bbox),
-                    DetectionType.EDGE
-                ))
-
-    return result
+    paired = M[current_ind, new_ind] != 0
+    return current_ind[paired], new_ind[paired]
+
+
+def _grid_candidates(current_bboxes, new_bboxes) -> Union[Tuple[Any, Any], None]:
+    sizes = np.concatenate([current_bboxes[:, 2:4], new_bboxes[:, 2:4]]).max(axis=1)
+    cell_size = max(float(np.median(sizes)), 1.0)
+
+    current_cells, current_owners = _grid_cells(current_bboxes, cell_size)
+    new_cells, new_owners = _grid_cells(new_bboxes, cell_size)
+    order = np.argsort(new_cells, kind='stable')
+    new_cells, new_owners = new_cells[order], new_owners[order]
+
+    starts = np.searchsorted(new_cells, current_cells, side='left')
+    counts = np.searchsorted(new_cells, current_cells, side='right') - starts
+    if counts.sum() > MAX_CANDIDATE_SHARE * len(current_bboxes) * len(new_bboxes):
+        return None
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    cells = np.repeat(current_cells, counts)
+    current_ind = np.repeat(current_owners, counts)
+    new_ind = new_owners[np.repeat(starts, counts) + offsets]
+
+    # Overlapping boxes share every cell their intersection covers; keeping only the cell holding the intersection's
+    # top-left corner reports each pair once.
+    corners = np.maximum(current_bboxes[current_ind, 0:2], new_bboxes[new_ind, 0:2])
+    first = _cell_keys(corners[:, 0], corners[:, 1], cell_size) == cells
+    return current_ind[first], new_ind[first]
+
+
+def _grid_cells(bboxes, cell_size: float) -> Tuple[Any, Any]:
+    x0 = _cell_index(bboxes[:, 0], cell_size)
+    y0 = _cell_index(bboxes[:, 1], cell_size)
+    x1 = np.maximum(_cell_index(bboxes[:, 0] + bboxes[:, 2], cell_size), x0)
+    y1 = np.maximum(_cell_index(bboxes[:, 1] + bboxes[:, 3], cell_size), y0)
+
+    columns = x1 - x0 + 1
+    counts = columns * (y1 - y0 + 1)
+    owners = np.repeat(np.arange(len(bboxes)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    cell_x = x0[owners] + offsets % columns[owners]
+    cell_y = y0[owners] + offsets // columns[owners]
+    return (cell_x << 32) + cell_y, owners
+
+
+def _cell_keys(x, y, cell_size: float):
+    return (_cell_index(x, cell_size) << 32) + _cell_index(y, cell_size)
+
+
+def _cell_index(coordinate, cell_size: float):
+    return np.floor(coordinate / cell_size).astype(np.int64)
+
+
+def _iou(current_bboxes, new_bboxes):
+    # Same arithmetic as pycocotools' bbox IoU, so the threshold gates exactly the same pairs.
+    w = np.minimum(current_bboxes[:, 2] + current_bboxes[:, 0], new_bboxes[:, 2] + new_bboxes[:, 0]) - \
+        np.maximum(current_bboxes[:, 0], new_bboxes[:, 0])
+    h = np.minimum(current_bboxes[:, 3] + current_bboxes[:, 1], new_bboxes[:, 3] + new_bboxes[:, 1]) - \
+        np.maximum(current_bboxes[:, 1], new_bboxes[:, 1])
+    overlap = (w > 0) & (h > 0)
+
+    intersection = w * h
+    union = current_bboxes[:, 2] * current_bboxes[:, 3] + new_bboxes[:, 2] * new_bboxes[:, 3] - intersection
+    return np.divide(intersection, union, out=np.zeros(len(intersection)), where=overlap)
+
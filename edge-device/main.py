@@ -1,16 +1,51 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 
 from cloud_server import CloudServer
-from detection import EdgeCloudObjectDetector
-from edge_device import EdgeDevice
-from edge_server import EdgeServer
+from detection import EdgeCloudObjectDetector, FRAME_RING_CAPACITY_FACTOR
+from detection_rate import get_detection_rate_controller
+from edge_device import EdgeDevice, Stream
+from edge_server import EdgeServer, EdgeServerConnection
+from frame_encoding import FRAME_ENCODINGS, get_frame_encoder
+from http_client import HttpClient
+from metrics import Metrics, start_metrics_server
 from model import Dimensions
+from offload import get_offload_scheduler
+from process import CloudTrackingWorker
+from render import RenderThread, get_renderer
+from response_trace import TraceRecorder, Trace, ReplayEdgeServer, ReplayCloudServer
+from results import RESULT_FORMATS, get_result_writer
+from simulation import get_clock, get_latency
 from track import MultiObjectTracker
+from tracker_engine import TRACKER_ENGINES
+from wire import WIRE_FORMATS, WIRE_FORMAT_BINARY
 
 
-def main(videos: Union[str, None], annotations_path: Union[str, None], detection_rate: int, ipc: bool, sync: bool):
-    print(f"Got: detection-rate={detection_rate}, ipc={ipc}, sync={sync}")
+def main(videos: Union[str, None], annotations_path: Union[str, None], detection_rate: int, ipc: bool, sync: bool,
+         tracker: str, tracker_workers: int, wire_format: str, headless: bool, render_thread: bool,
+         metrics_port: Union[int, None], metrics_snapshot: str, streams: int, adaptive_detection_rate: bool,
+         target_fps: float, min_detection_rate: int, max_detection_rate: int, content_aware_offload: bool,
+         offload_requests_per_minute: Union[int, None], offload_megabytes_per_minute: Union[float, None],
+         frame_encoding: str, edge_latency_target_ms: float, cloud_latency_target_ms: float, results_format: str,
+         results: Union[str, None], simulate: bool, simulated_latencies: Union[str, None],
+         simulated_edge_latency_ms: float, simulated_edge_jitter_ms: float, simulated_cloud_latency_ms: float,
+         simulated_cloud_jitter_ms: float, simulated_uplink_mbps: Union[float, None], seed: int,
+         record_trace: Union[str, None], replay_trace: Union[str, None]):
+    print(f"Got: detection-rate={detection_rate}, ipc={ipc}, sync={sync}, tracker={tracker}, "
+          f"tracker-workers={tracker_workers}, wire-format={wire_format}, headless={headless}, "
+          f"render-thread={render_thread}, metrics-port={metrics_port}, metrics-snapshot={metrics_snapshot}, "
+          f"streams={streams}, adaptive-detection-rate={adaptive_detection_rate}, target-fps={target_fps}, "
+          f"min-detection-rate={min_detection_rate}, max-detection-rate={max_detection_rate}, "
+          f"content-aware-offload={content_aware_offload}, offload-requests-per-minute={offload_requests_per_minute}, "
+          f"offload-megabytes-per-minute={offload_megabytes_per_minute}, frame-encoding={frame_encoding}, "
+          f"edge-latency-target-ms={edge_latency_target_ms}, cloud-latency-target-ms={cloud_latency_target_ms}, "
+          f"results-format={results_format}, results={results}, simulate={simulate}, "
+          f"simulated-latencies={simulated_latencies}, simulated-edge-latency-ms={simulated_edge_latency_ms}, "
+          f"simulated-edge-jitter-ms={simulated_edge_jitter_ms}, "
+          f"simulated-cloud-latency-ms={simulated_cloud_latency_ms}, "
+          f"simulated-cloud-jitter-ms={simulated_cloud_jitter_ms}, simulated-uplink-mbps={simulated_uplink_mbps}, "
+          f"seed={seed}, record-trace={record_trace}, replay-trace={replay_trace}")
 
     dimensions = Dimensions(
         edge_processing_width=640,
@@ -20,24 +55,116 @@ def main(videos: Union[str, None], annotations_path: Union[str, None], detection
     )
     max_fps = 24
 
-    object_tracker = MultiObjectTracker(min_score=20, drop=False)
+    trace_recorder = TraceRecorder(record_trace) if record_trace is not None else None
+    # Adapting the detection rate or the cloud offloads to the replayed responses changes which frames are requested.
+    trace = Trace(replay_trace, tolerant=adaptive_detection_rate or content_aware_offload) \
+        if replay_trace is not None else None
 
-    edge_server = EdgeServer(ipc)
-    edge_server.connect()
+    metrics = Metrics('vate_edge_device')
+    metrics_server = start_metrics_server(metrics, metrics_port)
 
-    cloud_server = CloudServer(
-        detection_model_url="http://127.0.0.1:9093/predictions/faster_rcnn_visdrone",
-        detection_timeout=30
+    cloud_tracking = CloudTrackingWorker(
+        frame_ring_capacity=FRAME_RING_CAPACITY_FACTOR * max_fps * streams,
+        frame_shape=(dimensions.edge_processing_height, dimensions.edge_processing_width, 3),
+        engine=tracker,
+        num_workers=tracker_workers,
+        verbose=not headless
     )
+    cloud_tracking.start()
 
-    object_detector = EdgeCloudObjectDetector(edge_server, cloud_server, dimensions, cloud_tracking_min_score=20,
-                                              cloud_tracking_stride=2, max_fps=max_fps)
-    object_detector.start_cloud_tracking()
+    # Streams share one connection to the edge server, the HTTP connection pool to the cloud server, the threads
+    # waiting for cloud detections and the cloud tracking worker. Trackers and detection state are per stream.
+    edge_server_connection = None
+    if streams > 1 and replay_trace is None:
+        edge_server_connection = EdgeServerConnection(ipc)
+        edge_server_connection.start()
 
-    edge_device = EdgeDevice(dimensions, max_fps, detection_rate, object_tracker, object_detector, sync)
-    edge_device.process(videos, annotations_path)
+    http_client = HttpClient(max_connections=max(4, streams))
+    executor = ThreadPoolExecutor()
+    # More than one window can only be kept up to date from a render thread, which shows the windows of all streams.
+    shared_render_thread = RenderThread() if render_thread or streams > 1 else None
 
-    object_detector.stop_cloud_tracking()
+    edge_device_streams = []
+    for stream_id in range(streams):
+        stream_metrics = metrics.with_labels(stream=str(stream_id)) if streams > 1 else metrics
+
+        object_tracker = MultiObjectTracker(min_score=20, drop=False, engine=tracker, num_workers=tracker_workers)
+
+        # Every stream has its own clock, simulated clocks of different streams move forward independently.
+        clock = get_clock(simulate, simulated_latencies)
+        edge_latency, cloud_latency = None, None
+        # Replayed responses arrive after their recorded round-trip times instead.
+        if simulate and trace is None:
+            edge_latency = get_latency('edge', simulated_edge_latency_ms, simulated_edge_jitter_ms,
+                                       simulated_uplink_mbps, simulated_latencies, seed + 2 * stream_id)
+            cloud_latency = get_latency('cloud', simulated_cloud_latency_ms, simulated_cloud_jitter_ms,
+                                        simulated_uplink_mbps, simulated_latencies, seed + 2 * stream_id + 1)
+
+        if trace is not None:
+            edge_server = ReplayEdgeServer(trace, clock, stream_metrics)
+            cloud_server = ReplayCloudServer(trace, clock, stream_metrics, verbose=not headless)
+        else:
+            edge_encoder = get_frame_encoder(frame_encoding, edge_latency_target_ms / 1000, 'edge', stream_metrics,
+                                             clock)
+            edge_server = EdgeServer(ipc, wire_format, edge_encoder, clock, stream_metrics, verbose=not headless,
+                                     connection=edge_server_connection, latency=edge_latency, trace=trace_recorder)
+            cloud_server = CloudServer(
+                detection_model_url="http://127.0.0.1:9093/predictions/faster_rcnn_visdrone",
+                http_client=http_client,
+                encoder=get_frame_encoder(frame_encoding, cloud_latency_target_ms / 1000, 'cloud', stream_metrics,
+                                          clock),
+                clock=clock,
+                metrics=stream_metrics,
+                latency=cloud_latency,
+                trace=trace_recorder,
+                verbose=not headless
+            )
+        edge_server.connect()
+
+        offload_scheduler = get_offload_scheduler(content_aware_offload, offload_requests_per_minute,
+                                                  offload_megabytes_per_minute, clock)
+
+        object_detector = EdgeCloudObjectDetector(edge_server, cloud_server, executor, cloud_detection_deadline=30,
+                                                  dimensions=dimensions, cloud_tracking=cloud_tracking,
+                                                  cloud_tracking_identity=f"edge-device-{stream_id}",
+                                                  cloud_tracking_min_score=20, cloud_tracking_stride=2,
+                                                  max_fps=max_fps, offload_scheduler=offload_scheduler,
+                                                  clock=clock, metrics=stream_metrics, verbose=not headless)
+        object_detector.start_cloud_tracking()
+
+        rate_controller = get_detection_rate_controller(adaptive_detection_rate, detection_rate, min_detection_rate,
+                                                        max_detection_rate, target_fps, sync, stream_metrics)
+
+        renderer = get_renderer(headless, shared_render_thread,
+                                window='frame' if streams == 1 else f'frame-{stream_id}')
+
+        edge_device_streams.append(Stream(stream_id, object_tracker, object_detector, rate_controller, renderer,
+                                          clock, stream_metrics))
+
+    metrics.register_gauge('http_requests', lambda: http_client.stats()['requests'])
+    metrics.register_gauge('http_connections', lambda: http_client.stats()['connections'])
+
+    edge_device = EdgeDevice(dimensions, max_fps, edge_device_streams, sync, verbose=not headless,
+                             result_writer=get_result_writer(results_format, results))
+    try:
+        edge_device.process(videos, annotations_path)
+    finally:
+        for stream in edge_device_streams:
+            stream.object_detector.stop_cloud_tracking()
+        cloud_tracking.stop()
+        if edge_server_connection is not None:
+            edge_server_connection.close()
+        # Cloud requests still in flight are waited for when recording, so the trace has all their responses.
+        executor.shutdown(wait=trace_recorder is not None)
+        if trace_recorder is not None:
+            trace_recorder.close()
+
+        print(f"HTTP connection stats: {http_client.stats()}")
+        print(f"Writing metrics snapshot to {metrics_snapshot}")
+        metrics.write_snapshot(metrics_snapshot)
+        if metrics_server is not None:
+            metrics_server.stop()
+        http_client.close()
 
 
 if __name__ == '__main__':
@@ -48,6 +175,70 @@ if __name__ == '__main__':
                         help="rate for edge-server detection requests")
     parser.add_argument('--ipc', action='store_true', help="use ipc for communication with edge-server")
     parser.add_argument('--sync', action='store_true', help="wait for edge-server detection responses")
+    parser.add_argument('--tracker', choices=TRACKER_ENGINES, default='mosse', help="object tracker engine")
+    parser.add_argument('--tracker-workers', type=int, default=1,
+                        help="number of threads updating object trackers")
+    parser.add_argument('--wire-format', choices=WIRE_FORMATS, default=WIRE_FORMAT_BINARY,
+                        help="preferred format of edge-server detection responses")
+    display_group = parser.add_mutually_exclusive_group()
+    display_group.add_argument('--headless', action='store_true',
+                               help="don't display frames and don't log per frame")
+    display_group.add_argument('--render-thread', action='store_true',
+                               help="display frames from a separate thread, dropping frames it can't keep up with")
+    parser.add_argument('--metrics-port', type=int, help="port serving metrics in Prometheus text format")
+    parser.add_argument('--metrics-snapshot', default='edge_device_metrics.json',
+                        help="file the metrics are written to at shutdown")
+    parser.add_argument('--streams', type=int, default=1,
+                        help="number of streams processed at the same time, videos are spread over the streams")
+    parser.add_argument('--adaptive-detection-rate', action='store_true',
+                        help="adjust the detection rate at runtime to hold the target FPS")
+    parser.add_argument('--target-fps', type=float, default=20, help="FPS held by the adaptive detection rate")
+    parser.add_argument('--min-detection-rate', type=int, default=1, help="lowest adaptive detection rate")
+    parser.add_argument('--max-detection-rate', type=int, default=15, help="highest adaptive detection rate")
+    parser.add_argument('--content-aware-offload', action='store_true',
+                        help="send frames to the cloud server only when the scene has changed")
+    parser.add_argument('--offload-requests-per-minute', type=int,
+                        help="most cloud server requests per minute of the content-aware offload")
+    parser.add_argument('--offload-megabytes-per-minute', type=float,
+                        help="most megabytes sent to the cloud server per minute of the content-aware offload")
+    parser.add_argument('--frame-encoding', choices=FRAME_ENCODINGS, default='fixed',
+                        help="encoding of frames sent to the edge-server and the cloud-server")
+    parser.add_argument('--edge-latency-target-ms', type=float, default=100,
+                        help="edge-server round-trip time the adaptive frame encoding aims for")
+    parser.add_argument('--cloud-latency-target-ms', type=float, default=1000,
+                        help="cloud-server round-trip time the adaptive frame encoding aims for")
+    parser.add_argument('--results-format', choices=RESULT_FORMATS, default='npz',
+                        help="format of the detections written when annotations are given")
+    parser.add_argument('--results', help="where detections are written, detections/ or detections.jsonl by default")
+    parser.add_argument('--simulate', action='store_true',
+                        help="process videos as fast as possible on a simulated clock, with simulated server latencies")
+    parser.add_argument('--simulated-latencies',
+                        help="metrics snapshot of an earlier run whose round-trip and compute times are simulated")
+    parser.add_argument('--simulated-edge-latency-ms', type=float, default=40, help="mean simulated edge latency")
+    parser.add_argument('--simulated-edge-jitter-ms', type=float, default=10,
+                        help="standard deviation of the simulated edge latency")
+    parser.add_argument('--simulated-cloud-latency-ms', type=float, default=250, help="mean simulated cloud latency")
+    parser.add_argument('--simulated-cloud-jitter-ms', type=float, default=50,
+                        help="standard deviation of the simulated cloud latency")
+    parser.add_argument('--simulated-uplink-mbps', type=float, help="simulated uplink bandwidth, unlimited by default")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the simulated latencies")
+    trace_group = parser.add_mutually_exclusive_group()
+    trace_group.add_argument('--record-trace', help="file the edge and cloud server responses are recorded to")
+    trace_group.add_argument('--replay-trace',
+                             help="file of recorded responses which are replayed instead of using the servers")
     args = parser.parse_args()
 
-    main(args.videos, args.annotations, args.detection_rate, args.ipc, args.sync)
+    if args.simulate and args.videos is None:
+        parser.error("--simulate needs videos, the camera can't be simulated")
+    if (args.record_trace is not None or args.replay_trace is not None) and args.videos is None:
+        parser.error("traces need videos, the frames of the camera can't be replayed")
+
+    main(args.videos, args.annotations, args.detection_rate, args.ipc, args.sync, args.tracker, args.tracker_workers,
+         args.wire_format, args.headless, args.render_thread, args.metrics_port, args.metrics_snapshot,
+         args.streams, args.adaptive_detection_rate, args.target_fps, args.min_detection_rate,
+         args.max_detection_rate, args.content_aware_offload, args.offload_requests_per_minute,
+         args.offload_megabytes_per_minute, args.frame_encoding, args.edge_latency_target_ms,
+         args.cloud_latency_target_ms, args.results_format, args.results, args.simulate, args.simulated_latencies,
+         args.simulated_edge_latency_ms, args.simulated_edge_jitter_ms, args.simulated_cloud_latency_ms,
+         args.simulated_cloud_jitter_ms, args.simulated_uplink_mbps, args.seed, args.record_trace,
+         args.replay_trace)
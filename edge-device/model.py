@@ -1,6 +1,8 @@
+import cv2 as cv
+import numpy as np
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, List, Dict, Tuple
+from typing import Any, List, Dict, Union
 
 
 @dataclass
@@ -9,13 +11,49 @@ class Image:
     file_name: str
 
 
-@dataclass
 class Frame:
     id: int
     video: str
     data: Any
-    edge_data: Any
-    cloud_data: Any
+    dimensions: Union["Dimensions", None]
+
+    _edge_data: Any
+    _cloud_data: Any
+
+    def __init__(self, id: int, video: str, data: Any, edge_data: Any = None, cloud_data: Any = None,
+                 dimensions: Union["Dimensions", None] = None):
+        self.id = id
+        self.video = video
+        self.data = data
+        self.dimensions = dimensions
+        self._edge_data = edge_data
+        self._cloud_data = cloud_data
+
+    # Resized frames are only computed when they are used for the first time. Most frames never go to the cloud
+    # server, so their cloud resolution is usually never computed.
+    @property
+    def edge_data(self) -> Any:
+        if self._edge_data is None:
+            self._edge_data = resize(self.data, self.dimensions.edge_processing_width,
+                                     self.dimensions.edge_processing_height)
+        return self._edge_data
+
+    @property
+    def cloud_data(self) -> Any:
+        if self._cloud_data is None:
+            self._cloud_data = resize(self.data, self.dimensions.cloud_processing_width,
+                                      self.dimensions.cloud_processing_height)
+        return self._cloud_data
+
+    def __repr__(self) -> str:
+        return f"Frame(id={self.id}, video={self.video})"
+
+
+@dataclass
+class FrameSlot:
+    id: int
+    video: str
+    slot: int
 
 
 @dataclass
@@ -32,10 +70,84 @@ class DetectionType(Enum):
 
 
 @dataclass
-class Detection:
-    category: str
-    score: int
-    bbox: List[float]
+class DetectionBatch:
+    bboxes: Any
+    scores: Any
+    categories: Any
+    types: Any
+
+    @staticmethod
+    def create(bboxes, scores, categories, det_type: DetectionType) -> "DetectionBatch":
+        scores = np.asarray(scores, dtype=np.int32)
+        return DetectionBatch(
+            bboxes=np.asarray(bboxes, dtype=np.float64).reshape(-1, 4),
+            scores=scores,
+            categories=np.asarray(categories, dtype=np.int16),
+            types=np.full(len(scores), det_type.value, dtype=np.int8)
+        )
+
+    @staticmethod
+    def empty() -> "DetectionBatch":
+        return DetectionBatch.create([], [], [], DetectionType.EDGE)
+
+    @staticmethod
+    def concatenate(batches: List["DetectionBatch"]) -> "DetectionBatch":
+        if not batches:
+            return DetectionBatch.empty()
+        return DetectionBatch(
+            bboxes=np.concatenate([batch.bboxes for batch in batches]),
+            scores=np.concatenate([batch.scores for batch in batches]),
+            categories=np.concatenate([batch.categories for batch in batches]),
+            types=np.concatenate([batch.types for batch in batches])
+        )
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def select(self, indices) -> "DetectionBatch":
+        return DetectionBatch(
+            bboxes=self.bboxes[indices],
+            scores=self.scores[indices],
+            categories=self.categories[indices],
+            types=self.types[indices]
+        )
+
+    def of_type(self, det_type: DetectionType) -> "DetectionBatch":
+        return self.select(self.types == det_type.value)
+
+
+@dataclass
+class TrackerHealth:
+    updates: int
+    failures: int
+    score_retention: float
+
+
+@dataclass
+class OffloadDecision:
+    offload: bool
+    reason: str
+
+
+@dataclass
+class Encoding:
+    codec: str
+    quality: int
+    scale: float
+
+    def __str__(self) -> str:
+        return f"{self.codec}-{self.quality}-{self.scale}"
+
+
+@dataclass
+class EncodedFrame:
+    data: Any
+    encoding: Encoding
+    encode_time: float
+
+    @property
+    def num_bytes(self) -> int:
+        return self.data.nbytes
 
 
 @dataclass
@@ -60,14 +172,8 @@ class AnnotationView:
     category: int
 
 
-@dataclass
-class TrackerRecord:
-    raw_tracker: Any
-    det_bbox: List[float]
-    det_score: int
-    det_category: str
-    det_type: DetectionType
+AnnotationsByImage = Dict[int, List[AnnotationView]]
 
 
-DetectionsWithTypes = List[Tuple[Detection, DetectionType]]
-AnnotationsByImage = Dict[int, List[AnnotationView]]
+def resize(data: Any, width: int, height: int) -> Any:
+    return cv.resize(data, (width, height), interpolation=cv.INTER_LINEAR)
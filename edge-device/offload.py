@@ -0,0 +1,147 @@
+import cv2 as cv
+import numpy as np
+from collections import deque
+from typing import Union, Tuple, Any
+from typing_extensions import Protocol
+
+from model import DetectionBatch, Frame, OffloadDecision, TrackerHealth
+from simulation import Clock
+
+THUMBNAIL_SIZE = (80, 64)
+BUDGET_WINDOW = 60.0
+MIN_OFFLOAD_INTERVAL = 0.5
+MAX_RESULT_AGE = 5.0
+MOTION_THRESHOLD = 0.04
+FAILURE_RATIO_THRESHOLD = 0.2
+MIN_OBJECT_CHANGE = 3
+OBJECT_CHANGE_RATIO = 0.25
+
+
+class OffloadScheduler(Protocol):
+    def decide(self, frame: Frame, current_detections: DetectionBatch) -> OffloadDecision:
+        ...
+
+    def observe_tracking(self, health: TrackerHealth):
+        ...
+
+    def observe_request_bytes(self, num_bytes: int):
+        ...
+
+
+class AlwaysOffload:
+    def decide(self, frame: Frame, current_detections: DetectionBatch) -> OffloadDecision:
+        return OffloadDecision(offload=True, reason='always')
+
+    def observe_tracking(self, health: TrackerHealth):
+        pass
+
+    def observe_request_bytes(self, num_bytes: int):
+        pass
+
+
+class ContentAwareOffload:
+    max_requests_per_minute: Union[int, None]
+    max_bytes_per_minute: Union[int, None]
+    clock: Clock
+
+    last_offload_at: Union[float, None]
+    last_thumbnail: Any
+    last_num_objects: int
+    last_request_bytes: int
+    updates: int
+    failures: int
+    offloads: "deque[float]"
+    request_bytes: "deque[Tuple[float, int]]"
+
+    def __init__(self, max_requests_per_minute: Union[int, None], max_megabytes_per_minute: Union[float, None],
+                 clock: Clock):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_bytes_per_minute = int(max_megabytes_per_minute * 1e6) if max_megabytes_per_minute else None
+        self.clock = clock
+
+        self.last_offload_at = None
+        self.last_thumbnail = None
+        self.last_num_objects = 0
+        self.last_request_bytes = 0
+        self.updates = 0
+        self.failures = 0
+        self.offloads = deque()
+        self.request_bytes = deque()
+
+    def decide(self, frame: Frame, current_detections: DetectionBatch) -> OffloadDecision:
+        now = self.clock.time()
+        thumbnail = _thumbnail(frame)
+        num_objects = len(current_detections)
+
+        if self.last_offload_at is None:
+            return self._offload(now, thumbnail, num_objects, 'first')
+
+        age = now - self.last_offload_at
+        if age < MIN_OFFLOAD_INTERVAL:
+            return OffloadDecision(offload=False, reason='min_interval')
+
+        if not self._within_budget(now):
+            return OffloadDecision(offload=False, reason='budget')
+
+        if age >= MAX_RESULT_AGE:
+            return self._offload(now, thumbnail, num_objects, 'max_age')
+
+        # Motion is measured against the frame of the last offload, so slow drift adds up until it's worth a request.
+        motion = np.mean(np.abs(thumbnail - self.last_thumbnail)) / 255
+        if motion >= MOTION_THRESHOLD:
+            return self._offload(now, thumbnail, num_objects, 'motion')
+
+        if self.updates and self.failures / self.updates >= FAILURE_RATIO_THRESHOLD:
+            return self._offload(now, thumbnail, num_objects, 'tracker_failures')
+
+        object_change = abs(num_objects - self.last_num_objects)
+        if object_change >= max(MIN_OBJECT_CHANGE, OBJECT_CHANGE_RATIO * self.last_num_objects):
+            return self._offload(now, thumbnail, num_objects, 'objects')
+
+        return OffloadDecision(offload=False, reason='static')
+
+    def observe_tracking(self, health: TrackerHealth):
+        self.updates += health.updates
+        self.failures += health.failures
+
+    def observe_request_bytes(self, num_bytes: int):
+        self.last_request_bytes = num_bytes
+        self.request_bytes.append((self.clock.time(), num_bytes))
+
+    def _offload(self, now: float, thumbnail: Any, num_objects: int, reason: str) -> OffloadDecision:
+        self.last_offload_at = now
+        self.last_thumbnail = thumbnail
+        self.last_num_objects = num_objects
+        self.updates = 0
+        self.failures = 0
+        self.offloads.append(now)
+        return OffloadDecision(offload=True, reason=reason)
+
+    def _within_budget(self, now: float) -> bool:
+        while self.offloads and self.offloads[0] <= now - BUDGET_WINDOW:
+            self.offloads.popleft()
+        while self.request_bytes and self.request_bytes[0][0] <= now - BUDGET_WINDOW:
+            self.request_bytes.popleft()
+
+        if self.max_requests_per_minute is not None and len(self.offloads) >= self.max_requests_per_minute:
+            return False
+
+        # The size of the next request isn't known before it's encoded, the last request is taken as an estimate.
+        if self.max_bytes_per_minute is not None:
+            spent = sum(num_bytes for _, num_bytes in self.request_bytes)
+            if spent + self.last_request_bytes > self.max_bytes_per_minute:
+                return False
+
+        return True
+
+
+def get_offload_scheduler(content_aware: bool, max_requests_per_minute: Union[int, None],
+                          max_megabytes_per_minute: Union[float, None], clock: Clock) -> OffloadScheduler:
+    if content_aware:
+        return ContentAwareOffload(max_requests_per_minute, max_megabytes_per_minute, clock)
+    return AlwaysOffload()
+
+
+def _thumbnail(frame: Frame) -> Any:
+    gray = cv.cvtColor(frame.edge_data, cv.COLOR_BGR2GRAY)
+    return cv.resize(gray, THUMBNAIL_SIZE, interpolation=cv.INTER_AREA).astype(np.int16)
@@ -1,16 +1,53 @@
 import time
 import zmq
 
-from multiprocessing import Event
+from multiprocessing import Event, Process
+from typing import Tuple, Union
 
-from model import DetectionType
+from frame_ring import SharedFrameRing
+from model import DetectionBatch, Frame, FrameSlot
 from track import MultiObjectTracker
 
+CLOUD_TRACKING_ENDPOINT = "ipc:///tmp/edge-device/0"
 
-def track_objects_until_current_worker(stop_event: Event):
+
+class CloudTrackingWorker:
+    frame_ring: SharedFrameRing
+    engine: str
+    num_workers: int
+    verbose: bool
+    stop_event: Event
+    process: Union[Process, None]
+
+    def __init__(self, frame_ring_capacity: int, frame_shape: Tuple[int, int, int], engine: str, num_workers: int,
+                 verbose: bool = True):
+        self.frame_ring = SharedFrameRing(capacity=frame_ring_capacity, shape=frame_shape)
+        self.engine = engine
+        self.num_workers = num_workers
+        self.verbose = verbose
+        self.stop_event = Event()
+        self.process = None
+
+    def start(self):
+        self.process = Process(
+            target=track_objects_until_current_worker,
+            args=(self.stop_event, self.frame_ring, self.engine, self.num_workers, self.verbose)
+        )
+        self.process.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.process.join()
+        self.frame_ring.close()
+
+
+def track_objects_until_current_worker(stop_event: Event, frame_ring: SharedFrameRing, engine: str, num_workers: int,
+                                       verbose: bool):
     context = zmq.Context()
     socket = context.socket(zmq.ROUTER)
-    socket.bind("ipc:///tmp/edge-device/0")
+    socket.bind(CLOUD_TRACKING_ENDPOINT)
+
+    object_tracker = MultiObjectTracker(min_score=0, drop=True, engine=engine, num_workers=num_workers)
 
     while True:
         if socket.poll(10000, zmq.POLLIN):
@@ -18,29 +55,44 @@ def track_objects_until_current_worker(stop_event: Event):
 
             obj = socket.recv_pyobj()
             detections = obj['detections']
-            frames_until_current = obj['frames_until_current']
-            current_frame = obj['current_frame']
+            frame_slots = obj['frames_until_current']
+            current_frame_slot = obj['current_frame']
             min_score = obj['min_score']
 
+            slots = [frame_slot.slot for frame_slot in frame_slots] + [current_frame_slot.slot]
+
             if not detections:
+                frame_ring.release(slots)
                 socket.send_string(identity, zmq.SNDMORE)
-                socket.send_pyobj([], protocol=-1)
+                socket.send_pyobj(dict(detections=DetectionBatch.empty(), tracking_time=None), protocol=-1)
                 continue
 
-            print(f"Cloud tracking num frames: {len(frames_until_current) + 1}")
-            start = time.time()
+            frames_until_current = [_to_frame(frame_ring, frame_slot) for frame_slot in frame_slots]
+            current_frame = _to_frame(frame_ring, current_frame_slot)
+
+            if verbose:
+                print(f"Cloud tracking num frames: {len(frames_until_current) + 1}")
+            start = time.perf_counter()
 
-            object_tracker = MultiObjectTracker(min_score=min_score, drop=True)
-            for detection in detections:
-                object_tracker.add_object(frames_until_current[0], detection, DetectionType.CLOUD)
+            object_tracker.reset_objects()
+            object_tracker.min_score = min_score
+            object_tracker.add_objects(frames_until_current[0], detections)
 
             tracking_result = object_tracker.track_objects_until_current(frames_until_current[1:], current_frame)
 
-            end = time.time()
-            print(f"Cloud tracking took: {end - start}s")
+            tracking_time = time.perf_counter() - start
+
+            object_tracker.reset_objects()
+            frame_ring.release(slots)
 
             socket.send_string(identity, zmq.SNDMORE)
-            socket.send_pyobj([detection for detection, _ in tracking_result], protocol=-1)
+            socket.send_pyobj(dict(detections=tracking_result, tracking_time=tracking_time), protocol=-1)
         else:
             if stop_event.is_set():
                 break
+
+    frame_ring.close()
+
+
+def _to_frame(frame_ring: SharedFrameRing, frame_slot: FrameSlot) -> Frame:
+    return Frame(id=frame_slot.id, video=frame_slot.video, data=None, edge_data=frame_ring.get(frame_slot.slot))
@@ -0,0 +1,154 @@
+import cv2 as cv
+import threading
+from typing import List, Dict, Set, Tuple, Any, Union
+from typing_extensions import Protocol
+
+from display import display_detection, display_annotation, display_fps
+from model import Frame, DetectionView, AnnotationView
+
+RenderItem = Tuple[Frame, List[DetectionView], List[AnnotationView], int]
+RENDER_IDLE_INTERVAL = 0.05
+
+
+class Renderer(Protocol):
+    def render(self, frame: Frame, detections: List[DetectionView], annotations: List[AnnotationView],
+               fps: int) -> bool:
+        ...
+
+    def close(self):
+        ...
+
+
+class HeadlessRenderer:
+    def render(self, frame: Frame, detections: List[DetectionView], annotations: List[AnnotationView],
+               fps: int) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+class WindowRenderer:
+    window: str
+
+    def __init__(self, window: str):
+        self.window = window
+
+    def render(self, frame: Frame, detections: List[DetectionView], annotations: List[AnnotationView],
+               fps: int) -> bool:
+        _draw(frame.data, detections, annotations, fps)
+        cv.imshow(self.window, frame.data)
+        return cv.waitKey(1) != ord('q')
+
+    def close(self):
+        cv.destroyWindow(self.window)
+
+
+class RenderThread:
+    # HighGUI isn't thread safe and cv.waitKey handles the events of every window, so a single thread shows the
+    # windows of all streams and waits for keys once per round.
+    condition: threading.Condition
+    items: Dict[str, RenderItem]
+    windows: Set[str]
+    closed_windows: List[str]
+    num_renderers: int
+    num_closed: int
+    stop_event: threading.Event
+    thread: Union[threading.Thread, None]
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.items = dict()
+        self.windows = set()
+        self.closed_windows = []
+        self.num_renderers = 0
+        self.num_closed = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def renderer(self, window: str) -> "ThreadedRenderer":
+        with self.condition:
+            self.num_renderers += 1
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._render_items, daemon=True)
+            self.thread.start()
+        return ThreadedRenderer(self, window)
+
+    def put(self, window: str, item: RenderItem):
+        # Only the latest frame of a window is worth rendering, a frame still waiting is replaced instead of making
+        # the processing loop wait for the render thread.
+        with self.condition:
+            self.items[window] = item
+            self.condition.notify()
+
+    def close(self, window: str):
+        with self.condition:
+            self.items.pop(window, None)
+            self.closed_windows.append(window)
+            self.num_closed += 1
+            last = self.num_closed == self.num_renderers
+            self.condition.notify()
+        if last:
+            self.thread.join()
+
+    def _render_items(self):
+        while True:
+            with self.condition:
+                if not self.items and not self.closed_windows:
+                    self.condition.wait(RENDER_IDLE_INTERVAL)
+                items, self.items = self.items, dict()
+                closed_windows, self.closed_windows = self.closed_windows, []
+                done = self.num_closed == self.num_renderers
+
+            for window, (frame, detections, annotations, fps) in items.items():
+                image = frame.data.copy()
+                _draw(image, detections, annotations, fps)
+                cv.imshow(window, image)
+                self.windows.add(window)
+
+            for window in closed_windows:
+                if window in self.windows:
+                    cv.destroyWindow(window)
+                    self.windows.discard(window)
+
+            if done:
+                break
+            # Keeps the windows responsive while no new frames arrive.
+            if self.windows and cv.waitKey(1) == ord('q'):
+                self.stop_event.set()
+
+
+class ThreadedRenderer:
+    render_thread: RenderThread
+    window: str
+
+    def __init__(self, render_thread: RenderThread, window: str):
+        self.render_thread = render_thread
+        self.window = window
+
+    def render(self, frame: Frame, detections: List[DetectionView], annotations: List[AnnotationView],
+               fps: int) -> bool:
+        self.render_thread.put(self.window, (frame, detections, annotations, fps))
+        return not self.render_thread.stop_event.is_set()
+
+    def close(self):
+        self.render_thread.close(self.window)
+
+
+def _draw(image: Any, detections: List[DetectionView], annotations: List[AnnotationView], fps: int):
+    for detection in detections:
+        display_detection(image, detection)
+
+    for annotation in annotations:
+        display_annotation(image, annotation)
+
+    display_fps(image, fps)
+
+
+def get_renderer(headless: bool, render_thread: Union[RenderThread, None], window: str = 'frame') -> Renderer:
+    if headless:
+        return HeadlessRenderer()
+    elif render_thread is not None:
+        return render_thread.renderer(window)
+    else:
+        return WindowRenderer(window)
@@ -0,0 +1,235 @@
+import math
+import numpy as np
+import requests
+import threading
+from collections import deque
+from typing import List, Dict, Tuple, Union, Any
+
+from metrics import Metrics
+from model import DetectionBatch, DetectionType, Frame
+from simulation import Clock
+
+
+class TraceRecorder:
+    path: str
+    lock: threading.Lock
+
+    videos: Dict[str, int]
+    responses: Dict[str, List[Any]]
+    detections: List[DetectionBatch]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.videos = dict()
+        self.responses = dict(types=[], videos=[], frame_ids=[], sent_times=[], arrival_times=[], request_bytes=[],
+                              failed=[], counts=[])
+        self.detections = []
+
+    def record(self, det_type: DetectionType, video: str, frame_id: int, sent_at: float, arrived_at: float,
+               request_bytes: int, detections: DetectionBatch, failed: bool = False):
+        # Responses of a video are recorded in the order of their requests, there's only one request of each type in
+        # flight per stream.
+        with self.lock:
+            video_idx = self.videos.setdefault(_video_name(video), len(self.videos))
+            for column, value in zip(self.responses.values(), [det_type.value, video_idx, frame_id, sent_at,
+                                                               arrived_at, request_bytes, failed, len(detections)]):
+                column.append(value)
+            self.detections.append(detections)
+
+    def close(self):
+        with self.lock:
+            print(f"Writing trace of {len(self.detections)} responses to {self.path}")
+            detections = DetectionBatch.concatenate(self.detections)
+            np.savez_compressed(
+                self.path,
+                video_names=np.array(list(self.videos), dtype=str),
+                types=np.array(self.responses['types'], dtype=np.int8),
+                videos=np.array(self.responses['videos'], dtype=np.int32),
+                frame_ids=np.array(self.responses['frame_ids'], dtype=np.int64),
+                sent_times=np.array(self.responses['sent_times'], dtype=np.float64),
+                arrival_times=np.array(self.responses['arrival_times'], dtype=np.float64),
+                request_bytes=np.array(self.responses['request_bytes'], dtype=np.int64),
+                failed=np.array(self.responses['failed'], dtype=bool),
+                counts=np.array(self.responses['counts'], dtype=np.int32),
+                bboxes=detections.bboxes,
+                scores=detections.scores,
+                categories=detections.categories
+            )
+
+
+class Response:
+    frame_id: int
+    detections: DetectionBatch
+    # Seconds since the first request for the video was sent.
+    sent_offset: float
+    arrival_offset: float
+    request_bytes: int
+    failed: bool
+
+    def __init__(self, frame_id: int, detections: DetectionBatch, sent_offset: float, arrival_offset: float,
+                 request_bytes: int, failed: bool):
+        self.frame_id = frame_id
+        self.detections = detections
+        self.sent_offset = sent_offset
+        self.arrival_offset = arrival_offset
+        self.request_bytes = request_bytes
+        self.failed = failed
+
+    @property
+    def round_trip_time(self) -> float:
+        return self.arrival_offset - self.sent_offset
+
+
+class Trace:
+    # Responses by type and video, in the order they were requested.
+    responses: Dict[Tuple[int, str], "deque[Response]"]
+    tolerant: bool
+
+    def __init__(self, path: str, tolerant: bool = False):
+        self.responses = dict()
+        self.tolerant = tolerant
+
+        with np.load(path) as archive:
+            trace = {name: archive[name] for name in archive.files}
+
+        video_names = trace['video_names'].tolist()
+        ends = np.cumsum(trace['counts'])
+        starts = ends - trace['counts']
+        first_sent_times = dict()
+        for video_idx, sent_time in zip(trace['videos'].tolist(), trace['sent_times'].tolist()):
+            first_sent_times[video_idx] = min(sent_time, first_sent_times.get(video_idx, sent_time))
+
+        for idx in range(len(trace['types'])):
+            det_type = DetectionType(int(trace['types'][idx]))
+            video_idx = int(trace['videos'][idx])
+            detections = DetectionBatch.create(
+                bboxes=trace['bboxes'][starts[idx]:ends[idx]],
+                scores=trace['scores'][starts[idx]:ends[idx]],
+                categories=trace['categories'][starts[idx]:ends[idx]],
+                det_type=det_type
+            )
+            self.responses.setdefault((det_type.value, video_names[video_idx]), deque()).append(Response(
+                frame_id=int(trace['frame_ids'][idx]),
+                detections=detections,
+                sent_offset=float(trace['sent_times'][idx]) - first_sent_times[video_idx],
+                arrival_offset=float(trace['arrival_times'][idx]) - first_sent_times[video_idx],
+                request_bytes=int(trace['request_bytes'][idx]),
+                failed=bool(trace['failed'][idx])
+            ))
+
+        print(f"Loaded trace of {sum(len(responses) for responses in self.responses.values())} responses "
+              f"from {path}")
+
+    def next_response(self, det_type: DetectionType, frame: Frame, metrics: Metrics) -> Union[Response, None]:
+        # A replay has to request the same frames in the same order as the recorded run, otherwise its responses
+        # don't belong to the frames they'd be used for.
+        video = _video_name(frame.video)
+        responses = self.responses.get((det_type.value, video))
+        if not responses:
+            return None
+        if responses[0].frame_id != frame.id:
+            if not self.tolerant:
+                raise ValueError(f"Trace mismatch: frame {frame.id} of {video} was requested from the "
+                                 f"{det_type.name.lower()} server, but frame {responses[0].frame_id} was recorded next")
+            # Tolerant replays answer with the response recorded for the closest frame instead, responses recorded
+            # for frames before it weren't requested and are dropped.
+            while len(responses) > 1 and \
+                    abs(responses[1].frame_id - frame.id) <= abs(responses[0].frame_id - frame.id):
+                responses.popleft()
+            if responses[0].frame_id != frame.id:
+                metrics.increment('trace_misses')
+        # Tolerant replays keep the last response for requests past the end of the recorded run.
+        if self.tolerant and len(responses) == 1:
+            return responses[0]
+        return responses.popleft()
+
+
+class ReplayEdgeServer:
+    trace: Trace
+    clock: Clock
+    metrics: Metrics
+
+    in_progress: bool
+    sent_at: float
+    response: Union[Response, None]
+    round_trip_time: float
+
+    def __init__(self, trace: Trace, clock: Clock, metrics: Metrics):
+        self.trace = trace
+        self.clock = clock
+        self.metrics = metrics
+        self.in_progress = False
+        self.sent_at = 0.0
+        self.response = None
+        self.round_trip_time = 0.0
+
+    def connect(self):
+        pass
+
+    def send_frame(self, frame: Frame) -> bool:
+        if self.in_progress:
+            return False
+
+        # The recorded run may have ended while waiting for the response of its last request, which then never
+        # arrives in the replay either.
+        self.response = self.trace.next_response(DetectionType.EDGE, frame, self.metrics)
+        self.in_progress = True
+        self.sent_at = self.clock.time()
+        return True
+
+    def receive_detections(self, timeout: int) -> Union[DetectionBatch, None]:
+        # Responses arrive as long after they were sent as in the recorded run, like those of a simulated latency.
+        if self.in_progress and self.response is not None:
+            remaining_time = self.sent_at + self.response.round_trip_time - self.clock.time()
+        else:
+            remaining_time = math.inf
+        if remaining_time > timeout / 1000:
+            self.clock.sleep(timeout / 1000)
+            return None
+
+        self.clock.sleep(remaining_time)
+        self.in_progress = False
+        self.round_trip_time = self.clock.time() - self.sent_at
+        self.metrics.observe('edge_rtt_seconds', self.round_trip_time)
+        return self.response.detections
+
+
+class ReplayCloudServer:
+    trace: Trace
+    clock: Clock
+    metrics: Metrics
+    verbose: bool
+
+    last_request_bytes: int
+
+    def __init__(self, trace: Trace, clock: Clock, metrics: Metrics, verbose: bool = True):
+        self.trace = trace
+        self.clock = clock
+        self.metrics = metrics
+        self.verbose = verbose
+        self.last_request_bytes = 0
+
+    def detect_objects(self, frame: Frame, deadline: float) -> DetectionBatch:
+        start = self.clock.time()
+        # Cloud requests in flight at the end of the recorded run were waited for, every request has its response.
+        response = self.trace.next_response(DetectionType.CLOUD, frame, self.metrics)
+        if response is None:
+            raise ValueError(f"Trace mismatch: frame {frame.id} of {_video_name(frame.video)} was requested from "
+                             f"the cloud server, but no more requests were recorded")
+        self.last_request_bytes = response.request_bytes
+
+        self.clock.wait_until(start + response.round_trip_time)
+        if response.failed:
+            raise requests.exceptions.RequestException(f"Replayed failure of the request for frame {frame.id}")
+        self.metrics.observe('cloud_rtt_seconds', self.clock.time() - start)
+        if self.verbose:
+            print(f"Cloud num detections: {len(response.detections)} (replayed)")
+        return response.detections
+
+
+def _video_name(video: str) -> str:
+    # Videos are recognised by their directory, the trace can be replayed with the videos stored elsewhere.
+    parts = [part for part in video.replace("\\", "/").split("/") if part and '*' not in part]
+    return parts[-1] if parts else video
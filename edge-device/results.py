@@ -0,0 +1,174 @@
+import glob
+import json
+import numpy as np
+import os
+import threading
+from typing import List, Dict, Iterator, Union, Any
+from typing_extensions import Protocol
+
+from model import DetectionView, DetectionType
+
+RESULT_FORMATS = ['npz', 'jsonl']
+DEFAULT_RESULT_PATHS = {'npz': 'detections', 'jsonl': 'detections.jsonl'}
+CHUNK_SIZE = 100000
+COLUMNS = {
+    'frame_id': np.int32,
+    'x': np.float64,
+    'y': np.float64,
+    'w': np.float64,
+    'h': np.float64,
+    'score': np.int32,
+    'category': np.int16,
+    'type': np.int8,
+    'tracked': bool,
+}
+
+
+class ResultWriter(Protocol):
+    num_detections: int
+
+    def write(self, detections: List[DetectionView]):
+        ...
+
+    def close(self):
+        ...
+
+
+class NpzResultWriter:
+    path: str
+    chunk_size: int
+    lock: threading.Lock
+
+    columns: Dict[str, List[Any]]
+    num_buffered: int
+    num_chunks: int
+    num_detections: int
+
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+
+        self.columns = {name: [] for name in COLUMNS}
+        self.num_buffered = 0
+        self.num_chunks = 0
+        self.num_detections = 0
+
+    def write(self, detections: List[DetectionView]):
+        if not detections:
+            return
+
+        # Detections of a frame always end up in the same chunk.
+        with self.lock:
+            for name, dtype in COLUMNS.items():
+                self.columns[name].append(np.array([_value(detection, name) for detection in detections], dtype))
+            self.num_buffered += len(detections)
+            self.num_detections += len(detections)
+
+            if self.num_buffered >= self.chunk_size:
+                self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.num_buffered == 0:
+            return
+
+        # Chunks of an earlier run are only removed once there's something to replace them with.
+        if self.num_chunks == 0:
+            print(f"Writing detections to {self.path}")
+            os.makedirs(self.path, exist_ok=True)
+            for chunk in _chunks(self.path):
+                os.remove(chunk)
+
+        chunk = os.path.join(self.path, f"detections-{self.num_chunks:05d}.npz")
+        np.savez_compressed(chunk, **{name: np.concatenate(values) for name, values in self.columns.items()})
+
+        self.columns = {name: [] for name in COLUMNS}
+        self.num_buffered = 0
+        self.num_chunks += 1
+
+
+class JsonlResultWriter:
+    path: str
+    lock: threading.Lock
+    file: Any
+
+    num_detections: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+        self.num_detections = 0
+
+    def write(self, detections: List[DetectionView]):
+        if not detections:
+            return
+
+        lines = [json.dumps({name: _value(detection, name) for name in COLUMNS}) + '\n' for detection in detections]
+        with self.lock:
+            if self.file is None:
+                print(f"Writing detections to {self.path}")
+                self.file = open(self.path, 'w')
+            self.file.writelines(lines)
+            self.num_detections += len(detections)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+
+
+def get_result_writer(result_format: str, path: Union[str, None]) -> ResultWriter:
+    path = path if path is not None else DEFAULT_RESULT_PATHS[result_format]
+    if result_format == 'jsonl':
+        return JsonlResultWriter(path)
+    return NpzResultWriter(path)
+
+
+def read_results(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[List[DetectionView]]:
+    if os.path.isdir(path):
+        for chunk in _chunks(path):
+            with np.load(chunk) as columns:
+                yield _to_views(zip(*[columns[name].tolist() for name in COLUMNS]))
+    elif path.endswith('.jsonl'):
+        with open(path) as f:
+            rows = []
+            for line in f:
+                row = json.loads(line)
+                row = [row[name] for name in COLUMNS]
+                # Like NPZ chunks, a chunk only ends between frames.
+                if len(rows) >= chunk_size and row[0] != rows[-1][0]:
+                    yield _to_views(rows)
+                    rows = []
+                rows.append(row)
+            if rows:
+                yield _to_views(rows)
+    else:
+        # all_detections.json of earlier versions, with the detection type written as e.g. "DetectionType.EDGE".
+        with open(path) as f:
+            yield _to_views([
+                [row[name] if name != 'type' else DetectionType[row[name].split('.')[1]].value for name in COLUMNS]
+                for row in json.load(f)
+            ])
+
+
+def _value(detection: DetectionView, name: str) -> Any:
+    if name == 'type':
+        return detection.type.value
+    return getattr(detection, name)
+
+
+def _to_views(rows: Any) -> List[DetectionView]:
+    return [
+        DetectionView(frame_id, x, y, w, h, score, category, DetectionType(det_type), tracked)
+        for frame_id, x, y, w, h, score, category, det_type, tracked in rows
+    ]
+
+
+def _chunks(path: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(path, "detections-*.npz")))
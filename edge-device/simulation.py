@@ -0,0 +1,211 @@
+import contextlib
+import json
+import random
+import threading
+import time
+import zmq
+from concurrent.futures import Future, wait
+from typing import Dict, List, Tuple, Union, Iterator, Any
+from typing_extensions import Protocol
+
+SIMULATED_POLL_TIMEOUT = 60000
+RECORDED_QUANTILES = [('min', 0.0), ('p10', 0.1), ('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)]
+# Compute time charged per stage by simulated clocks, unless a metrics snapshot of an earlier run is given.
+MODELLED_COMPUTE_SECONDS = {
+    'frame_acquire_seconds': 0.002,
+    'edge_encode_seconds': 0.004,
+    'cloud_resize_seconds': 0.004,
+    'cloud_encode_seconds': 0.010,
+    'tracking_seconds': 0.015,
+    'catch_up_seconds': 0.040,
+    'fusion_seconds': 0.001,
+    'cloud_tracking_seconds': 0.150,
+}
+
+
+class Clock(Protocol):
+    def time(self) -> float:
+        ...
+
+    def sleep(self, seconds: float):
+        ...
+
+    def wait_until(self, at: float):
+        ...
+
+    def computing(self, stage: str) -> Any:
+        ...
+
+    def compute_time(self, stage: str, seconds: float) -> float:
+        ...
+
+    def forked(self, at: float) -> Any:
+        ...
+
+    def finished(self, future: Future) -> bool:
+        ...
+
+    def poll(self, socket: Any, timeout: int) -> bool:
+        ...
+
+
+class SystemClock:
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        if seconds > 0.0:
+            time.sleep(seconds)
+
+    def wait_until(self, at: float):
+        self.sleep(at - time.time())
+
+    def computing(self, stage: str) -> Any:
+        return contextlib.nullcontext()
+
+    def compute_time(self, stage: str, seconds: float) -> float:
+        return seconds
+
+    def forked(self, at: float) -> Any:
+        return contextlib.nullcontext()
+
+    def finished(self, future: Future) -> bool:
+        return future.done()
+
+    def poll(self, socket: Any, timeout: int) -> bool:
+        return socket.poll(timeout, zmq.POLLIN)
+
+
+class SimulatedClock:
+    # Time only passes by sleeping, waiting for simulated latencies and the compute time charged for every stage the
+    # device runs, never by how long anything actually takes. Runs with the same seed therefore see the same times.
+    # Threads working next to the processing loop, e.g. on cloud requests, run on their own forked timeline.
+    compute_seconds: Dict[str, float]
+    now: float
+    forks: threading.local
+
+    def __init__(self, compute_seconds: Dict[str, float]):
+        self.compute_seconds = compute_seconds
+        self.now = 0.0
+        self.forks = threading.local()
+
+    def time(self) -> float:
+        return getattr(self.forks, 'now', self.now)
+
+    def sleep(self, seconds: float):
+        if seconds > 0.0:
+            self._advance(self.time() + seconds)
+
+    def wait_until(self, at: float):
+        if at > self.time():
+            self._advance(at)
+
+    @contextlib.contextmanager
+    def computing(self, stage: str) -> Iterator[None]:
+        yield
+        self.sleep(self.compute_time(stage, 0.0))
+
+    def compute_time(self, stage: str, seconds: float) -> float:
+        return self.compute_seconds.get(stage, 0.0)
+
+    @contextlib.contextmanager
+    def forked(self, at: float) -> Iterator[None]:
+        self.forks.now = at
+        try:
+            yield
+        finally:
+            del self.forks.now
+
+    def finished(self, future: Future) -> bool:
+        # Work running next to the processing loop is waited for, the clock stands still meanwhile.
+        wait([future])
+        return True
+
+    def poll(self, socket: Any, timeout: int) -> bool:
+        # Only polled for responses which are due, the clock stands still until they actually arrive.
+        return socket.poll(SIMULATED_POLL_TIMEOUT, zmq.POLLIN)
+
+    def _advance(self, at: float):
+        if hasattr(self.forks, 'now'):
+            self.forks.now = at
+        else:
+            self.now = at
+
+
+class Latency(Protocol):
+    def sample(self, num_bytes: int) -> float:
+        ...
+
+
+class ModelledLatency:
+    mean: float
+    jitter: float
+    uplink_bytes_per_second: Union[float, None]
+    rand: random.Random
+
+    def __init__(self, mean_ms: float, jitter_ms: float, uplink_mbps: Union[float, None], seed: int):
+        self.mean = mean_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.uplink_bytes_per_second = uplink_mbps * 1e6 / 8 if uplink_mbps else None
+        self.rand = random.Random(seed)
+
+    def sample(self, num_bytes: int) -> float:
+        transfer_time = num_bytes / self.uplink_bytes_per_second if self.uplink_bytes_per_second else 0.0
+        return max(self.rand.gauss(self.mean, self.jitter), 0.0) + transfer_time
+
+
+class RecordedLatency:
+    quantiles: List[Tuple[float, float]]
+    rand: random.Random
+
+    def __init__(self, histogram: Dict[str, float], seed: int):
+        # Snapshots only have a few quantiles, latencies in between are interpolated. Snapshots of older runs don't
+        # have the low quantiles, latencies below their median are taken to be the median.
+        self.quantiles = [(q, histogram[key]) for key, q in RECORDED_QUANTILES if key in histogram]
+        if self.quantiles[0][0] > 0.0:
+            self.quantiles.insert(0, (0.0, self.quantiles[0][1]))
+        self.rand = random.Random(seed)
+
+    def sample(self, num_bytes: int) -> float:
+        u = self.rand.random()
+        for (q_low, low), (q_high, high) in zip(self.quantiles, self.quantiles[1:]):
+            if u <= q_high:
+                return low + (high - low) * (u - q_low) / (q_high - q_low)
+        return self.quantiles[-1][1]
+
+
+def get_clock(simulate: bool, recorded_metrics: Union[str, None] = None) -> Clock:
+    if not simulate:
+        return SystemClock()
+    return SimulatedClock(get_compute_seconds(recorded_metrics))
+
+
+def get_compute_seconds(recorded_metrics: Union[str, None]) -> Dict[str, float]:
+    compute_seconds = dict(MODELLED_COMPUTE_SECONDS)
+    if recorded_metrics is not None:
+        # Every stage is charged the median of its recorded times, stages the snapshot doesn't have keep their
+        # modelled time.
+        for stage in compute_seconds:
+            try:
+                compute_seconds[stage] = _recorded_histogram(recorded_metrics, stage)['p50']
+            except ValueError:
+                pass
+    return compute_seconds
+
+
+def get_latency(name: str, mean_ms: float, jitter_ms: float, uplink_mbps: Union[float, None],
+                recorded_metrics: Union[str, None], seed: int) -> Latency:
+    if recorded_metrics is not None:
+        return RecordedLatency(_recorded_histogram(recorded_metrics, f'{name}_rtt_seconds'), seed)
+    return ModelledLatency(mean_ms, jitter_ms, uplink_mbps, seed)
+
+
+def _recorded_histogram(path: str, metric: str) -> Dict[str, float]:
+    with open(path) as f:
+        histograms = json.load(f)['histograms']
+
+    # With several streams the histograms are labelled per stream, the one with most samples is used.
+    candidates = [histogram for key, histogram in histograms.items() if key.split('{')[0] == metric]
+    if not candidates:
+        raise ValueError(f"No {metric} in {path}")
+    return max(candidates, key=lambda histogram: histogram['count'])
@@ -0,0 +1,91 @@
+import argparse
+import random
+import statistics
+import sys
+import time
+from typing import List
+
+import numpy as np
+from pycocotools.coco import maskUtils as mask
+from scipy.optimize import linear_sum_assignment
+
+sys.path.append('..')
+
+from fusion import match_detections
+
+WIDTH = 1333
+HEIGHT = 800
+
+
+LAYOUTS = ['spread', 'crowded']
+
+
+def create_bboxes(num_boxes: int, layout: str, seed: int):
+    # Spread boxes mostly overlap only with their own counterpart, crowded boxes are packed into a small area and
+    # overlap with many others.
+    rand = random.Random(seed)
+    width, height = (WIDTH, HEIGHT) if layout == 'spread' else (200, 120)
+    current_bboxes = []
+    for _ in range(num_boxes):
+        w = rand.uniform(8, 60)
+        h = rand.uniform(8, 60)
+        current_bboxes.append([rand.uniform(0, width - w), rand.uniform(0, height - h), w, h])
+
+    new_bboxes = [[x + rand.uniform(-4, 4), y + rand.uniform(-4, 4), w * rand.uniform(0.9, 1.1), h]
+                  for x, y, w, h in current_bboxes if rand.random() < 0.8]
+    new_bboxes.extend(current_bboxes[:num_boxes - len(new_bboxes)])
+    rand.shuffle(new_bboxes)
+    return np.array(current_bboxes), np.array(new_bboxes)
+
+
+def match_detections_dense(current_bboxes, new_bboxes):
+    size = max(len(current_bboxes), len(new_bboxes))
+    current_detection_bboxes = np.zeros((size, 4))
+    current_detection_bboxes[:len(current_bboxes)] = current_bboxes
+    new_detection_bboxes = np.zeros((size, 4))
+    new_detection_bboxes[:len(new_bboxes)] = new_bboxes
+
+    M = mask.iou(current_detection_bboxes, new_detection_bboxes, [0] * size)
+    M[M < 0.5] = 0
+
+    current_ind, new_ind = linear_sum_assignment(M, maximize=True)
+    paired = M[current_ind, new_ind] != 0
+    return current_ind[paired], new_ind[paired]
+
+
+def measure(match, current_bboxes, new_bboxes, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        match(current_bboxes, new_bboxes)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(box_counts, layouts: List[str], repeat: int, seed: int):
+    print(f"{'layout':>8}{'boxes':>7}{'dense (ms)':>14}{'gated (ms)':>14}{'matches':>10}{'identical':>11}")
+    for layout in layouts:
+        for num_boxes in box_counts:
+            current_bboxes, new_bboxes = create_bboxes(num_boxes, layout, seed)
+
+            # Both return the matched pairs ordered by current detection. The boxes are continuous, so there are
+            # no ties between equally good assignments.
+            dense = match_detections_dense(current_bboxes, new_bboxes)
+            gated = match_detections(current_bboxes, new_bboxes)
+            identical = all(np.array_equal(a, b) for a, b in zip(dense, gated))
+
+            dense_time = measure(match_detections_dense, current_bboxes, new_bboxes, repeat)
+            gated_time = measure(match_detections, current_bboxes, new_bboxes, repeat)
+            print(f"{layout:>8}{num_boxes:>7}{dense_time * 1000:>14.2f}{gated_time * 1000:>14.2f}"
+                  f"{len(gated[0]):>10}{str(identical):>11}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--boxes', nargs='+', type=int, default=[10, 50, 100, 300, 500, 1000, 2000])
+    parser.add_argument('--layouts', nargs='+', choices=LAYOUTS, default=LAYOUTS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.boxes, args.layouts, args.repeat, args.seed)
@@ -0,0 +1,452 @@
+import argparse
+import heapq
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Tuple, Union
+
+import cv2 as cv
+import numpy as np
+import zmq
+
+sys.path.append('..')
+
+from category import CATEGORIES
+from cloud_server import CloudServer
+from detection import EdgeCloudObjectDetector, FRAME_RING_CAPACITY_FACTOR
+from detection_rate import get_detection_rate_controller
+from edge_device import EdgeDevice, Stream
+from edge_server import EdgeServer, EdgeServerConnection
+from frame_encoding import FrameEncoder, FRAME_ENCODINGS, get_frame_encoder
+from http_client import HttpClient
+from metrics import Metrics
+from model import Dimensions, Frame, DetectionBatch
+from offload import get_offload_scheduler
+from process import CloudTrackingWorker
+from render import HeadlessRenderer
+from results import get_result_writer
+from simulation import Clock, Latency, ModelledLatency, get_clock
+from track import MultiObjectTracker
+from tracker_engine import TRACKER_ENGINES
+from wire import WIRE_FORMATS, WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON, encode_detections, decode_hello, \
+    encode_hello_ack, negotiate_wire_format
+
+DIMENSIONS = Dimensions(
+    edge_processing_width=640,
+    edge_processing_height=512,
+    cloud_processing_width=1333,
+    cloud_processing_height=800
+)
+MODES = ['sync', 'async']
+
+
+class EdgeServerStandIn:
+    latency: Latency
+    responses: Dict[str, bytes]
+    wire_formats: Dict[Tuple[bytes, ...], str]
+    context: Any
+    socket: Any
+    stop_event: threading.Event
+    thread: threading.Thread
+
+    def __init__(self, latency: Latency, num_detections: int, seed: int):
+        self.latency = latency
+        bboxes, scores, category_ids = _canned_detections(num_detections, DIMENSIONS.edge_processing_width,
+                                                          DIMENSIONS.edge_processing_height, seed)
+        self.responses = {
+            WIRE_FORMAT_BINARY: encode_detections(bboxes, scores, category_ids),
+            WIRE_FORMAT_JSON: json.dumps(dict(detections=[
+                dict(bbox=bbox, score=score, category=CATEGORIES[category_id]["name"])
+                for bbox, score, category_id in zip(bboxes, scores, category_ids)
+            ])).encode()
+        }
+        self.wire_formats = dict()
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self, ipc: bool):
+        if ipc:
+            os.makedirs("/tmp/edge-server", exist_ok=True)
+            self.socket.bind("ipc:///tmp/edge-server/0")
+        else:
+            self.socket.bind("tcp://127.0.0.1:8000")
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.socket.close(linger=0)
+        self.context.term()
+
+    def _serve(self):
+        # Responses due at the same time are sent in the order their requests arrived.
+        pending = []
+        arrivals = itertools.count()
+        while not self.stop_event.is_set():
+            timeout = 50
+            if pending:
+                timeout = max(int((pending[0][0] - time.time()) * 1000), 0)
+
+            if self.socket.poll(min(timeout, 50), zmq.POLLIN):
+                parts = self.socket.recv_multipart()
+                envelope = tuple(parts[:-1])
+                accepted_formats = decode_hello(parts[-1])
+                if accepted_formats is not None:
+                    self.wire_formats[envelope] = negotiate_wire_format(accepted_formats)
+                    self.socket.send_multipart([*envelope, encode_hello_ack(self.wire_formats[envelope])])
+                    continue
+                response = self.responses[self.wire_formats.get(envelope, WIRE_FORMAT_JSON)]
+                heapq.heappush(pending, (time.time() + self.latency.sample(len(parts[-1])), next(arrivals),
+                                         envelope, response))
+
+            while pending and pending[0][0] <= time.time():
+                _, _, envelope, response = heapq.heappop(pending)
+                self.socket.send_multipart([*envelope, response])
+
+
+class CloudServerStandIn:
+    server: ThreadingHTTPServer
+    thread: threading.Thread
+
+    def __init__(self, latency: Latency, num_detections: int, seed: int, port: int = 0):
+        bboxes, scores, category_ids = _canned_detections(num_detections, DIMENSIONS.cloud_processing_width,
+                                                          DIMENSIONS.cloud_processing_height, seed + 1)
+        response = json.dumps([
+            dict(class_name=CATEGORIES[category_id]["name"], score=score / 100, bbox=bbox)
+            for bbox, score, category_id in zip(bboxes, scores, category_ids)
+        ]).encode()
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with lock:
+                    delay = latency.sample(len(body))
+                time.sleep(delay)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/predictions/stand_in"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TimedEdgeServer(EdgeServer):
+    round_trip_times: List[float]
+
+    def __init__(self, ipc: bool, wire_format: str, encoder: FrameEncoder, clock: Clock, metrics: Metrics,
+                 connection: Union[EdgeServerConnection, None], latency: Union[Latency, None]):
+        super().__init__(ipc, wire_format, encoder, clock, metrics, verbose=False, connection=connection,
+                         latency=latency)
+        self.round_trip_times = []
+
+    def receive_detections(self, timeout: int) -> Union[DetectionBatch, None]:
+        detections = super().receive_detections(timeout)
+        if detections is not None:
+            self.round_trip_times.append(self.round_trip_time)
+        return detections
+
+
+class TimedCloudServer(CloudServer):
+    round_trip_times: List[float]
+
+    def __init__(self, detection_model_url: str, http_client: HttpClient, encoder: FrameEncoder, clock: Clock,
+                 metrics: Metrics, latency: Union[Latency, None]):
+        super().__init__(detection_model_url, http_client, encoder, clock, metrics, latency=latency, verbose=False)
+        self.round_trip_times = []
+
+    def detect_objects(self, frame: Frame, deadline: float) -> DetectionBatch:
+        start = self.clock.time()
+        detections = super().detect_objects(frame, deadline)
+        self.round_trip_times.append(self.clock.time() - start)
+        return detections
+
+
+class TimedObjectDetector(EdgeCloudObjectDetector):
+    catch_up_times: List[float]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.catch_up_times = []
+
+    def _receive_cloud_tracking(self) -> Union[Dict[str, Any], None]:
+        # Timed when the result is used, simulated clocks receive results before they're due.
+        sent_at = self.cloud_tracking_sent_at[0] if self.cloud_tracking_sent_at else None
+        obj = super()._receive_cloud_tracking()
+        if obj is not None:
+            self.catch_up_times.append(self.clock.time() - sent_at)
+        return obj
+
+
+def create_frames(directory: str, num_frames: int, width: int, height: int, seed: int) -> str:
+    rng = np.random.default_rng(seed)
+    texture = rng.integers(0, 256, size=(height + 2 * num_frames, width + 2 * num_frames, 3), dtype=np.uint8)
+    texture = cv.GaussianBlur(texture, (9, 9), 0)
+    for idx in range(num_frames):
+        cv.imwrite(os.path.join(directory, f"{idx:07d}.jpg"), texture[idx:idx + height, 2 * idx:2 * idx + width])
+    return os.path.join(directory, "*.jpg")
+
+
+def link_videos(directory: str, frames_directory: str, num_videos: int) -> str:
+    # Every stream processes its own video, all videos link to the same frames.
+    videos_directory = os.path.join(directory, "videos")
+    os.makedirs(videos_directory)
+    for idx in range(num_videos):
+        os.symlink(os.path.abspath(frames_directory), os.path.join(videos_directory, f"video-{idx}"))
+    return os.path.join(videos_directory, "*")
+
+
+def run(mode: str, video: str, args) -> Dict[str, Any]:
+    metrics = Metrics('vate_edge_device')
+
+    cloud_tracking = CloudTrackingWorker(
+        frame_ring_capacity=FRAME_RING_CAPACITY_FACTOR * args.max_fps * args.streams,
+        frame_shape=(DIMENSIONS.edge_processing_height, DIMENSIONS.edge_processing_width, 3),
+        engine=args.tracker,
+        num_workers=1,
+        verbose=False
+    )
+    cloud_tracking.start()
+
+    edge_server_connection = None
+    if args.streams > 1:
+        edge_server_connection = EdgeServerConnection(args.ipc)
+        edge_server_connection.start()
+
+    http_client = HttpClient(max_connections=max(4, args.streams))
+    executor = ThreadPoolExecutor()
+
+    streams = []
+    edge_servers: List[TimedEdgeServer] = []
+    cloud_servers: List[TimedCloudServer] = []
+    object_detectors: List[TimedObjectDetector] = []
+    for stream_id in range(args.streams):
+        stream_metrics = metrics.with_labels(stream=str(stream_id)) if args.streams > 1 else metrics
+
+        # Simulated runs model the latencies on the device, the stand-ins answer right away.
+        clock = get_clock(args.simulate)
+        edge_latency, cloud_latency = None, None
+        if args.simulate:
+            edge_latency = _edge_latency(args, args.seed + 2 * stream_id)
+            cloud_latency = _cloud_latency(args, args.seed + 2 * stream_id + 1)
+
+        edge_encoder = get_frame_encoder(args.frame_encoding, args.edge_latency_target_ms / 1000, 'edge',
+                                         stream_metrics, clock)
+        edge_server = TimedEdgeServer(args.ipc, args.wire_format, edge_encoder, clock, stream_metrics,
+                                      edge_server_connection, edge_latency)
+        edge_server.connect()
+        cloud_encoder = get_frame_encoder(args.frame_encoding, args.cloud_latency_target_ms / 1000, 'cloud',
+                                          stream_metrics, clock)
+        cloud_server = TimedCloudServer(args.cloud_url, http_client, cloud_encoder, clock, stream_metrics,
+                                        cloud_latency)
+
+        object_tracker = MultiObjectTracker(min_score=20, drop=False, engine=args.tracker)
+        offload_scheduler = get_offload_scheduler(args.content_aware_offload, args.offload_requests_per_minute,
+                                                  args.offload_megabytes_per_minute, clock)
+        object_detector = TimedObjectDetector(edge_server, cloud_server, executor, cloud_detection_deadline=30,
+                                              dimensions=DIMENSIONS, cloud_tracking=cloud_tracking,
+                                              cloud_tracking_identity=f"edge-device-{stream_id}",
+                                              cloud_tracking_min_score=20, cloud_tracking_stride=2,
+                                              max_fps=args.max_fps, offload_scheduler=offload_scheduler,
+                                              clock=clock, metrics=stream_metrics, verbose=False)
+
+        rate_controller = get_detection_rate_controller(args.adaptive_detection_rate, args.detection_rate,
+                                                        args.min_detection_rate, args.max_detection_rate,
+                                                        args.target_fps, mode == 'sync', stream_metrics)
+
+        streams.append(Stream(stream_id, object_tracker, object_detector, rate_controller, HeadlessRenderer(),
+                              clock, stream_metrics))
+        edge_servers.append(edge_server)
+        cloud_servers.append(cloud_server)
+        object_detectors.append(object_detector)
+
+    edge_device = EdgeDevice(DIMENSIONS, args.max_fps, streams, sync=mode == 'sync', verbose=False,
+                             result_writer=get_result_writer('npz', None))
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+
+    for stream in streams:
+        stream.object_detector.start_cloud_tracking()
+    edge_device.process(video, None)
+    for stream in streams:
+        stream.object_detector.stop_cloud_tracking()
+    cloud_tracking.stop()
+
+    wall_time = time.time() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if edge_server_connection is not None:
+        edge_server_connection.close()
+    executor.shutdown()
+    http_client.close()
+
+    cpu_time = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    worker_cpu_time = (children_after.ru_utime - children_before.ru_utime) + \
+                      (children_after.ru_stime - children_before.ru_stime)
+
+    fps = [value for stream in streams for value in stream.all_fps[1:]]
+    return dict(
+        mode=mode,
+        frames=len(edge_device.all_fps),
+        detections=edge_device.num_detections,
+        wall_time_s=round(wall_time, 3),
+        fps=_summarize(fps, scale=1.0),
+        fps_per_stream=[_summarize(stream.all_fps[1:], scale=1.0) for stream in streams],
+        frame_time_ms=_summarize([1 / value for value in fps], scale=1000.0),
+        edge_rtt_ms=_summarize([value for server in edge_servers for value in server.round_trip_times],
+                               scale=1000.0),
+        cloud_rtt_ms=_summarize([value for server in cloud_servers for value in server.round_trip_times],
+                                scale=1000.0),
+        cloud_catch_up_ms=_summarize([value for detector in object_detectors for value in detector.catch_up_times],
+                                     scale=1000.0),
+        cpu=dict(
+            process_s=round(cpu_time, 3),
+            process_percent=round(100 * cpu_time / wall_time, 1),
+            cloud_tracking_worker_s=round(worker_cpu_time, 3)
+        ),
+        rss_mb=dict(
+            process_peak=round(usage_after.ru_maxrss / 1024, 1),
+            cloud_tracking_worker_peak=round(children_after.ru_maxrss / 1024, 1)
+        ),
+        stages=metrics.snapshot()['histograms'],
+        counters=metrics.snapshot()['counters']
+    )
+
+
+def _summarize(values: List[float], scale: float) -> Dict[str, float]:
+    if not values:
+        return dict(count=0)
+
+    values = np.array(values) * scale
+    p50, p90, p95, p99 = np.percentile(values, [50, 90, 95, 99])
+    return dict(count=len(values), mean=round(float(values.mean()), 3), min=round(float(values.min()), 3),
+                p50=round(float(p50), 3), p90=round(float(p90), 3), p95=round(float(p95), 3),
+                p99=round(float(p99), 3), max=round(float(values.max()), 3))
+
+
+def _edge_latency(args, seed: int) -> Latency:
+    return ModelledLatency(args.edge_latency_ms, args.edge_jitter_ms, args.uplink_mbps, seed)
+
+
+def _cloud_latency(args, seed: int) -> Latency:
+    return ModelledLatency(args.cloud_latency_ms, args.cloud_jitter_ms, args.uplink_mbps, seed)
+
+
+def _canned_detections(num_detections: int, width: int, height: int, seed: int):
+    rand = random.Random(seed)
+    bboxes, scores, category_ids = [], [], []
+    for _ in range(num_detections):
+        w = rand.uniform(0.02, 0.08) * width
+        h = rand.uniform(0.02, 0.08) * height
+        x = rand.uniform(0, width - w)
+        y = rand.uniform(0, height - h)
+        bboxes.append([x, y, x + w, y + h])
+        scores.append(rand.randint(30, 99))
+        category_ids.append(rand.choice(CATEGORIES)["id"])
+    return bboxes, scores, category_ids
+
+
+def main(args):
+    os.makedirs("/tmp/edge-device", exist_ok=True)
+
+    no_latency = ModelledLatency(0.0, 0.0, None, args.seed)
+    edge_latency = no_latency if args.simulate else _edge_latency(args, args.seed)
+    cloud_latency = no_latency if args.simulate else _cloud_latency(args, args.seed + 1)
+    edge_stand_in = EdgeServerStandIn(edge_latency, args.edge_detections, args.seed)
+    cloud_stand_in = CloudServerStandIn(cloud_latency, args.cloud_detections, args.seed)
+    edge_stand_in.start(args.ipc)
+    cloud_stand_in.start()
+    args.cloud_url = cloud_stand_in.url()
+
+    with tempfile.TemporaryDirectory() as directory:
+        video = args.video
+        if video is None:
+            frames_directory = os.path.join(directory, "frames")
+            os.makedirs(frames_directory)
+            video = create_frames(frames_directory, args.frames, args.width, args.height, args.seed)
+        if args.streams > 1:
+            video = link_videos(directory, os.path.dirname(video), args.streams)
+
+        runs = [run(mode, video, args) for mode in args.modes]
+
+    edge_stand_in.stop()
+    cloud_stand_in.stop()
+
+    config = {key: value for key, value in vars(args).items() if key not in ['output', 'cloud_url']}
+    report = dict(config=config, runs=runs)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for result in runs:
+        print(f"{result['mode']}: {result['fps'].get('mean')} FPS (p50 {result['fps'].get('p50')}), "
+              f"edge RTT p50 {result['edge_rtt_ms'].get('p50')} ms, "
+              f"cloud catch-up p50 {result['cloud_catch_up_ms'].get('p50')} ms, "
+              f"CPU {result['cpu']['process_percent']}%")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('video', nargs='?', help="glob of recorded JPEG frames, defaults to synthetic frames")
+    parser.add_argument('--frames', type=int, default=120, help="number of synthetic frames")
+    parser.add_argument('--width', type=int, default=1344)
+    parser.add_argument('--height', type=int, default=756)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--detection-rate', type=int, default=5)
+    parser.add_argument('--adaptive-detection-rate', action='store_true')
+    parser.add_argument('--target-fps', type=float, default=20)
+    parser.add_argument('--min-detection-rate', type=int, default=1)
+    parser.add_argument('--max-detection-rate', type=int, default=15)
+    parser.add_argument('--content-aware-offload', action='store_true')
+    parser.add_argument('--offload-requests-per-minute', type=int)
+    parser.add_argument('--offload-megabytes-per-minute', type=float)
+    parser.add_argument('--frame-encoding', choices=FRAME_ENCODINGS, default='fixed')
+    parser.add_argument('--edge-latency-target-ms', type=float, default=100)
+    parser.add_argument('--cloud-latency-target-ms', type=float, default=1000)
+    parser.add_argument('--max-fps', type=int, default=24)
+    parser.add_argument('--tracker', choices=TRACKER_ENGINES, default='mosse')
+    parser.add_argument('--wire-format', choices=WIRE_FORMATS, default=WIRE_FORMAT_BINARY)
+    parser.add_argument('--ipc', action='store_true')
+    parser.add_argument('--streams', type=int, default=1, help="number of streams, each processing the frames")
+    parser.add_argument('--edge-latency-ms', type=float, default=40)
+    parser.add_argument('--edge-jitter-ms', type=float, default=10)
+    parser.add_argument('--edge-detections', type=int, default=30)
+    parser.add_argument('--cloud-latency-ms', type=float, default=250)
+    parser.add_argument('--cloud-jitter-ms', type=float, default=50)
+    parser.add_argument('--uplink-mbps', type=float, help="simulated uplink bandwidth, unlimited by default")
+    parser.add_argument('--cloud-detections', type=int, default=60)
+    parser.add_argument('--simulate', action='store_true', help="run on simulated clocks, latencies are simulated")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_system.json')
+    args = parser.parse_args()
+
+    main(args)
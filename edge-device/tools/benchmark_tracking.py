@@ -0,0 +1,73 @@
+import argparse
+import random
+import statistics
+import sys
+import time
+
+import cv2 as cv
+import numpy as np
+
+sys.path.append('..')
+
+from model import Frame, DetectionBatch, DetectionType
+from track import MultiObjectTracker
+from tracker_engine import TRACKER_ENGINES
+
+WIDTH = 640
+HEIGHT = 512
+
+
+def create_frames(num_frames: int, seed: int):
+    rng = np.random.default_rng(seed)
+    texture = rng.integers(0, 256, size=(HEIGHT + num_frames, WIDTH + num_frames, 3), dtype=np.uint8)
+    texture = cv.GaussianBlur(texture, (7, 7), 0)
+    return [
+        Frame(id=idx, video='benchmark', data=None,
+              edge_data=np.ascontiguousarray(texture[idx:idx + HEIGHT, idx:idx + WIDTH]))
+        for idx in range(num_frames)
+    ]
+
+
+def create_detections(num_objects: int, seed: int) -> DetectionBatch:
+    rand = random.Random(seed)
+    bboxes = []
+    for _ in range(num_objects):
+        w = rand.randint(8, 40)
+        h = rand.randint(8, 40)
+        x = rand.randint(0, WIDTH - w - 1)
+        y = rand.randint(0, HEIGHT - h - 1)
+        bboxes.append([x, y, w, h])
+    return DetectionBatch.create(bboxes, [90] * num_objects, [3] * num_objects, DetectionType.EDGE)
+
+
+def benchmark(engine: str, num_workers: int, num_objects: int, frames, seed: int) -> float:
+    object_tracker = MultiObjectTracker(min_score=20, drop=False, engine=engine, num_workers=num_workers)
+    object_tracker.add_objects(frames[0], create_detections(num_objects, seed))
+
+    times = []
+    for frame in frames[1:]:
+        start = time.perf_counter()
+        object_tracker.track_objects(frame)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def main(object_counts, num_frames: int, num_workers: int, seed: int):
+    frames = create_frames(num_frames, seed)
+
+    print(f"{'objects':>8}" + "".join(f"{engine + ' (ms)':>14}" for engine in TRACKER_ENGINES))
+    for num_objects in object_counts:
+        times = [benchmark(engine, num_workers, num_objects, frames, seed) for engine in TRACKER_ENGINES]
+        print(f"{num_objects:>8}" + "".join(f"{t * 1000:>14.2f}" for t in times))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', nargs='+', type=int, default=[10, 50, 100, 200, 400, 800])
+    parser.add_argument('--frames', type=int, default=25)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.objects, args.frames, args.workers, args.seed)
@@ -1,29 +1,28 @@
 import argparse
-import json
 import sys
 
 sys.path.append('..')
 
-from evaluation import evaluate_detections
-from model import DetectionView, DetectionType
+from evaluation import Evaluator
+from results import read_results
 
 
-def main(annotations_path: str):
-    with open('all_detections.json') as f:
-        loaded_detections = json.load(f)
-        detections = [
-            DetectionView(detection['frame_id'], detection['x'], detection['y'], detection['w'], detection['h'],
-                          detection['score'], detection['category'], DetectionType[detection['type'].split('.')[1]],
-                          detection['tracked'])
-            for detection in loaded_detections
-        ]
+def main(annotations_path: str, results_path: str):
+    evaluator = Evaluator(annotations_path)
 
-        evaluate_detections(detections, annotations_path)
+    # Chunks never split the detections of a frame, so they can be matched one chunk at a time.
+    for detections in read_results(results_path):
+        evaluator.add(detections)
+        evaluator.match()
+
+    evaluator.evaluate(evaluator.image_id_range())
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("annotations")
+    parser.add_argument("results", nargs="?", default='detections',
+                        help="detections/ written by main.py, a detections.jsonl or an all_detections.json")
     args = parser.parse_args()
 
-    main(args.annotations)
+    main(args.annotations, args.results)
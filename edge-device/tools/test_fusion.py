@@ -1,66 +1,236 @@
+import sys
+
+import numpy as np
+from pycocotools.coco import maskUtils as mask
+from scipy.optimize import linear_sum_assignment
+
+sys.path.append('..')
+
+import fusion
+from category import to_category_ids
 from fusion import fuse_edge_cloud_detections
-from model import Detection, DetectionType
-
-current1 = [Detection(category='people', score=52, bbox=[640, 710, 15, 26]),
-            Detection(category='car', score=92, bbox=[706, 721, 37, 70]),
-            Detection(category='car', score=87, bbox=[785, 471, 26, 26]),
-            Detection(category='car', score=87, bbox=[637, 632, 34, 54]),
-            Detection(category='car', score=84, bbox=[773, 429, 22, 22]),
-            Detection(category='car', score=84, bbox=[693, 488, 26, 28]),
-            Detection(category='car', score=82, bbox=[689, 533, 28, 37]),
-            Detection(category='car', score=78, bbox=[704, 357, 15, 14]),
-            Detection(category='car', score=73, bbox=[885, 531, 37, 36]),
-            Detection(category='car', score=67, bbox=[621, 399, 19, 21]),
-            Detection(category='car', score=67, bbox=[660, 440, 22, 24]),
-            Detection(category='car', score=66, bbox=[721, 443, 20, 25]),
-            Detection(category='car', score=60, bbox=[1158, 460, 29, 27]),
-            Detection(category='car', score=57, bbox=[720, 292, 10, 10]),
-            Detection(category='car', score=55, bbox=[649, 538, 29, 36]),
-            Detection(category='car', score=52, bbox=[826, 452, 17, 20]),
-            Detection(category='motor', score=61, bbox=[614, 757, 17, 32])]
-new1 = [Detection(category='people', score=37, bbox=[777, 666, 12, 20]),
-        Detection(category='car', score=99, bbox=[1188, 728, 90, 72]),
-        Detection(category='car', score=99, bbox=[1154, 469, 25, 27]),
-        Detection(category='car', score=99, bbox=[1079, 465, 36, 20]),
-        Detection(category='car', score=99, bbox=[1230, 451, 45, 24]),
-        Detection(category='car', score=99, bbox=[1265, 458, 45, 27]),
-        Detection(category='car', score=99, bbox=[695, 623, 36, 72]),
-        Detection(category='car', score=99, bbox=[691, 563, 30, 40]),
-        Detection(category='car', score=36, bbox=[779, 339, 24, 13]),
-        Detection(category='awning-tricycle', score=31, bbox=[826, 470, 18, 23]),
-        Detection(category='motor', score=32, bbox=[445, 529, 19, 17])]
-
-result1 = fuse_edge_cloud_detections(current1, new1, DetectionType.CLOUD)
-
-current2 = [Detection(category='people', score=37, bbox=[777, 666, 12, 20]),
-            Detection(category='car', score=99, bbox=[1188, 728, 90, 72]),
-            Detection(category='car', score=99, bbox=[1154, 469, 25, 27]),
-            Detection(category='car', score=99, bbox=[1079, 465, 36, 20]),
-            Detection(category='car', score=99, bbox=[1230, 451, 45, 24]),
-            Detection(category='car', score=99, bbox=[1265, 458, 45, 27]),
-            Detection(category='car', score=99, bbox=[695, 623, 36, 72]),
-            Detection(category='car', score=99, bbox=[691, 563, 30, 40]),
-            Detection(category='car', score=36, bbox=[779, 339, 24, 13]),
-            Detection(category='awning-tricycle', score=31, bbox=[826, 470, 18, 23]),
-            Detection(category='motor', score=32, bbox=[445, 529, 19, 17])]
-new2 = [Detection(category='car', score=91, bbox=[637, 647, 36, 59]),
-        Detection(category='car', score=90, bbox=[689, 503, 28, 36]),
-        Detection(category='car', score=88, bbox=[695, 542, 32, 39]),
-        Detection(category='car', score=83, bbox=[708, 361, 14, 15]),
-        Detection(category='car', score=81, bbox=[657, 449, 23, 25]),
-        Detection(category='car', score=73, bbox=[1161, 462, 30, 26]),
-        Detection(category='car', score=71, bbox=[785, 443, 25, 27]),
-        Detection(category='car', score=68, bbox=[625, 400, 19, 22]),
-        Detection(category='car', score=66, bbox=[720, 446, 23, 28]),
-        Detection(category='car', score=65, bbox=[733, 294, 10, 10]),
-        Detection(category='car', score=61, bbox=[818, 444, 24, 23]),
-        Detection(category='car', score=56, bbox=[1281, 457, 35, 25]),
-        Detection(category='car', score=51, bbox=[1243, 455, 37, 22]),
-        Detection(category='car', score=50, bbox=[648, 549, 30, 38]),
-        Detection(category='motor', score=62, bbox=[650, 732, 16, 35]),
-        Detection(category='motor', score=54, bbox=[523, 599, 14, 25])]
-
-result2 = fuse_edge_cloud_detections(current2, new2, DetectionType.EDGE)
+from model import DetectionBatch, DetectionType
+
+
+def fuse_edge_cloud_detections_baseline(current_detections: DetectionBatch,
+                                        new_detections: DetectionBatch,
+                                        new_type: DetectionType) -> DetectionBatch:
+    if not len(current_detections):
+        return DetectionBatch.create(new_detections.bboxes, new_detections.scores, new_detections.categories,
+                                     new_type)
+
+    if not len(new_detections):
+        return DetectionBatch.empty()
+
+    current_detection_bboxes = current_detections.bboxes.tolist()
+    new_detection_bboxes = new_detections.bboxes.tolist()
+
+    diff = len(current_detection_bboxes) - len(new_detection_bboxes)
+    if diff < 0:
+        current_detection_bboxes.extend([[0, 0, 0, 0]] * (diff * (-1)))
+    elif diff > 0:
+        new_detection_bboxes.extend([[0, 0, 0, 0]] * diff)
+
+    M = mask.iou(current_detection_bboxes, new_detection_bboxes, [0] * len(new_detection_bboxes))
+    M[M < 0.5] = 0
+
+    current_ind, new_ind = linear_sum_assignment(M, maximize=True)
+    result = []
+
+    for i, j in zip(current_ind, new_ind):
+        if M[i, j] != 0:
+            if new_type == DetectionType.CLOUD:
+                category = new_detections.categories[j]
+                bbox = current_detections.bboxes[i]
+            else:
+                category = current_detections.categories[i]
+                bbox = new_detections.bboxes[j]
+            result.append((bbox, new_detections.scores[j], category, new_type))
+        else:
+            if j < len(new_detections):
+                result.append((new_detections.bboxes[j], new_detections.scores[j], new_detections.categories[j],
+                               new_type))
+
+            if i < len(current_detections) and new_type == DetectionType.CLOUD:
+                result.append((current_detections.bboxes[i], current_detections.scores[i],
+                               current_detections.categories[i], DetectionType.EDGE))
+
+    return DetectionBatch(
+        bboxes=np.array([bbox for bbox, _, _, _ in result]).reshape(-1, 4),
+        scores=np.array([score for _, score, _, _ in result], dtype=np.int32),
+        categories=np.array([category for _, _, category, _ in result], dtype=np.int16),
+        types=np.array([det_type.value for _, _, _, det_type in result], dtype=np.int8)
+    )
+
+
+def match_detections_baseline(current_bboxes, new_bboxes):
+    size = max(len(current_bboxes), len(new_bboxes))
+    current_padded = np.zeros((size, 4))
+    current_padded[:len(current_bboxes)] = current_bboxes
+    new_padded = np.zeros((size, 4))
+    new_padded[:len(new_bboxes)] = new_bboxes
+
+    M = mask.iou(current_padded, new_padded, [0] * size)
+    M[M < 0.5] = 0
+    current_ind, new_ind = linear_sum_assignment(M, maximize=True)
+    paired = M[current_ind, new_ind] != 0
+    return current_ind[paired], new_ind[paired]
+
+
+def random_batch(rng, num_boxes: int, det_type: DetectionType, reference_bboxes=None,
+                 ties: bool = True) -> DetectionBatch:
+    # Boxes on a coarse integer grid, partly copied or shifted from the other set, give many exact IoU ties.
+    # Without ties, the boxes are moved off the grid a little.
+    bboxes = np.column_stack([rng.integers(0, 200, num_boxes), rng.integers(0, 200, num_boxes),
+                              rng.integers(4, 40, num_boxes), rng.integers(4, 40, num_boxes)]).astype(np.float64)
+    if reference_bboxes is not None and len(reference_bboxes):
+        copied = rng.random(num_boxes) < 0.6
+        sources = reference_bboxes[rng.integers(0, len(reference_bboxes), num_boxes)]
+        sources[:, 0:2] += rng.integers(-2, 3, (num_boxes, 2))
+        bboxes[copied] = sources[copied]
+    if not ties:
+        bboxes += rng.uniform(0, 0.5, bboxes.shape)
+    return DetectionBatch.create(bboxes, rng.integers(0, 100, num_boxes), rng.integers(0, 10, num_boxes), det_type)
+
+
+def same_detections(a: DetectionBatch, b: DetectionBatch) -> bool:
+    # Fused detections are compared regardless of their order.
+    def rows(batch: DetectionBatch):
+        columns = np.column_stack([batch.bboxes, batch.scores, batch.categories, batch.types])
+        return columns[np.lexsort(columns.T[::-1])]
+    return len(a) == len(b) and np.array_equal(rows(a), rows(b))
+
+
+def summed_iou(current_bboxes, new_bboxes, current_ind, new_ind) -> float:
+    return float(np.diag(mask.iou(current_bboxes[current_ind], new_bboxes[new_ind], [0] * len(new_ind))).sum()) \
+        if len(new_ind) else 0.0
+
+
+def compare_with_baseline(seed: int, num_cases: int):
+    rng = np.random.default_rng(seed)
+    max_dense_pairs = fusion.MAX_DENSE_PAIRS
+    max_component_share = fusion.MAX_COMPONENT_SHARE
+    mismatches = 0
+    for case in range(num_cases):
+        # Most cases take the component path regardless of their size, some without falling back to the full matrix.
+        fusion.MAX_DENSE_PAIRS = 0 if case % 3 else max_dense_pairs
+        fusion.MAX_COMPONENT_SHARE = 1.0 if case % 3 == 2 else max_component_share
+        ties = case % 2 == 0
+        num_current = int(rng.integers(0, 40))
+        num_new = int(rng.integers(0, 40))
+        new_type = DetectionType.CLOUD if case % 4 < 2 else DetectionType.EDGE
+        current_type = DetectionType.EDGE if new_type == DetectionType.CLOUD else DetectionType.CLOUD
+
+        current_detections = random_batch(rng, num_current, current_type, ties=ties)
+        new_detections = random_batch(rng, num_new, new_type, current_detections.bboxes, ties=ties)
+        if not compare_case(current_detections, new_detections, new_type, ties):
+            mismatches += 1
+    fusion.MAX_DENSE_PAIRS = max_dense_pairs
+    fusion.MAX_COMPONENT_SHARE = max_component_share
+
+    for num_boxes in [300, 1000]:
+        for ties in [True, False]:
+            current_detections = random_batch(rng, num_boxes, DetectionType.EDGE, ties=ties)
+            new_detections = random_batch(rng, num_boxes - 10, DetectionType.CLOUD, current_detections.bboxes,
+                                          ties=ties)
+            if not compare_case(current_detections, new_detections, DetectionType.CLOUD, ties):
+                mismatches += 1
+
+    print(f"Baseline comparison: {mismatches} of {num_cases + 4} cases differ")
+    assert mismatches == 0
+
+
+def compare_case(current_detections: DetectionBatch, new_detections: DetectionBatch, new_type: DetectionType,
+                 ties: bool) -> bool:
+    if not len(current_detections) or not len(new_detections):
+        return same_detections(fuse_edge_cloud_detections(current_detections, new_detections, new_type),
+                               fuse_edge_cloud_detections_baseline(current_detections, new_detections, new_type))
+
+    current_bboxes, new_bboxes = current_detections.bboxes, new_detections.bboxes
+    expected = match_detections_baseline(current_bboxes, new_bboxes)
+    matched = fusion.match_detections(current_bboxes, new_bboxes)
+    if ties:
+        # Equally good assignments may differ, their summed IoU may not.
+        return np.isclose(summed_iou(current_bboxes, new_bboxes, *matched),
+                          summed_iou(current_bboxes, new_bboxes, *expected))
+
+    order = np.argsort(expected[0])
+    return all(np.array_equal(a, b[order]) for a, b in zip(matched, expected)) and same_detections(
+        fuse_edge_cloud_detections(current_detections, new_detections, new_type),
+        fuse_edge_cloud_detections_baseline(current_detections, new_detections, new_type))
+
+
+def to_batch(detections, det_type: DetectionType) -> DetectionBatch:
+    return DetectionBatch.create(
+        bboxes=[bbox for _, _, bbox in detections],
+        scores=[score for _, score, _ in detections],
+        categories=to_category_ids([category for category, _, _ in detections]),
+        det_type=det_type
+    )
+
+
+current1 = [('people', 52, [640, 710, 15, 26]),
+            ('car', 92, [706, 721, 37, 70]),
+            ('car', 87, [785, 471, 26, 26]),
+            ('car', 87, [637, 632, 34, 54]),
+            ('car', 84, [773, 429, 22, 22]),
+            ('car', 84, [693, 488, 26, 28]),
+            ('car', 82, [689, 533, 28, 37]),
+            ('car', 78, [704, 357, 15, 14]),
+            ('car', 73, [885, 531, 37, 36]),
+            ('car', 67, [621, 399, 19, 21]),
+            ('car', 67, [660, 440, 22, 24]),
+            ('car', 66, [721, 443, 20, 25]),
+            ('car', 60, [1158, 460, 29, 27]),
+            ('car', 57, [720, 292, 10, 10]),
+            ('car', 55, [649, 538, 29, 36]),
+            ('car', 52, [826, 452, 17, 20]),
+            ('motor', 61, [614, 757, 17, 32])]
+new1 = [('people', 37, [777, 666, 12, 20]),
+        ('car', 99, [1188, 728, 90, 72]),
+        ('car', 99, [1154, 469, 25, 27]),
+        ('car', 99, [1079, 465, 36, 20]),
+        ('car', 99, [1230, 451, 45, 24]),
+        ('car', 99, [1265, 458, 45, 27]),
+        ('car', 99, [695, 623, 36, 72]),
+        ('car', 99, [691, 563, 30, 40]),
+        ('car', 36, [779, 339, 24, 13]),
+        ('awning-tricycle', 31, [826, 470, 18, 23]),
+        ('motor', 32, [445, 529, 19, 17])]
+
+result1 = fuse_edge_cloud_detections(to_batch(current1, DetectionType.EDGE), to_batch(new1, DetectionType.CLOUD),
+                                     DetectionType.CLOUD)
+
+current2 = [('people', 37, [777, 666, 12, 20]),
+            ('car', 99, [1188, 728, 90, 72]),
+            ('car', 99, [1154, 469, 25, 27]),
+            ('car', 99, [1079, 465, 36, 20]),
+            ('car', 99, [1230, 451, 45, 24]),
+            ('car', 99, [1265, 458, 45, 27]),
+            ('car', 99, [695, 623, 36, 72]),
+            ('car', 99, [691, 563, 30, 40]),
+            ('car', 36, [779, 339, 24, 13]),
+            ('awning-tricycle', 31, [826, 470, 18, 23]),
+            ('motor', 32, [445, 529, 19, 17])]
+new2 = [('car', 91, [637, 647, 36, 59]),
+        ('car', 90, [689, 503, 28, 36]),
+        ('car', 88, [695, 542, 32, 39]),
+        ('car', 83, [708, 361, 14, 15]),
+        ('car', 81, [657, 449, 23, 25]),
+        ('car', 73, [1161, 462, 30, 26]),
+        ('car', 71, [785, 443, 25, 27]),
+        ('car', 68, [625, 400, 19, 22]),
+        ('car', 66, [720, 446, 23, 28]),
+        ('car', 65, [733, 294, 10, 10]),
+        ('car', 61, [818, 444, 24, 23]),
+        ('car', 56, [1281, 457, 35, 25]),
+        ('car', 51, [1243, 455, 37, 22]),
+        ('car', 50, [648, 549, 30, 38]),
+        ('motor', 62, [650, 732, 16, 35]),
+        ('motor', 54, [523, 599, 14, 25])]
+
+result2 = fuse_edge_cloud_detections(to_batch(current2, DetectionType.CLOUD), to_batch(new2, DetectionType.EDGE),
+                                     DetectionType.EDGE)
 
 print(current1)
 print(new1)
@@ -79,3 +249,6 @@ print("Edge:")
 print("Len current2:", len(current2))
 print("Len new2:", len(new2))
 print("Len result2:", len(result2))
+
+print()
+compare_with_baseline(seed=0, num_cases=2000)
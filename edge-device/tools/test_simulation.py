@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.append('..')
+
+from benchmark_system import EdgeServerStandIn, CloudServerStandIn, create_frames
+from category import CATEGORIES
+from results import read_results
+from simulation import ModelledLatency
+
+EDGE_DEVICE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def create_annotations(path: str, frames: str, video_name: str):
+    # Results are only written for annotated videos, every frame gets one annotation.
+    images = [dict(id=idx + 1, file_name=f"{video_name}/{file_name}", width=1344, height=756)
+              for idx, file_name in enumerate(sorted(os.listdir(frames)))]
+    annotations = [dict(id=image['id'], image_id=image['id'], bbox=[100, 100, 40, 30], category_id=4, area=1200,
+                        iscrowd=0)
+                   for image in images]
+    with open(path, 'w') as f:
+        json.dump(dict(images=images, annotations=annotations, categories=CATEGORIES), f)
+
+
+def run(videos: str, annotations: str, results: str, seed: int):
+    subprocess.run([sys.executable, 'main.py', videos, annotations, '--simulate', '--headless', '--results', results,
+                    '--metrics-snapshot', f"{results}.json", '--seed', str(seed)],
+                   cwd=EDGE_DEVICE_DIRECTORY, check=True, stdout=subprocess.DEVNULL)
+    return [detection for chunk in read_results(results) for detection in chunk]
+
+
+def main(num_frames: int, seed: int):
+    no_latency = ModelledLatency(0.0, 0.0, None, seed)
+    edge_stand_in = EdgeServerStandIn(no_latency, 30, seed)
+    cloud_stand_in = CloudServerStandIn(no_latency, 60, seed, port=9093)
+    edge_stand_in.start(ipc=False)
+    cloud_stand_in.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        frames = os.path.join(directory, "videos", "video-0")
+        os.makedirs(frames)
+        create_frames(frames, num_frames, 1344, 756, seed)
+        annotations = os.path.join(directory, "annotations.json")
+        create_annotations(annotations, frames, "video-0")
+
+        videos = os.path.join(directory, "videos", "*")
+        first = run(videos, annotations, os.path.join(directory, "first"), seed)
+        second = run(videos, annotations, os.path.join(directory, "second"), seed)
+
+    edge_stand_in.stop()
+    cloud_stand_in.stop()
+
+    print(f"Simulated runs: {len(first)} and {len(second)} detections, identical: {first == second}")
+    assert first and first == second
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=96)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.frames, args.seed)
@@ -1,66 +1,85 @@
 import cv2 as cv
-from typing import List
+import numpy as np
+from typing import List, Any
 
-from model import TrackerRecord, Frame, Detection, DetectionType, DetectionsWithTypes
+from model import Frame, DetectionBatch, TrackerHealth
+from tracker_engine import TrackerEngine, get_tracker_engine
 
 
 class MultiObjectTracker:
-    trackers: List[TrackerRecord]
+    detections: DetectionBatch
+    raw_trackers: List[Any]
     min_score: int
     drop: bool
+    engine: TrackerEngine
+    added_score: int
+    health: TrackerHealth
 
-    def __init__(self, min_score: int, drop: bool):
-        self.trackers = []
+    def __init__(self, min_score: int, drop: bool, engine: str = 'mosse', num_workers: int = 1):
+        self.detections = DetectionBatch.empty()
+        self.raw_trackers = []
         self.min_score = min_score
         self.drop = drop
+        self.engine = get_tracker_engine(engine, num_workers)
+        self.added_score = 0
+        self.health = TrackerHealth(updates=0, failures=0, score_retention=1.0)
 
     def reset_objects(self):
-        self.trackers = []
+        self.detections = DetectionBatch.empty()
+        self.raw_trackers = []
+        self.engine.reset()
+        self.added_score = 0
 
-    def add_object(self, frame: Frame, detection: Detection, det_type: DetectionType):
-        if detection.score < self.min_score:
-            if not self.drop:
-                self.trackers.append(
-                    TrackerRecord(None, detection.bbox, detection.score, detection.category, det_type)
-                )
-            return
+    def add_objects(self, frame: Frame, detections: DetectionBatch):
+        added = []
+        for idx, (bbox, score) in enumerate(zip(detections.bboxes.tolist(), detections.scores.tolist())):
+            if score < self.min_score:
+                if not self.drop:
+                    added.append(idx)
+                    self.raw_trackers.append(None)
+                continue
 
-        tracker = cv.legacy.TrackerMOSSE_create()
-        try:
-            tracker.init(frame.edge_data, detection.bbox)
-            self.trackers.append(
-                TrackerRecord(tracker, detection.bbox, detection.score, detection.category, det_type)
-            )
-        except cv.error as e:
-            print(f"Failed to init a tracker: {e}")
+            try:
+                self.raw_trackers.append(self.engine.add(frame, bbox))
+                added.append(idx)
+            except cv.error as e:
+                print(f"Failed to init a tracker: {e}")
+
+        self.detections = DetectionBatch.concatenate([self.detections, detections.select(added)])
+        self.added_score += int(detections.scores[added].sum())
 
     def track_objects_until_current(self, frames_until_current: List[Frame],
-                                    current_frame: Frame, decay: float = 0.9) -> DetectionsWithTypes:
+                                    current_frame: Frame, decay: float = 0.9) -> DetectionBatch:
         for frame in frames_until_current:
             self.track_objects(frame, decay)
 
         return self.track_objects(current_frame, decay)
 
-    def track_objects(self, frame: Frame, decay: float = 0.8) -> DetectionsWithTypes:
-        result = []
-        for tracker in self.trackers:
-            if tracker.raw_tracker is None:
-                new_score = int(decay * tracker.det_score)
-                tracker.det_score = new_score
-                result.append(
-                    (Detection(tracker.det_category, new_score, list(map(int, tracker.det_bbox))), tracker.det_type)
-                )
-            else:
-                ok, bbox = tracker.raw_tracker.update(frame.edge_data)
-                if ok:
-                    result.append(
-                        (Detection(tracker.det_category, tracker.det_score, list(map(int, bbox))), tracker.det_type)
-                    )
-                elif not self.drop:
-                    new_score = int(decay * tracker.det_score)
-                    tracker.det_score = new_score
-                    result.append(
-                        (Detection(tracker.det_category, new_score, list(map(int, tracker.det_bbox))), tracker.det_type)
-                    )
+    def track_objects(self, frame: Frame, decay: float = 0.8) -> DetectionBatch:
+        has_tracker = np.array([raw_tracker is not None for raw_tracker in self.raw_trackers], dtype=bool)
+        updates = self.engine.update(frame, [raw_tracker for raw_tracker in self.raw_trackers
+                                             if raw_tracker is not None])
+
+        ok = np.zeros(len(self.detections), dtype=bool)
+        ok[has_tracker] = [tracker_ok for tracker_ok, _ in updates]
+        bboxes = self.detections.bboxes.copy()
+        bboxes[ok] = np.array([bbox for tracker_ok, bbox in updates if tracker_ok], dtype=np.float64).reshape(-1, 4)
+
+        failed = has_tracker & ~ok
+        decayed = ~has_tracker if self.drop else ~ok
+        self.detections.scores[decayed] = (decay * self.detections.scores[decayed]).astype(np.int32)
+
+        self.health = TrackerHealth(
+            updates=len(updates),
+            failures=int(failed.sum()),
+            score_retention=float(self.detections.scores.sum()) / self.added_score if self.added_score else 1.0
+        )
 
-        return [(detection, det_type) for detection, det_type in result if detection.score > 0]
+        keep = ~failed if self.drop else np.ones(len(self.detections), dtype=bool)
+        keep &= self.detections.scores > 0
+        return DetectionBatch(
+            bboxes=np.trunc(bboxes[keep]),
+            scores=self.detections.scores[keep],
+            categories=self.detections.categories[keep],
+            types=self.detections.types[keep]
+        )
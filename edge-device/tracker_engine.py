@@ -0,0 +1,149 @@
+import cv2 as cv
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Any, Union
+from typing_extensions import Protocol
+
+from model import Frame
+
+TRACKER_ENGINES = ['mosse', 'flow']
+MIN_TRACKERS_PER_WORKER = 8
+
+
+class TrackerEngine(Protocol):
+    def reset(self):
+        ...
+
+    def add(self, frame: Frame, bbox: List[float]) -> Any:
+        ...
+
+    def update(self, frame: Frame, raw_trackers: List[Any]) -> List[Tuple[bool, Any]]:
+        ...
+
+
+class MOSSETrackerEngine:
+    num_workers: int
+    executor: Union[ThreadPoolExecutor, None]
+
+    def __init__(self, num_workers: int = 1):
+        self.num_workers = num_workers
+        self.executor = ThreadPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+
+    def reset(self):
+        pass
+
+    def add(self, frame: Frame, bbox: List[float]) -> Any:
+        raw_tracker = cv.legacy.TrackerMOSSE_create()
+        raw_tracker.init(frame.edge_data, bbox)
+        return raw_tracker
+
+    def update(self, frame: Frame, raw_trackers: List[Any]) -> List[Tuple[bool, Any]]:
+        num_shards = min(self.num_workers, len(raw_trackers) // MIN_TRACKERS_PER_WORKER)
+        if self.executor is None or num_shards < 2:
+            return _update_all(frame, raw_trackers)
+
+        shard_size = -(-len(raw_trackers) // num_shards)
+        shards = [raw_trackers[start:start + shard_size] for start in range(0, len(raw_trackers), shard_size)]
+        results = self.executor.map(_update_all, [frame] * len(shards), shards)
+        return [result for shard_result in results for result in shard_result]
+
+
+class OpticalFlowTrackerEngine:
+    grid_size: int
+    min_points: int
+    max_fb_error: Union[float, None]
+    lk_params: dict
+
+    bboxes: Any
+    added_bboxes: List[List[float]]
+    prev_gray: Any
+    prev_edge_data: Any
+
+    def __init__(self, grid_size: int = 3, min_points: int = 3, max_fb_error: Union[float, None] = None,
+                 win_size: int = 9, max_level: int = 2):
+        self.grid_size = grid_size
+        self.min_points = min_points
+        self.max_fb_error = max_fb_error
+        self.lk_params = dict(
+            winSize=(win_size, win_size),
+            maxLevel=max_level,
+            criteria=(cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 10, 0.03)
+        )
+        self.reset()
+
+    def reset(self):
+        self.bboxes = np.empty((0, 4), dtype=np.float32)
+        self.added_bboxes = []
+        self.prev_gray = None
+        self.prev_edge_data = None
+
+    def add(self, frame: Frame, bbox: List[float]) -> Any:
+        self._set_previous(frame)
+        self.added_bboxes.append(bbox)
+        return len(self.bboxes) + len(self.added_bboxes) - 1
+
+    def update(self, frame: Frame, raw_trackers: List[Any]) -> List[Tuple[bool, Any]]:
+        if self.added_bboxes:
+            added_bboxes = np.array(self.added_bboxes, dtype=np.float32).reshape(-1, 4)
+            self.bboxes = np.concatenate([self.bboxes, added_bboxes])
+            self.added_bboxes = []
+
+        if len(self.bboxes) == 0 or self.prev_gray is None:
+            return [(False, None) for _ in raw_trackers]
+
+        gray = cv.cvtColor(frame.edge_data, cv.COLOR_BGR2GRAY)
+        ok, displacements = self._track_points(self.prev_gray, gray)
+
+        self.bboxes[ok, 0:2] += displacements[ok]
+        self.prev_gray = gray
+        self.prev_edge_data = frame.edge_data
+
+        return [(bool(ok[idx]), self.bboxes[idx]) for idx in raw_trackers]
+
+    def _set_previous(self, frame: Frame):
+        if self.prev_edge_data is not frame.edge_data:
+            self.prev_gray = cv.cvtColor(frame.edge_data, cv.COLOR_BGR2GRAY)
+            self.prev_edge_data = frame.edge_data
+
+    def _track_points(self, prev_gray, gray) -> Tuple[Any, Any]:
+        num_points = self.grid_size * self.grid_size
+        points = self._sample_points().reshape(-1, 1, 2)
+
+        next_points, status, _ = cv.calcOpticalFlowPyrLK(prev_gray, gray, points, None, **self.lk_params)
+        valid = status.ravel() == 1
+
+        if self.max_fb_error is not None:
+            back_points, back_status, _ = cv.calcOpticalFlowPyrLK(gray, prev_gray, next_points, None,
+                                                                  **self.lk_params)
+            fb_error = np.linalg.norm((points - back_points).reshape(-1, 2), axis=1)
+            valid &= (back_status.ravel() == 1) & (fb_error <= self.max_fb_error)
+
+        valid = valid.reshape(-1, num_points)
+        ok = valid.sum(axis=1) >= self.min_points
+
+        flow = (next_points - points).reshape(-1, num_points, 2)
+        flow[~valid] = np.nan
+        flow[~ok] = 0.0
+        return ok, np.nanmedian(flow, axis=1)
+
+    def _sample_points(self) -> Any:
+        offsets = (np.arange(self.grid_size, dtype=np.float32) + 0.5) / self.grid_size
+        x, y, w, h = [self.bboxes[:, i:i + 1] for i in range(4)]
+        xs = x + w * offsets
+        ys = y + h * offsets
+        grid_x = np.repeat(xs[:, np.newaxis, :], self.grid_size, axis=1)
+        grid_y = np.repeat(ys[:, :, np.newaxis], self.grid_size, axis=2)
+        return np.stack([grid_x, grid_y], axis=-1).astype(np.float32)
+
+
+def _update_all(frame: Frame, raw_trackers: List[Any]) -> List[Tuple[bool, Any]]:
+    return [raw_tracker.update(frame.edge_data) for raw_tracker in raw_trackers]
+
+
+def get_tracker_engine(name: str, num_workers: int = 1) -> TrackerEngine:
+    if name == 'mosse':
+        return MOSSETrackerEngine(num_workers)
+    elif name == 'flow':
+        return OpticalFlowTrackerEngine()
+    else:
+        raise ValueError(f"Unknown tracker engine: {name}")
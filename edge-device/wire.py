@@ -0,0 +1,76 @@
+import numpy as np
+import struct
+from typing import List, Tuple, Union, Any
+
+WIRE_FORMAT_JSON = "json"
+WIRE_FORMAT_BINARY = "vate-bin/1"
+WIRE_FORMATS = [WIRE_FORMAT_JSON, WIRE_FORMAT_BINARY]
+
+MAGIC = b"VATE"
+# Devices ask for a wire format once per connection, in place of a frame, and the edge server acknowledges the
+# format it will answer with. Older edge servers take the hello for a frame and don't acknowledge it.
+HELLO = b"VATE-HELLO "
+HELLO_ACK = b"VATE-ACK "
+VERSION = 1
+HEADER = struct.Struct("<4sBxxxI")
+
+BBOX_DTYPE = np.dtype("<f4")
+SCORE_DTYPE = np.dtype("<i2")
+CATEGORY_DTYPE = np.dtype("<i2")
+
+
+def is_binary(payload) -> bool:
+    return bytes(payload[:len(MAGIC)]) == MAGIC
+
+
+def encode_detections(bboxes, scores, category_ids) -> bytes:
+    num_detections = len(scores)
+    return b"".join([
+        HEADER.pack(MAGIC, VERSION, num_detections),
+        np.asarray(bboxes, dtype=BBOX_DTYPE).reshape(num_detections, 4).tobytes(),
+        np.asarray(scores, dtype=SCORE_DTYPE).tobytes(),
+        np.asarray(category_ids, dtype=CATEGORY_DTYPE).tobytes(),
+    ])
+
+
+def decode_detections(payload) -> Tuple[Any, Any, Any]:
+    buffer = memoryview(payload)
+    magic, version, num_detections = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported wire format: {magic}/{version}")
+
+    offset = HEADER.size
+    bboxes = np.frombuffer(buffer, dtype=BBOX_DTYPE, count=num_detections * 4, offset=offset)
+    offset += bboxes.nbytes
+    scores = np.frombuffer(buffer, dtype=SCORE_DTYPE, count=num_detections, offset=offset)
+    offset += scores.nbytes
+    category_ids = np.frombuffer(buffer, dtype=CATEGORY_DTYPE, count=num_detections, offset=offset)
+
+    return bboxes.reshape(num_detections, 4), scores, category_ids
+
+
+def encode_hello(accepted_formats: List[str]) -> bytes:
+    return HELLO + ",".join(accepted_formats).encode()
+
+
+def decode_hello(payload) -> Union[List[str], None]:
+    payload = bytes(payload[:len(HELLO) + 64])
+    if not payload.startswith(HELLO):
+        return None
+    return payload[len(HELLO):].decode(errors='replace').split(",")
+
+
+def encode_hello_ack(wire_format: str) -> bytes:
+    return HELLO_ACK + wire_format.encode()
+
+
+def decode_hello_ack(payload) -> Union[str, None]:
+    payload = bytes(payload)
+    if not payload.startswith(HELLO_ACK):
+        return None
+    wire_format = payload[len(HELLO_ACK):].decode(errors='replace')
+    return wire_format if wire_format in WIRE_FORMATS else None
+
+
+def negotiate_wire_format(accepted_formats: List[str]) -> str:
+    return WIRE_FORMAT_BINARY if WIRE_FORMAT_BINARY in accepted_formats else WIRE_FORMAT_JSON
@@ -0,0 +1,215 @@
+import time
+import zmq
+from collections import deque
+from multiprocessing import Process
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from edge_server import READY, HEARTBEAT, HEARTBEAT_INTERVAL, empty_response
+from metrics import Metrics
+from model import BrokerRequest
+from wire import WIRE_FORMAT_JSON, decode_hello, encode_hello_ack, negotiate_wire_format
+
+WORKERS_ENDPOINT = "ipc:///tmp/edge-server/workers"
+HEARTBEAT_TIMEOUT = 5 * HEARTBEAT_INTERVAL
+START_TIMEOUT = 60.0
+RESTART_DELAY = 1.0
+MAX_PENDING_REQUESTS = 100
+
+
+class Worker:
+    index: int
+    generation: int
+    identity: bytes
+    process: Union[Process, None]
+    ready: bool
+    last_seen: float
+    restart_at: float
+    outstanding: Dict[bytes, BrokerRequest]
+
+    def __init__(self, index: int):
+        self.index = index
+        self.generation = 0
+        self.identity = b""
+        self.process = None
+        self.ready = False
+        self.last_seen = 0.0
+        self.restart_at = 0.0
+        self.outstanding = dict()
+
+
+class Broker:
+    context: Any
+    frontend: Any
+    backend: Any
+    poller: Any
+
+    worker_target: Callable[..., None]
+    worker_args: Tuple[Any, ...]
+    workers: List[Worker]
+    workers_by_identity: Dict[bytes, Worker]
+    pending: "deque[BrokerRequest]"
+    wire_formats: Dict[Tuple[bytes, ...], str]
+    next_request_id: int
+    metrics: Metrics
+
+    def __init__(self, num_workers: int, worker_target: Callable[..., None], worker_args: Tuple[Any, ...]):
+        self.context = zmq.Context()
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.backend = self.context.socket(zmq.ROUTER)
+        self.poller = zmq.Poller()
+
+        self.worker_target = worker_target
+        self.worker_args = worker_args
+        self.workers = [Worker(index) for index in range(num_workers)]
+        self.workers_by_identity = dict()
+        self.pending = deque()
+        self.wire_formats = dict()
+        self.next_request_id = 0
+        self.metrics = Metrics('vate_edge_server')
+
+        self.metrics.register_gauge('pending_requests', lambda: len(self.pending))
+        for worker in self.workers:
+            worker_metrics = self.metrics.with_labels(worker=str(worker.index))
+            worker_metrics.register_gauge('outstanding_requests', lambda worker=worker: len(worker.outstanding))
+            worker_metrics.register_gauge('worker_ready', lambda worker=worker: int(worker.ready))
+
+    def listen(self, ipc: bool):
+        if ipc:
+            self.frontend.bind("ipc:///tmp/edge-server/0")
+        else:
+            self.frontend.bind("tcp://*:8000")
+        self.backend.bind(WORKERS_ENDPOINT)
+
+        self.poller.register(self.frontend, zmq.POLLIN)
+        self.poller.register(self.backend, zmq.POLLIN)
+
+        for worker in self.workers:
+            self._start_worker(worker)
+
+    def handle_requests(self):
+        while True:
+            sockets = dict(self.poller.poll(int(HEARTBEAT_INTERVAL * 1000)))
+            if self.backend in sockets:
+                self._receive_reply()
+            if self.frontend in sockets:
+                self._receive_request()
+
+            self._check_workers()
+            self._dispatch_requests()
+
+    def close(self):
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.terminate()
+                worker.process.join()
+        self.frontend.close(linger=0)
+        self.backend.close(linger=0)
+        self.context.term()
+
+    def _receive_request(self):
+        parts = self.frontend.recv_multipart()
+        # The wire format is negotiated with each device here, as its requests go to any of the workers.
+        route = tuple(parts[:-1])
+        accepted_formats = decode_hello(parts[-1])
+        if accepted_formats is not None:
+            wire_format = negotiate_wire_format(accepted_formats)
+            self.wire_formats[route] = wire_format
+            self.frontend.send_multipart([*route, encode_hello_ack(wire_format)])
+            return
+
+        request_id = str(self.next_request_id).encode()
+        self.next_request_id += 1
+        request = BrokerRequest(request_id, parts, self.wire_formats.get(route, WIRE_FORMAT_JSON), time.perf_counter())
+        self.metrics.increment('requests')
+        # Requests only wait while no worker is ready, e.g. after all of them died. Devices don't wait for requests
+        # beyond what workers starting up could catch up on.
+        if len(self.pending) >= MAX_PENDING_REQUESTS:
+            self._reply_empty(request)
+            self.metrics.increment('requests_rejected')
+            return
+        self.pending.append(request)
+
+    def _receive_reply(self):
+        parts = self.backend.recv_multipart()
+        worker = self.workers_by_identity.get(parts[0])
+        if worker is None:
+            return
+
+        worker.last_seen = time.time()
+        if parts[1] == READY:
+            print(f"Worker {worker.index} ready")
+            worker.ready = True
+        elif parts[1] == HEARTBEAT:
+            pass
+        else:
+            request = worker.outstanding.pop(parts[1], None)
+            if request is None:
+                return
+            self.frontend.send_multipart(parts[2:])
+            self.metrics.observe('request_seconds', time.perf_counter() - request.received_at)
+
+    def _dispatch_requests(self):
+        while self.pending:
+            ready_workers = [worker for worker in self.workers if worker.ready]
+            if not ready_workers:
+                return
+
+            worker = min(ready_workers, key=lambda ready_worker: len(ready_worker.outstanding))
+            request = self.pending.popleft()
+            worker.outstanding[request.id] = request
+            self.backend.send_multipart([worker.identity, request.id, request.wire_format.encode(), *request.parts])
+
+    def _check_workers(self):
+        now = time.time()
+        for worker in self.workers:
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    self._start_worker(worker)
+            elif not worker.process.is_alive():
+                print(f"Worker {worker.index} died with exit code {worker.process.exitcode}")
+                self._stop_worker(worker)
+            elif worker.ready and now - worker.last_seen > HEARTBEAT_TIMEOUT:
+                print(f"Worker {worker.index} missed its heartbeats")
+                self._stop_worker(worker)
+            elif not worker.ready and now - worker.last_seen > START_TIMEOUT:
+                print(f"Worker {worker.index} didn't get ready")
+                self._stop_worker(worker)
+
+    def _start_worker(self, worker: Worker):
+        worker.generation += 1
+        worker.identity = f"worker-{worker.index}-{worker.generation}".encode()
+        worker.ready = False
+        worker.last_seen = time.time()
+        worker.process = Process(target=self.worker_target,
+                                 args=(WORKERS_ENDPOINT, worker.identity.decode(), *self.worker_args), daemon=True)
+        worker.process.start()
+        self.workers_by_identity[worker.identity] = worker
+
+    def _stop_worker(self, worker: Worker):
+        worker.process.kill()
+        worker.process.join()
+        del self.workers_by_identity[worker.identity]
+
+        worker.process = None
+        worker.ready = False
+        worker.restart_at = time.time() + RESTART_DELAY
+        self.metrics.increment('worker_restarts')
+
+        # Requests the worker didn't answer are handed to the other workers once, oldest first. Requests which another
+        # worker didn't answer either are answered with empty detections, they may be what kills the workers.
+        requests = sorted(worker.outstanding.values(), key=lambda request: request.received_at)
+        worker.outstanding.clear()
+        redispatched = []
+        for request in requests:
+            if request.redispatched:
+                self._reply_empty(request)
+                self.metrics.increment('requests_failed')
+            else:
+                request.redispatched = True
+                redispatched.append(request)
+        self.pending.extendleft(reversed(redispatched))
+        self.metrics.increment('requests_redispatched', len(redispatched))
+
+    def _reply_empty(self, request: BrokerRequest):
+        self.frontend.send_multipart([*request.parts[:-1], empty_response(request.wire_format)])
+        self.metrics.observe('request_seconds', time.perf_counter() - request.received_at)
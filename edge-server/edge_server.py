@@ -1,25 +1,67 @@
+import asyncio
 import time
 import zmq.asyncio
-from typing import List, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Tuple
 
-from model import Detection, DetectionResponse, RawDetection
-from prediction import Predictor
+from metrics import Metrics, SIZE_BUCKETS
+from model import Detection, DetectionResponse, RawDetection, Request
+from prediction import Predictor, to_category_id
+from wire import WIRE_FORMAT_JSON, WIRE_FORMAT_BINARY, encode_detections, decode_hello, encode_hello_ack, \
+    negotiate_wire_format
+
+READY = b"READY"
+HEARTBEAT = b"HEARTBEAT"
+HEARTBEAT_INTERVAL = 1.0
 
 
 class EdgeServer:
     context: Any
     socket: Any
     poll: Any
+    heartbeat: bool
+    brokered: bool
+    wire_formats: Dict[Tuple[bytes, ...], str]
 
     predictor: Predictor
+    batch_size: int
+    batch_wait: float
+    request_timeout: float
+    queue_size: int
+    decode_workers: int
+    encode_workers: int
+
+    decode_executor: ThreadPoolExecutor
+    infer_executor: ThreadPoolExecutor
+    encode_executor: ThreadPoolExecutor
+    decode_queue: "asyncio.Queue[Request]"
+    infer_queue: "asyncio.Queue[Request]"
+    encode_queue: "asyncio.Queue[Tuple[List[Request], List[List[RawDetection]]]]"
+    metrics: Metrics
 
-    def __init__(self, predictor: Predictor):
+    def __init__(self, predictor: Predictor, batch_size: int = 1, batch_wait: float = 0.0,
+                 request_timeout: float = 10.0, queue_size: int = 8, decode_workers: int = 2, encode_workers: int = 1):
         self.context = zmq.asyncio.Context()
-        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket = None
         self.poll = zmq.asyncio.Poller()
+        self.heartbeat = False
+        self.brokered = False
+        self.wire_formats = dict()
         self.predictor = predictor
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.request_timeout = request_timeout
+        self.queue_size = queue_size
+        self.decode_workers = decode_workers
+        self.encode_workers = encode_workers
+
+        self.decode_executor = ThreadPoolExecutor(max_workers=decode_workers)
+        self.infer_executor = ThreadPoolExecutor(max_workers=1)
+        self.encode_executor = ThreadPoolExecutor(max_workers=encode_workers)
+        self.metrics = Metrics('vate_edge_server')
 
     def listen(self, ipc: bool):
+        self.socket = self.context.socket(zmq.ROUTER)
         if ipc:
             self.socket.bind("ipc:///tmp/edge-server/0")
         else:
@@ -27,26 +69,182 @@ class EdgeServer:
 
         self.poll.register(self.socket, zmq.POLLIN)
 
+    def connect(self, endpoint: str, identity: str):
+        # Requests forwarded by a broker start with the broker's request id instead of the device's identity, so
+        # they are handled and answered like requests received directly from devices.
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt_string(zmq.IDENTITY, identity)
+        self.socket.connect(endpoint)
+        self.socket.send(READY)
+        self.heartbeat = True
+        self.brokered = True
+
+        self.poll.register(self.socket, zmq.POLLIN)
+
     async def handle_requests(self):
+        self.decode_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.infer_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.encode_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.metrics.register_gauge('decode_queue_depth', self.decode_queue.qsize)
+        self.metrics.register_gauge('infer_queue_depth', self.infer_queue.qsize)
+        self.metrics.register_gauge('encode_queue_depth', self.encode_queue.qsize)
+
+        stages = [self._decode_stage() for _ in range(self.decode_workers)] + \
+                 [self._infer_stage()] + \
+                 [self._encode_stage() for _ in range(self.encode_workers)]
+        # Stages handle failures of single requests themselves, a stage which still fails ends the server, as
+        # requests would pile up in its queue without ever being answered otherwise.
+        tasks = [asyncio.ensure_future(stage) for stage in stages]
+        try:
+            await asyncio.gather(self._receive_stage(), *tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _receive_stage(self):
+        heartbeat_at = time.time() + HEARTBEAT_INTERVAL
         while True:
             sockets = dict(await self.poll.poll(1000))
             if sockets:
-                await self._handle_request()
+                await self._receive_request()
+
+            if self.heartbeat and time.time() >= heartbeat_at:
+                await self.socket.send(HEARTBEAT)
+                heartbeat_at = time.time() + HEARTBEAT_INTERVAL
+
+    async def _receive_request(self):
+        parts = await self.socket.recv_multipart(copy=False)
+        identity = parts[0].bytes
+        frame = parts[-1]
+        if self.brokered:
+            # The broker negotiates the wire format with the devices and sends it along with every request.
+            wire_format = parts[1].bytes.decode()
+            envelope = [part.bytes for part in parts[2:-1]]
+        else:
+            # Devices multiplexing several streams over one connection prefix requests with routing frames, which are
+            # sent back unchanged in front of the response. The wire format is negotiated for each of these routes.
+            envelope = [part.bytes for part in parts[1:-1]]
+            route = (identity, *envelope)
+            accepted_formats = decode_hello(frame.buffer)
+            if accepted_formats is not None:
+                wire_format = negotiate_wire_format(accepted_formats)
+                self.wire_formats[route] = wire_format
+                print(f"Negotiated wire format {wire_format} with {identity.decode()}")
+                await self.socket.send_multipart([identity, *envelope, encode_hello_ack(wire_format)])
+                return
+            wire_format = self.wire_formats.get(route, WIRE_FORMAT_JSON)
+
+        print(f"Identity: {identity.decode()}")
+
+        self.metrics.increment('requests')
+        await self.decode_queue.put(Request(identity, envelope, wire_format, frame, time.perf_counter(),
+                                            time.time() + self.request_timeout))
+
+    async def _decode_stage(self):
+        event_loop = asyncio.get_event_loop()
+        while True:
+            request = await self.decode_queue.get()
 
-    async def _handle_request(self):
-        identity = await self.socket.recv_string()
+            start = time.perf_counter()
+            try:
+                request.data = await event_loop.run_in_executor(self.decode_executor, self.predictor.decode,
+                                                                request.data)
+            except Exception as e:
+                print(f"Decode failure: {e}")
+                self.metrics.increment('decode_failures')
+                await self.encode_queue.put(([request], [[]]))
+                continue
+            self.metrics.observe('decode_seconds', time.perf_counter() - start)
 
-        print(f"Identity: {identity}")
+            await self.infer_queue.put(request)
 
-        frame = await self.socket.recv(flags=0, copy=False, track=False)
+    async def _infer_stage(self):
+        event_loop = asyncio.get_event_loop()
+        while True:
+            requests = await self._receive_batch()
+            images = [request.data for request in requests]
+            # The batch has to be done in time for the request which has waited the longest.
+            deadline = min(request.deadline for request in requests)
+
+            start_detect = time.perf_counter()
+            try:
+                batch_detections = await event_loop.run_in_executor(self.infer_executor, self._predict, images,
+                                                                    deadline)
+            except Exception as e:
+                print(f"Detect failure: {e}")
+                self.metrics.increment('detect_failures')
+                batch_detections = [[] for _ in images]
+            self.metrics.observe('infer_seconds', time.perf_counter() - start_detect)
+            self.metrics.observe('batch_size', len(images), SIZE_BUCKETS)
+
+            await self.encode_queue.put((requests, batch_detections))
+
+    async def _encode_stage(self):
+        event_loop = asyncio.get_event_loop()
+        while True:
+            requests, batch_detections = await self.encode_queue.get()
+            wire_formats = [request.wire_format for request in requests]
+
+            start = time.perf_counter()
+            try:
+                detection_responses = await event_loop.run_in_executor(self.encode_executor, _encode, wire_formats,
+                                                                       batch_detections)
+            except Exception as e:
+                print(f"Encode failure: {e}")
+                self.metrics.increment('encode_failures')
+                detection_responses = _encode(wire_formats, [[] for _ in requests])
+            self.metrics.observe('encode_seconds', time.perf_counter() - start)
+
+            for request, detection_response in zip(requests, detection_responses):
+                try:
+                    await self.socket.send_multipart([request.identity, *request.envelope, detection_response])
+                except Exception as e:
+                    print(f"Send failure: {e}")
+                    self.metrics.increment('send_failures')
+                    continue
+                self.metrics.observe('request_seconds', time.perf_counter() - request.received_at)
+
+    async def _receive_batch(self) -> List[Request]:
+        requests = [await self.infer_queue.get()]
+
+        deadline = time.time() + self.batch_wait
+        while len(requests) < self.batch_size:
+            if not self.infer_queue.empty():
+                requests.append(self.infer_queue.get_nowait())
+                continue
 
-        start_detect = time.time()
-        detections = self.predictor.get_predictions(frame)
-        detection_response = _to_response(detections)
-        print(f"Detect took: {time.time() - start_detect}")
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(await asyncio.wait_for(self.infer_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
 
-        await self.socket.send_string(identity, zmq.SNDMORE)
-        await self.socket.send_string(detection_response.json())
+        return requests
+
+    def _predict(self, images: List, deadline: float) -> List[List[RawDetection]]:
+        if len(images) == 1:
+            return [self.predictor.get_predictions(images[0], deadline)]
+        return self.predictor.get_predictions_batch(images, deadline)
+
+
+def empty_response(wire_format: str) -> bytes:
+    return _encode([wire_format], [[]])[0]
+
+
+def _encode(wire_formats: List[str], batch_detections: List[List[RawDetection]]) -> List[bytes]:
+    return [_to_binary_response(detections) if wire_format == WIRE_FORMAT_BINARY
+            else _to_response(detections).json().encode()
+            for wire_format, detections in zip(wire_formats, batch_detections)]
+
+
+def _to_binary_response(detections: List[RawDetection]) -> bytes:
+    return encode_detections(
+        bboxes=[detection.bbox for detection in detections],
+        scores=[int(detection.score * 100) for detection in detections],
+        category_ids=[to_category_id(detection.class_name) for detection in detections]
+    )
 
 
 def _to_response(detections: List[RawDetection]) -> DetectionResponse:
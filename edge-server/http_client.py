@@ -0,0 +1,58 @@
+import concurrent.futures
+import requests
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import Dict
+from urllib3 import Timeout
+
+CONNECT_TIMEOUT = 1.0
+
+
+class HttpClient:
+    session: requests.Session
+    adapter: HTTPAdapter
+    executor: ThreadPoolExecutor
+
+    def __init__(self, max_connections: int = 4):
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_connections)
+
+    def get(self, url: str, data: bytes, deadline: float) -> requests.Response:
+        return self._send(url, data, deadline)
+
+    def get_async(self, url: str, data: bytes, deadline: float) -> "Future[requests.Response]":
+        return self.executor.submit(self._send, url, data, deadline)
+
+    def wait(self, response: "Future[requests.Response]", deadline: float) -> requests.Response:
+        # Requests which are already being sent can't be cancelled, they time out at the deadline on their own.
+        try:
+            return response.result(timeout=max(deadline - time.time(), 0))
+        except concurrent.futures.TimeoutError:
+            response.cancel()
+            raise requests.exceptions.Timeout("Deadline exceeded waiting for response")
+
+    def _send(self, url: str, data: bytes, deadline: float) -> requests.Response:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            raise requests.exceptions.Timeout(f"Deadline exceeded before sending request to {url}")
+
+        # The timeout of requests applies to connecting and to each read separately, the total keeps the whole request
+        # within the deadline. Connections of timed out requests are closed instead of going back to the pool.
+        return self.session.get(url, data=data, timeout=Timeout(connect=min(CONNECT_TIMEOUT, timeout), read=timeout,
+                                                                total=timeout))
+
+    def stats(self) -> Dict[str, int]:
+        pool_container = self.adapter.poolmanager.pools
+        pools = [pool_container.get(key) for key in pool_container.keys()]
+        pools = [pool for pool in pools if pool is not None]
+        num_requests = sum(pool.num_requests for pool in pools)
+        num_connections = sum(pool.num_connections for pool in pools)
+        return dict(requests=num_requests, connections=num_connections, reused=num_requests - num_connections)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
@@ -21,8 +21,12 @@ class JetsonPredictor:
         self.input_width = input_width
         self.input_height = input_height
 
-    def get_predictions(self, frame) -> List[RawDetection]:
-        detections = self._run_inference(frame)
+    def decode(self, frame) -> Any:
+        image = np.frombuffer(frame, dtype=np.uint8)
+        return cv.imdecode(image, cv.IMREAD_COLOR)
+
+    def get_predictions(self, image, deadline: float) -> List[RawDetection]:
+        detections = self._run_inference(image)
 
         return [RawDetection(
             class_name=to_category_name(detection.ClassID - 1),
@@ -30,12 +34,12 @@ class JetsonPredictor:
             bbox=[detection.Left, detection.Top, detection.Right, detection.Bottom]
         ) for detection in detections]
 
+    def get_predictions_batch(self, images: List, deadline: float) -> List[List[RawDetection]]:
+        return [self.get_predictions(image, deadline) for image in images]
+
     def _run_inference(self, image):
         start = time.time()
 
-        image = np.frombuffer(image, dtype=np.uint8)
-        image = cv.imdecode(image, cv.IMREAD_COLOR)
-
         original_height, original_width, _ = image.shape
         image = cv.resize(image, (self.input_width, self.input_height), interpolation=cv.INTER_LINEAR)
 
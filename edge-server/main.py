@@ -1,22 +1,79 @@
 import argparse
 import asyncio
+import signal
+import sys
+from typing import Union, Tuple, Any
 
+from broker import Broker
 from edge_server import EdgeServer
+from http_client import HttpClient
+from metrics import start_metrics_server
 from services import get_predictor
 
 
-def main(ipc: bool, jetson: bool):
-    print(f"Got: ipc={ipc}, jetson={jetson}")
+def main(ipc: bool, jetson: bool, batch_size: int, batch_wait_ms: int, request_timeout_ms: int, queue_size: int,
+         metrics_port: Union[int, None], metrics_snapshot: str, workers: int):
+    print(f"Got: ipc={ipc}, jetson={jetson}, batch-size={batch_size}, batch-wait-ms={batch_wait_ms}, "
+          f"request-timeout-ms={request_timeout_ms}, queue-size={queue_size}, metrics-port={metrics_port}, "
+          f"metrics-snapshot={metrics_snapshot}, workers={workers}")
 
-    predictor = get_predictor(jetson)
-    edge_server = EdgeServer(predictor)
+    if workers > 0:
+        run_broker(ipc, workers, (jetson, batch_size, batch_wait_ms, request_timeout_ms, queue_size), metrics_port,
+                   metrics_snapshot)
+        return
+
+    http_client = HttpClient(max_connections=max(batch_size, 1))
+    predictor = get_predictor(jetson, http_client)
+    edge_server = EdgeServer(predictor, batch_size=batch_size, batch_wait=batch_wait_ms / 1000,
+                             request_timeout=request_timeout_ms / 1000, queue_size=queue_size)
+    edge_server.metrics.register_gauge('http_requests', lambda: http_client.stats()['requests'])
+    edge_server.metrics.register_gauge('http_connections', lambda: http_client.stats()['connections'])
     edge_server.listen(ipc)
+    metrics_server = start_metrics_server(edge_server.metrics, metrics_port)
 
-    event_loop = asyncio.get_event_loop()
-    event_loop.run_until_complete(edge_server.handle_requests())
+    try:
+        event_loop = asyncio.get_event_loop()
+        event_loop.run_until_complete(edge_server.handle_requests())
+
+        pending = asyncio.Task.all_tasks()
+        event_loop.run_until_complete(asyncio.gather(*pending))
+    finally:
+        print(f"Writing metrics snapshot to {metrics_snapshot}")
+        edge_server.metrics.write_snapshot(metrics_snapshot)
+        if metrics_server is not None:
+            metrics_server.stop()
+
+
+def run_broker(ipc: bool, workers: int, worker_args: Tuple[Any, ...], metrics_port: Union[int, None],
+               metrics_snapshot: str):
+    # Stopping the broker stops its workers, which needs the finally block below to run on SIGTERM as well.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-    pending = asyncio.Task.all_tasks()
-    event_loop.run_until_complete(asyncio.gather(*pending))
+    broker = Broker(workers, run_worker, worker_args)
+    broker.listen(ipc)
+    metrics_server = start_metrics_server(broker.metrics, metrics_port)
+
+    try:
+        broker.handle_requests()
+    finally:
+        broker.close()
+        print(f"Writing metrics snapshot to {metrics_snapshot}")
+        broker.metrics.write_snapshot(metrics_snapshot)
+        if metrics_server is not None:
+            metrics_server.stop()
+
+
+def run_worker(endpoint: str, identity: str, jetson: bool, batch_size: int, batch_wait_ms: int,
+               request_timeout_ms: int, queue_size: int):
+    http_client = HttpClient(max_connections=max(batch_size, 1))
+    predictor = get_predictor(jetson, http_client)
+    edge_server = EdgeServer(predictor, batch_size=batch_size, batch_wait=batch_wait_ms / 1000,
+                             request_timeout=request_timeout_ms / 1000, queue_size=queue_size)
+    edge_server.connect(endpoint, identity)
+
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    event_loop.run_until_complete(edge_server.handle_requests())
 
 
 if __name__ == '__main__':
@@ -24,7 +81,18 @@ if __name__ == '__main__':
     parser.add_argument('--ipc', action='store_true')
     parser.add_argument('--jetson', action='store_true')
     parser.add_argument('--no-jetson', dest='jetson', action='store_false')
+    parser.add_argument('--batch-size', type=int, default=1, help="max number of frames per inference call")
+    parser.add_argument('--batch-wait-ms', type=int, default=0, help="max time to wait for a batch to fill up")
+    parser.add_argument('--request-timeout-ms', type=int, default=10000,
+                        help="max time from receiving a request until its detections are ready")
+    parser.add_argument('--queue-size', type=int, default=8, help="max number of requests waiting in each stage")
+    parser.add_argument('--metrics-port', type=int, help="port serving metrics in Prometheus text format")
+    parser.add_argument('--metrics-snapshot', default='edge_server_metrics.json',
+                        help="file the metrics are written to at shutdown")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="number of worker processes behind a broker, 0 runs the predictor in this process")
     parser.set_defaults(ipc=False, jetson=True)
     args = parser.parse_args()
 
-    main(args.ipc, args.jetson)
+    main(args.ipc, args.jetson, args.batch_size, args.batch_wait_ms, args.request_timeout_ms, args.queue_size,
+         args.metrics_port, args.metrics_snapshot, args.workers)
@@ -0,0 +1,215 @@
+import bisect
+import copy
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Callable, List, Set, Tuple, Union
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5,
+                   5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+BYTE_BUCKETS = (1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000, 2500000, 5000000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    buckets: Tuple[float, ...]
+    counts: List[int]
+    count: int
+    sum: float
+    min: float
+    max: float
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.count == 1 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[idx - 1] if idx > 0 else 0.0
+                upper = self.buckets[idx] if idx < len(self.buckets) else self.max
+                return max(min(lower + (upper - lower) * (rank - seen) / count, self.max), self.min)
+            seen += count
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(count=self.count, sum=round(self.sum, 6), mean=round(self.sum / self.count, 6) if self.count else 0,
+                    min=round(self.min, 6), max=round(self.max, 6), p10=round(self.quantile(0.1), 6),
+                    p50=round(self.quantile(0.5), 6), p90=round(self.quantile(0.9), 6),
+                    p99=round(self.quantile(0.99), 6))
+
+
+class Timer:
+    metrics: "Metrics"
+    name: str
+    start: float
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    namespace: str
+    labels: Labels
+    lock: threading.Lock
+    histograms: Dict[Tuple[str, Labels], Histogram]
+    counters: Dict[Tuple[str, Labels], float]
+    gauges: Dict[Tuple[str, Labels], Callable[[], float]]
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self.labels = ()
+        self.lock = threading.Lock()
+        self.histograms = dict()
+        self.counters = dict()
+        self.gauges = dict()
+
+    def with_labels(self, **labels: str) -> "Metrics":
+        metrics = copy.copy(self)
+        metrics.labels = tuple(sorted({**dict(self.labels), **labels}.items()))
+        return metrics
+
+    def timer(self, name: str) -> Timer:
+        return Timer(self, name)
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        with self.lock:
+            histogram = self.histograms.get((name, self.labels))
+            if histogram is None:
+                histogram = self.histograms[(name, self.labels)] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[(name, self.labels)] = self.counters.get((name, self.labels), 0) + value
+
+    def register_gauge(self, name: str, value: Callable[[], float]):
+        self.gauges[(name, self.labels)] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(
+                histograms={_key(*key): histogram.snapshot() for key, histogram in sorted(self.histograms.items())},
+                counters={_key(*key): value for key, value in sorted(self.counters.items())},
+                gauges={_key(*key): value() for key, value in sorted(self.gauges.items())}
+            )
+
+    def to_prometheus(self) -> str:
+        lines = []
+        typed = set()
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{self.namespace}_{name}"
+                _append_type(lines, typed, metric, 'histogram')
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{_format_labels(labels, le=str(bucket))} {cumulative}')
+                lines.append(f'{metric}_bucket{_format_labels(labels, le="+Inf")} {histogram.count}')
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{self.namespace}_{name}_total"
+                _append_type(lines, typed, metric, 'counter')
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+        for (name, labels), value in sorted(self.gauges.items()):
+            metric = f"{self.namespace}_{name}"
+            _append_type(lines, typed, metric, 'gauge')
+            lines.append(f"{metric}{_format_labels(labels)} {value()}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+class MetricsServer:
+    server: ThreadingHTTPServer
+    thread: threading.Thread
+
+    def __init__(self, metrics: Metrics, port: int):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ['/', '/metrics']:
+                    self.send_error(404)
+                    return
+
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_metrics_server(metrics: Metrics, port: Union[int, None]) -> Union[MetricsServer, None]:
+    if port is None:
+        return None
+
+    metrics_server = MetricsServer(metrics, port)
+    metrics_server.start()
+    print(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    return metrics_server
+
+
+def _key(name: str, labels: Labels) -> str:
+    return f"{name}{_format_labels(labels)}"
+
+
+def _format_labels(labels: Labels, **extra: str) -> str:
+    labels = labels + tuple(extra.items())
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _append_type(lines: List[str], typed: Set[str], metric: str, metric_type: str):
+    if metric not in typed:
+        typed.add(metric)
+        lines.append(f"# TYPE {metric} {metric_type}")
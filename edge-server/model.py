@@ -1,6 +1,25 @@
 from dataclasses import dataclass
 from pydantic import BaseModel
-from typing import List
+from typing import List, Any
+
+
+@dataclass
+class Request:
+    identity: bytes
+    envelope: List[bytes]
+    wire_format: str
+    data: Any
+    received_at: float
+    deadline: float
+
+
+@dataclass
+class BrokerRequest:
+    id: bytes
+    parts: List[bytes]
+    wire_format: str
+    received_at: float
+    redispatched: bool = False
 
 
 @dataclass
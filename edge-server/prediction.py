@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Any
 from typing_extensions import Protocol
 
 from model import RawDetection
@@ -15,12 +15,23 @@ CATEGORIES = [
     {"id": 8, "name": "bus"},
     {"id": 9, "name": "motor"}
 ]
+CATEGORY_IDS = {category["name"]: category["id"] for category in CATEGORIES}
 
 
 class Predictor(Protocol):
-    def get_predictions(self, frame) -> List[RawDetection]:
+    def decode(self, frame) -> Any:
         ...
 
+    def get_predictions(self, image, deadline: float) -> List[RawDetection]:
+        ...
+
+    def get_predictions_batch(self, images: List, deadline: float) -> List[List[RawDetection]]:
+        ...
+
+
+def to_category_id(category_name: str) -> int:
+    return CATEGORY_IDS[category_name]
+
 
 def to_category_name(category_id: int) -> str:
     category = next(filter(lambda cat: cat["id"] == category_id, CATEGORIES))
@@ -1,8 +1,9 @@
+from http_client import HttpClient
 from prediction import Predictor
 from torch_serve_prediction import TorchServePredictor
 
 
-def get_predictor(jetson: bool) -> Predictor:
+def get_predictor(jetson: bool, http_client: HttpClient) -> Predictor:
     if jetson:
         from jetson_prediction import JetsonPredictor
         return JetsonPredictor(
@@ -15,5 +16,5 @@ def get_predictor(jetson: bool) -> Predictor:
     else:
         return TorchServePredictor(
             detection_model_url="http://127.0.0.1:9090/predictions/mobilenetv2_ssd_visdrone",
-            detection_timeout=10
+            http_client=http_client
         )
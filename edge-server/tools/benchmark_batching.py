@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import List, Any
+
+import zmq
+
+sys.path.append('..')
+
+from broker import Broker
+from edge_server import EdgeServer
+from model import RawDetection
+
+DETECTIONS = [RawDetection(class_name='car', score=0.9, bbox=[10.0, 20.0, 50.0, 60.0])] * 100
+
+
+class SimulatedPredictor:
+    base_latency: float
+    frame_latency: float
+
+    def __init__(self, base_latency: float, frame_latency: float):
+        self.base_latency = base_latency
+        self.frame_latency = frame_latency
+
+    def decode(self, frame) -> Any:
+        return frame
+
+    def get_predictions(self, image, deadline: float) -> List[RawDetection]:
+        return self.get_predictions_batch([image], deadline)[0]
+
+    def get_predictions_batch(self, images: List, deadline: float) -> List[List[RawDetection]]:
+        time.sleep(self.base_latency + self.frame_latency * len(images))
+        return [DETECTIONS for _ in images]
+
+
+def run_server(edge_server: EdgeServer):
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    event_loop.run_until_complete(edge_server.handle_requests())
+
+
+def run_worker(endpoint: str, identity: str, batch_size: int, batch_wait_ms: int, base_latency_ms: float,
+               frame_latency_ms: float):
+    predictor = SimulatedPredictor(base_latency_ms / 1000, frame_latency_ms / 1000)
+    edge_server = EdgeServer(predictor, batch_size=batch_size, batch_wait=batch_wait_ms / 1000)
+    edge_server.connect(endpoint, identity)
+    run_server(edge_server)
+
+
+def run_device(device_id: int, num_requests: int, latencies: List[float]):
+    context = zmq.Context.instance()
+    socket = context.socket(zmq.DEALER)
+    socket.setsockopt_string(zmq.IDENTITY, f"benchmark-{device_id}")
+    socket.connect("ipc:///tmp/edge-server/0")
+
+    frame = os.urandom(30_000)
+    for _ in range(num_requests):
+        start = time.perf_counter()
+        socket.send(frame)
+        socket.recv()
+        latencies.append(time.perf_counter() - start)
+
+    socket.close()
+
+
+def main(num_devices: int, num_requests: int, batch_size: int, batch_wait_ms: int, base_latency_ms: float,
+         frame_latency_ms: float, num_workers: int):
+    os.makedirs("/tmp/edge-server", exist_ok=True)
+
+    if num_workers > 0:
+        broker = Broker(num_workers, run_worker, (batch_size, batch_wait_ms, base_latency_ms, frame_latency_ms))
+        broker.listen(ipc=True)
+        threading.Thread(target=broker.handle_requests, daemon=True).start()
+    else:
+        predictor = SimulatedPredictor(base_latency_ms / 1000, frame_latency_ms / 1000)
+        edge_server = EdgeServer(predictor, batch_size=batch_size, batch_wait=batch_wait_ms / 1000)
+        edge_server.listen(ipc=True)
+        threading.Thread(target=run_server, args=(edge_server,), daemon=True).start()
+
+    latencies: List[float] = []
+    devices = [threading.Thread(target=run_device, args=(device_id, num_requests, latencies))
+               for device_id in range(num_devices)]
+
+    start = time.perf_counter()
+    for device in devices:
+        device.start()
+    for device in devices:
+        device.join()
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    print(f"devices={num_devices}, batch-size={batch_size}, batch-wait-ms={batch_wait_ms}, workers={num_workers}")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} frames/s")
+    print(f"Latency: mean {statistics.mean(latencies_ms):.1f}ms, "
+          f"p50 {latencies_ms[len(latencies_ms) // 2]:.1f}ms, "
+          f"p95 {latencies_ms[int(len(latencies_ms) * 0.95)]:.1f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--batch-wait-ms', type=int, default=0)
+    parser.add_argument('--base-latency-ms', type=float, default=20.0, help="simulated fixed cost of a model call")
+    parser.add_argument('--workers', type=int, default=0, help="number of worker processes behind a broker")
+    parser.add_argument('--frame-latency-ms', type=float, default=4.0, help="simulated cost per frame in a batch")
+    args = parser.parse_args()
+
+    main(args.devices, args.requests, args.batch_size, args.batch_wait_ms, args.base_latency_ms,
+         args.frame_latency_ms, args.workers)
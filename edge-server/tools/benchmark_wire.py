@@ -0,0 +1,91 @@
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+sys.path.append('..')
+
+from edge_server import _to_response, _to_binary_response
+from model import RawDetection
+from prediction import CATEGORIES, to_category_name
+from wire import decode_detections
+
+
+@dataclass
+class DeviceDetection:
+    category: str
+    score: int
+    bbox: List[float]
+
+
+def create_detections(num_detections: int, seed: int) -> List[RawDetection]:
+    rand = random.Random(seed)
+    detections = []
+    for _ in range(num_detections):
+        x = rand.uniform(0, 600)
+        y = rand.uniform(0, 480)
+        detections.append(RawDetection(
+            class_name=rand.choice(CATEGORIES)["name"],
+            score=rand.random(),
+            bbox=[x, y, x + rand.uniform(5, 40), y + rand.uniform(5, 40)]
+        ))
+    return detections
+
+
+def json_round_trip(detections: List[RawDetection]) -> List[DeviceDetection]:
+    response = _to_response(detections).json().encode()
+
+    body = json.loads(response)
+    return [DeviceDetection(detection['category'], detection['score'], _xyxy2xywh(detection['bbox']))
+            for detection in body['detections']]
+
+
+def binary_round_trip(detections: List[RawDetection]) -> List[DeviceDetection]:
+    response = _to_binary_response(detections)
+
+    bboxes, scores, category_ids = decode_detections(response)
+    bboxes = bboxes.astype(np.float64)
+    bboxes[:, 2:4] -= bboxes[:, 0:2]
+    return [DeviceDetection(to_category_name(category_id), score, bbox)
+            for bbox, score, category_id in zip(bboxes.tolist(), scores.tolist(), category_ids.tolist())]
+
+
+def _xyxy2xywh(bbox: List[float]) -> List[float]:
+    return [bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]]
+
+
+def measure(round_trip, detections: List[RawDetection], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        round_trip(detections)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(detection_counts: List[int], repeat: int, seed: int):
+    print(f"{'detections':>10}{'json (ms)':>12}{'binary (ms)':>14}{'json (B)':>10}{'binary (B)':>12}")
+    for num_detections in detection_counts:
+        detections = create_detections(num_detections, seed)
+        json_time = measure(json_round_trip, detections, repeat)
+        binary_time = measure(binary_round_trip, detections, repeat)
+        json_size = len(_to_response(detections).json().encode())
+        binary_size = len(_to_binary_response(detections))
+        print(f"{num_detections:>10}{json_time * 1000:>12.3f}{binary_time * 1000:>14.3f}"
+              f"{json_size:>10}{binary_size:>12}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--detections', nargs='+', type=int, default=[10, 100, 300, 1000])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.detections, args.repeat, args.seed)
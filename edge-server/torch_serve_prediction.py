@@ -1,33 +1,44 @@
 import numpy as np
-import requests
 import time
-from typing import List
+from typing import List, Any
 
+from http_client import HttpClient
 from model import RawDetection
 
 
 class TorchServePredictor:
     detection_model_url: str
-    detection_timeout: int
+    http_client: HttpClient
 
-    def __init__(self, detection_model_url: str, detection_timeout: int):
+    def __init__(self, detection_model_url: str, http_client: HttpClient):
         self.detection_model_url = detection_model_url
-        self.detection_timeout = detection_timeout
+        self.http_client = http_client
 
-    def get_predictions(self, frame) -> List[RawDetection]:
-        start = time.time()
+    def decode(self, frame) -> Any:
+        return np.frombuffer(frame, dtype=np.uint8).tobytes()
 
-        image = np.frombuffer(frame, dtype=np.uint8).tobytes()
+    def get_predictions(self, image, deadline: float) -> List[RawDetection]:
+        start = time.time()
 
-        response = requests.get(self.detection_model_url, data=image, timeout=self.detection_timeout)
+        response = self.http_client.get(self.detection_model_url, data=image, deadline=deadline)
         body = response.json()
         print(f"Num detections: {len(body)}")
 
         end = time.time()
         print(f"Detection request took: {end - start}s")
 
-        return [RawDetection(
-            class_name=detection['class_name'],
-            score=detection['score'],
-            bbox=detection['bbox']
-        ) for detection in body]
+        return _to_raw_detections(body)
+
+    def get_predictions_batch(self, images: List, deadline: float) -> List[List[RawDetection]]:
+        # Concurrent requests let TorchServe aggregate them into one batch on the server side
+        responses = [self.http_client.get_async(self.detection_model_url, data=image, deadline=deadline)
+                     for image in images]
+        return [_to_raw_detections(self.http_client.wait(response, deadline).json()) for response in responses]
+
+
+def _to_raw_detections(body) -> List[RawDetection]:
+    return [RawDetection(
+        class_name=detection['class_name'],
+        score=detection['score'],
+        bbox=detection['bbox']
+    ) for detection in body]